@@ -0,0 +1,160 @@
+import os
+import re
+import time
+
+from Solver import *
+from BitBoard import BOARD_CLASSES
+from SolutionCache import *
+from ProblemDatabase import *
+from Tablebase import TablebaseSet
+
+# Etude file names start with their stipulation, e.g. mate_in_3_2012.txt or
+# helpmate_in_2_2011_2_solutions.txt, where the last part is the number of helpmate solutions.
+ETUDE_FILENAME_PATTERN = re.compile(r"^(?P<stipulation>mate_in_\d+|selfmate_in_2|helpmate_in_2)"
+                                    r"(?:_.*?)?(?:_(?P<num_solutions>\d+)_solutions)?\.txt$")
+
+STIPULATION_TO_TYPE = {"selfmate_in_2": "selfmate", "helpmate_in_2": "helpmate"}
+
+
+def infer_problem(input_filename):
+    """
+    Returns (etude type as accepted by solve.py -t, number of solutions) from the file name,
+    or (None, None) when it doesn't follow the etudes naming.
+    """
+    match = ETUDE_FILENAME_PATTERN.match(os.path.basename(input_filename))
+    if match is None:
+        return None, None
+    stipulation = match.group("stipulation")
+    num_solutions = int(match.group("num_solutions") or 1)
+    return STIPULATION_TO_TYPE.get(stipulation, stipulation), num_solutions
+
+def make_problem(input_filename, type=None, num_solutions=None):
+    inferred_type, inferred_num_solutions = infer_problem(input_filename)
+    return {"input_filename": input_filename,
+            "type": type or inferred_type,
+            "num_solutions": num_solutions or inferred_num_solutions or 1}
+
+def read_problems(path, type=None):
+    """
+    Problems of every .txt file in a directory, of every line of a manifest file, or of every record of
+    a problem database, which are read lazily. Only those of type, when given.
+    A manifest line is: <etude file> [<type> [<number of solutions>]], with paths relative to the manifest.
+    Blank lines and lines starting with # are ignored.
+    """
+    if is_problem_database(path):
+        database = open_problem_database(path)
+        return (database.get_problem(i) for i in database.iter_records(type))
+    if os.path.isdir(path):
+        problems = [make_problem(os.path.join(path, filename))
+                    for filename in sorted(os.listdir(path)) if filename.endswith(".txt")]
+        return [problem for problem in problems if type is None or problem["type"] == type]
+    problems = []
+    for line in open(path).readlines():
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        input_filename = os.path.join(os.path.dirname(path), fields[0])
+        problem_type = fields[1] if len(fields) > 1 else None
+        num_solutions = int(fields[2]) if len(fields) > 2 else None
+        problems.append(make_problem(input_filename, problem_type, num_solutions))
+    return [problem for problem in problems if type is None or problem["type"] == type]
+
+def read_problem_board(problem, turn, board_class=None):
+    """
+    Board of a problem of read_problems: the record of a problem database, or an etude file read
+    with turn to move. A problem may also give its position as a FEN, in place of input_filename.
+    """
+    if "fen" in problem:
+        return fen_to_board(problem["fen"], board_class)
+    if "record" in problem:
+        return open_problem_database(problem["input_filename"]).get_board(problem["record"], board_class)
+    return read_board(problem["input_filename"], turn, board_class)
+
+def mate_solution_to_json(solution, board):
+    """
+    JSON-ready solution tree of a MateSolution, with moves in algebraic notation.
+    """
+    json_solution = {"move": get_move_string(solution.move, board, not solution.defences), "defences": []}
+    board.push(solution.move)
+    for defence, defence_solution in solution.defences.iteritems():
+        defence_string = get_move_string(defence, board)
+        board.push(defence)
+        json_solution["defences"].append({"defence": defence_string,
+                                          "solution": mate_solution_to_json(defence_solution, board)})
+        board.pop()
+    board.pop()
+    return json_solution
+
+def selfmate_solution_to_json(step1, solutions_dict, board):
+    json_solution = {"move": get_move_string(step1, board), "defences": []}
+    board.push(step1)
+    for step2, step3 in solutions_dict.iteritems():
+        defence_string = get_move_string(step2, board)
+        board.push(step2)
+        json_solution["defences"].append({"defence": defence_string,
+                                          "solution": {"move": get_move_string(step3, board)}})
+        board.pop()
+    board.pop()
+    return json_solution
+
+def solve_problem(problem):
+    """
+    Solves one problem quietly and returns its JSON-ready result: the key, the solution tree
+    (or the helpmate solutions), the number of nodes searched and the wall time.
+    Goes through the solution cache in the problem's cache_filename, when it has one, and probes the
+    endgame tablebases of its tablebase_dir in a mate-in-N search.
+    """
+    result = dict(problem)
+    type = problem["type"]
+    board_class = BOARD_CLASSES[problem.get("board", "mailbox")]
+    cache = SolutionCache(problem["cache_filename"]) if problem.get("cache_filename") else None
+    start_time = time.time()
+    try:
+        if type == "helpmate":
+            board = read_problem_board(problem, BLACK, board_class)
+            search = lambda: solve_helpmate_in_two(board, problem["num_solutions"], verbose=False)
+            if cache is None:
+                solutions = search()
+            else:
+                solutions = solve_helpmate_in_two_cached(cache, board, problem["num_solutions"], search, False)
+            result["nodes"] = board.num_nodes
+            result["solved"] = len(solutions) == problem["num_solutions"]
+            result["solutions"] = solutions
+        elif type == "selfmate":
+            board = read_problem_board(problem, WHITE, board_class)
+            search = lambda: solve_selfmate_in_two(board, verbose=False)
+            if cache is None:
+                selfmate_solution = search()
+            else:
+                selfmate_solution = solve_selfmate_in_two_cached(cache, board, search, False)
+            result["nodes"] = board.num_nodes
+            result["solved"] = selfmate_solution is not None
+            if selfmate_solution is not None:
+                result["key"] = get_move_string(selfmate_solution[0], board)
+                result["solution"] = selfmate_solution_to_json(selfmate_solution[0], selfmate_solution[1], board)
+        elif get_mate_in_n(type) is not None:
+            board = read_problem_board(problem, WHITE, board_class)
+            n = get_mate_in_n(type)
+            tablebases = TablebaseSet(problem["tablebase_dir"]) if problem.get("tablebase_dir") else None
+            search = lambda transposition_table: solve_mate_in_n(board, n, False, transposition_table,
+                                                                 tablebases=tablebases)
+            if cache is None:
+                solution = search(None)
+            else:
+                solution = solve_mate_in_n_cached(cache, board, n, search, False)
+            result["nodes"] = board.num_nodes
+            result["solved"] = solution is not None
+            if solution is not None:
+                result["key"] = get_move_string(solution.move, board)
+                result["solution"] = mate_solution_to_json(solution, board)
+            if tablebases is not None:
+                tablebases.close()
+        else:
+            raise ValueError("Invalid etude type: {}".format(type))
+    except Exception, e:
+        result["error"] = "{}: {}".format(e.__class__.__name__, e)
+    result["wall_time"] = time.time() - start_time
+    if cache is not None:
+        result["cache_hits"] = cache.hits
+        cache.close()
+    return result
@@ -0,0 +1,303 @@
+from Solver import *
+
+# Bit index of every board square in a 64-bit bitboard: a1 is bit 0, h1 is 7, a8 is 56 and h8 is 63.
+# Bits go up with the mailbox squares, so a positive mailbox direction is a direction of higher bits.
+SQUARE_TO_BIT = [None] * MAILBOX_SIZE
+for _bit, _square in enumerate(SQUARES):
+    SQUARE_TO_BIT[_square] = _bit
+BIT_TO_SQUARE = SQUARES
+
+def bit_mask(square):
+    return 1 << SQUARE_TO_BIT[square]
+
+SQUARE_MASKS = [bit_mask(square) if SQUARE_TO_BIT[square] is not None else 0 for square in xrange(MAILBOX_SIZE)]
+
+def get_step_attacks(steps):
+    # Squares reached from every square by one of steps, as bitboards indexed by bit.
+    return [sum(bit_mask(square + step) for step in steps if SQUARE_TO_BIT[square + step] is not None)
+            for square in SQUARES]
+
+def get_ray(square, direction):
+    # Squares from square (excluded) to the edge of the board along direction.
+    ray = 0
+    square += direction
+    while SQUARE_TO_BIT[square] is not None:
+        ray |= bit_mask(square)
+        square += direction
+    return ray
+
+# Attack tables, built once at import.
+KNIGHT_ATTACKS = get_step_attacks(KNIGHT_JUMPS)
+KING_ATTACKS = get_step_attacks(KING_STEPS)
+# PAWN_ATTACKS[player][bit]: squares a pawn of player on bit attacks.
+PAWN_ATTACKS = [get_step_attacks([PAWN_FORWARD[player] - 1, PAWN_FORWARD[player] + 1]) for player in PLAYERS]
+# PAWN_ATTACKERS[player][bit]: squares a pawn of player attacks bit from.
+PAWN_ATTACKERS = [PAWN_ATTACKS[next_turn(player)] for player in PLAYERS]
+# RAYS[direction][bit] for every queen direction, and every rook and bishop ray of a square together.
+RAYS = dict((direction, [get_ray(square, direction) for square in SQUARES]) for direction in QUEEN_DIRECTIONS)
+ROOK_RAYS = [sum(RAYS[direction][bit] for direction in ROOK_DIRECTIONS) for bit in xrange(len(SQUARES))]
+BISHOP_RAYS = [sum(RAYS[direction][bit] for direction in BISHOP_DIRECTIONS) for bit in xrange(len(SQUARES))]
+
+PAWN_FORWARD_BITS = [-8, 8] # Indexed by player.
+
+def lowest_bit(bitboard):
+    return (bitboard & -bitboard).bit_length() - 1
+
+def highest_bit(bitboard):
+    return bitboard.bit_length() - 1
+
+def iter_bits(bitboard):
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+def get_slider_attacks(bit, directions, occupied):
+    """
+    Squares a slider on bit attacks along directions: every ray up to and including its first blocker.
+    """
+    attacks = 0
+    for direction in directions:
+        ray = RAYS[direction][bit]
+        blockers = ray & occupied
+        if blockers:
+            blocker = lowest_bit(blockers) if direction > 0 else highest_bit(blockers)
+            ray ^= RAYS[direction][blocker]
+        attacks |= ray
+    return attacks
+
+def is_slider_attacking(bit, directions, occupied, sliders):
+    # Whether the first piece along one of directions from bit is one of sliders.
+    for direction in directions:
+        blockers = RAYS[direction][bit] & occupied
+        if blockers:
+            blocker = lowest_bit(blockers) if direction > 0 else highest_bit(blockers)
+            if sliders >> blocker & 1:
+                return True
+    return False
+
+SLIDER_DIRECTIONS = {BISHOP_CODE: BISHOP_DIRECTIONS, ROOK_CODE: ROOK_DIRECTIONS, QUEEN_CODE: QUEEN_DIRECTIONS}
+
+
+class BitBoard(Board):
+    """
+    Board whose move generation and check tests run on 64-bit bitboards: one per piece code
+    (pieces[code]) and one per player (occupancy[player]). Knight, king and pawn moves come from
+    attack tables and slider moves from ray tables.
+
+    The mailbox squares are kept up to date alongside the bitboards, so a BitBoard can be used
+    anywhere a Board is, and the two can be cross-checked on the same positions.
+    """
+
+    def __init__(self, state, turn):
+        Board.__init__(self, state, turn)
+        self.compute_bitboards()
+
+    @classmethod
+    def from_squares(cls, squares, turn):
+        board = super(BitBoard, cls).from_squares(squares, turn)
+        board.compute_bitboards()
+        return board
+
+    def compute_bitboards(self):
+        self.pieces = [0] * (2 * BLACK_BIT)
+        self.occupancy = [0, 0]
+        for square in SQUARES:
+            code = self.squares[square]
+            if code != EMPTY_CODE:
+                self.pieces[code] |= bit_mask(square)
+                self.occupancy[code_to_player(code)] |= bit_mask(square)
+
+    def is_square_attacked(self, square, player):
+        bit = SQUARE_TO_BIT[square]
+        pieces = self.pieces
+        player_bits = PLAYER_BITS[player]
+        if KNIGHT_ATTACKS[bit] & pieces[KNIGHT_CODE | player_bits] or \
+           KING_ATTACKS[bit] & pieces[KING_CODE | player_bits] or \
+           PAWN_ATTACKERS[player][bit] & pieces[PAWN_CODE | player_bits]:
+            return True
+        queens = pieces[QUEEN_CODE | player_bits]
+        occupied = self.occupancy[BLACK] | self.occupancy[WHITE]
+        rooks = pieces[ROOK_CODE | player_bits] | queens
+        if ROOK_RAYS[bit] & rooks and is_slider_attacking(bit, ROOK_DIRECTIONS, occupied, rooks):
+            return True
+        bishops = pieces[BISHOP_CODE | player_bits] | queens
+        if BISHOP_RAYS[bit] & bishops and is_slider_attacking(bit, BISHOP_DIRECTIONS, occupied, bishops):
+            return True
+        return False
+
+    def get_piece_moves_no_check(self, player, bit, code):
+        # Moves of the piece code of player on bit, ignoring checked king.
+        square = BIT_TO_SQUARE[bit]
+        type_code = code & TYPE_MASK
+        own = self.occupancy[player]
+        if type_code == PAWN_CODE:
+            return self.get_pawn_moves_no_check(player, bit, square)
+        if type_code == KNIGHT_CODE:
+            targets = KNIGHT_ATTACKS[bit] & ~own
+        elif type_code == KING_CODE:
+            targets = KING_ATTACKS[bit] & ~own
+        else:
+            occupied = own | self.occupancy[next_turn(player)]
+            targets = get_slider_attacks(bit, SLIDER_DIRECTIONS[type_code], occupied) & ~own
+        moves_from = MOVE_TABLE[square]
+        return [moves_from[BIT_TO_SQUARE[target]] for target in iter_bits(targets)]
+
+    def get_pawn_moves_no_check(self, player, bit, square):
+        # Not including en-passent. Pawns on the first or last row don't move.
+        row = square_row(square)
+        if row == MIN_ROW or row == MAX_ROW:
+            return []
+        moves = []
+        promotes = row == PAWN_PROMOTION_ROW[player]
+        occupied = self.occupancy[BLACK] | self.occupancy[WHITE]
+        new_bit = bit + PAWN_FORWARD_BITS[player]
+        targets = 0
+        if not occupied >> new_bit & 1:
+            targets |= 1 << new_bit
+            double_step_bit = new_bit + PAWN_FORWARD_BITS[player]
+            if row == PAWN_START_ROW[player] and not occupied >> double_step_bit & 1:
+                targets |= 1 << double_step_bit
+        targets |= PAWN_ATTACKS[player][bit] & self.occupancy[next_turn(player)]
+        for target in iter_bits(targets):
+            if promotes:
+                moves += PROMOTION_MOVES[square, BIT_TO_SQUARE[target]]
+            else:
+                moves.append(square_move(square, BIT_TO_SQUARE[target]))
+        return moves
+
+    def get_all_player_legal_moves_no_check(self, player):
+        # Legal moves ignore checked king.
+        moves = []
+        squares = self.squares
+        for bit in iter_bits(self.occupancy[player]):
+            moves += self.get_piece_moves_no_check(player, bit, squares[BIT_TO_SQUARE[bit]])
+        return moves
+
+    def iter_legal_moves(self):
+        player = self.turn
+        squares = self.squares
+        for bit in iter_bits(self.occupancy[player]):
+            for move in self.get_piece_moves_no_check(player, bit, squares[BIT_TO_SQUARE[bit]]):
+                if self.is_move_legal(move, player):
+                    yield move
+
+    def has_any_legal_move(self):
+        player = self.turn
+        king_square = self.king_squares[player]
+        squares = self.squares
+        # The king first, the usual escape from a check.
+        bits = self.occupancy[player]
+        if king_square is not None:
+            king_bit = SQUARE_TO_BIT[king_square]
+            bits = [king_bit] + [bit for bit in iter_bits(bits) if bit != king_bit]
+        else:
+            bits = iter_bits(bits)
+        for bit in bits:
+            for move in self.get_piece_moves_no_check(player, bit, squares[BIT_TO_SQUARE[bit]]):
+                if self.is_move_legal(move, player):
+                    return True
+        return False
+
+    def has_check_evasion(self):
+        # Board.has_check_evasion, with the checkers and the squares blocking them found on the bitboards.
+        player = self.turn
+        king_square = self.king_squares[player]
+        king_bit = SQUARE_TO_BIT[king_square]
+        for move in self.get_piece_moves_no_check(player, king_bit, self.squares[king_square]):
+            if self.is_move_legal(move, player):
+                return True
+        pieces = self.pieces
+        enemy = next_turn(player)
+        enemy_bits = PLAYER_BITS[enemy]
+        occupied = self.occupancy[BLACK] | self.occupancy[WHITE]
+        queens = pieces[QUEEN_CODE | enemy_bits]
+        rooks = pieces[ROOK_CODE | enemy_bits] | queens
+        bishops = pieces[BISHOP_CODE | enemy_bits] | queens
+        checkers = KNIGHT_ATTACKS[king_bit] & pieces[KNIGHT_CODE | enemy_bits] | \
+                   PAWN_ATTACKERS[enemy][king_bit] & pieces[PAWN_CODE | enemy_bits] | \
+                   get_slider_attacks(king_bit, ROOK_DIRECTIONS, occupied) & rooks | \
+                   get_slider_attacks(king_bit, BISHOP_DIRECTIONS, occupied) & bishops
+        if checkers & (checkers - 1): # Only the king moves out of a double check.
+            return False
+        # The checker's square, and the squares between it and the king when it's a slider.
+        squares = self.squares
+        targets = checkers
+        checker_bit = lowest_bit(checkers)
+        if squares[BIT_TO_SQUARE[checker_bit]] & TYPE_MASK in SLIDER_DIRECTIONS:
+            for direction in QUEEN_DIRECTIONS:
+                if RAYS[direction][king_bit] & checkers:
+                    targets = RAYS[direction][king_bit] ^ RAYS[direction][checker_bit]
+                    break
+        for bit in iter_bits(self.occupancy[player] & ~(1 << king_bit)):
+            for move in self.get_piece_moves_no_check(player, bit, squares[BIT_TO_SQUARE[bit]]):
+                if targets >> SQUARE_TO_BIT[move.new_square] & 1 and self.is_move_legal(move, player):
+                    return True
+        return False
+
+    def push(self, move):
+        # Board.push, also moving the pieces on the bitboards.
+        squares = self.squares
+        old_square = move.old_square
+        new_square = move.new_square
+        moved_piece = squares[old_square]
+        captured_piece = squares[new_square]
+        player = self.turn
+
+        assert IS_PLAYER_PIECE[player][moved_piece]
+        assert not IS_PLAYER_PIECE[player][captured_piece]
+
+        self.num_nodes += 1
+        self.undo_stack.append((move, moved_piece, captured_piece, self.zobrist_hash))
+        new_piece = piece_code(move.promotion_to_piece, player) if move.promotion_to_piece else moved_piece
+        squares[new_square] = new_piece
+        squares[old_square] = EMPTY_CODE
+        if moved_piece & TYPE_MASK == KING_CODE:
+            self.king_squares[player] = new_square
+        self.turn = next_turn(player)
+        self.zobrist_hash ^= ZOBRIST_PIECE_KEYS[moved_piece][old_square] ^ \
+                             ZOBRIST_PIECE_KEYS[captured_piece][new_square] ^ \
+                             ZOBRIST_PIECE_KEYS[new_piece][new_square] ^ ZOBRIST_TURN_KEY
+
+        from_mask = SQUARE_MASKS[old_square]
+        to_mask = SQUARE_MASKS[new_square]
+        pieces = self.pieces
+        pieces[moved_piece] ^= from_mask
+        pieces[new_piece] ^= to_mask
+        self.occupancy[player] ^= from_mask | to_mask
+        if captured_piece != EMPTY_CODE:
+            pieces[captured_piece] ^= to_mask
+            self.occupancy[self.turn] ^= to_mask
+            self.num_pieces -= 1
+
+    def pop(self):
+        move, moved_piece, captured_piece, self.zobrist_hash = self.undo_stack.pop()
+        if move is None:
+            # A null move.
+            self.turn = next_turn(self.turn)
+            return None
+        squares = self.squares
+        old_square = move.old_square
+        new_square = move.new_square
+        new_piece = squares[new_square]
+        squares[old_square] = moved_piece
+        squares[new_square] = captured_piece
+        player = next_turn(self.turn)
+        self.turn = player
+        if moved_piece & TYPE_MASK == KING_CODE:
+            self.king_squares[player] = old_square
+
+        from_mask = SQUARE_MASKS[old_square]
+        to_mask = SQUARE_MASKS[new_square]
+        pieces = self.pieces
+        pieces[new_piece] ^= to_mask
+        pieces[moved_piece] ^= from_mask
+        self.occupancy[player] ^= from_mask | to_mask
+        if captured_piece != EMPTY_CODE:
+            pieces[captured_piece] ^= to_mask
+            self.occupancy[next_turn(player)] ^= to_mask
+            self.num_pieces += 1
+        return move
+
+# Board implementations by name, for the --board options.
+BOARD_CLASSES = {"mailbox": Board, "bitboard": BitBoard}
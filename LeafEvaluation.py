@@ -0,0 +1,130 @@
+from Solver import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Batched leaf evaluation: the final positions of the helpmate's (third, fourth) move lines, or of the
+# selfmate's defences, are built together as an (N, 120) uint8 array of mailbox piece codes, and the
+# attacked squares, check status and king escapes of all of them are computed at once with NumPy. A
+# position is only mate when its side to move is in check and its king has no escape square, and only
+# stalemate when its king has no escape square either, so the few positions passing that filter are
+# confirmed one at a time by the board's own mate and stalemate tests: the results are exact.
+#
+# NumPy is optional. Without it every function falls back to the one position at a time version.
+
+# Slider rays are at most this long.
+MAX_RAY_LENGTH = 7
+
+
+def get_attack_maps(mailbox, players):
+    """
+    (N, 120) bool array of the squares attacked by the pieces of players[i] in mailbox row i.
+    A move by offset is a roll of the piece masks along the rows. The frame is two ranks deep, so no
+    roll brings a board square around from the other end.
+    """
+    player_bits = numpy.where(players == BLACK, BLACK_BIT, 0).astype(numpy.uint8)[:, None]
+    pieces = lambda type_code: mailbox == (player_bits | type_code)
+    empty = mailbox == EMPTY_CODE
+    attacked = numpy.zeros(mailbox.shape, bool)
+    for type_code, offsets in [(KNIGHT_CODE, KNIGHT_JUMPS), (KING_CODE, KING_STEPS)]:
+        piece_mask = pieces(type_code)
+        for offset in offsets:
+            attacked |= numpy.roll(piece_mask, offset, axis=1)
+    pawns = pieces(PAWN_CODE)
+    for player in PLAYERS:
+        player_pawns = pawns & (players == player)[:, None]
+        for side in [-1, 1]:
+            attacked |= numpy.roll(player_pawns, PAWN_FORWARD[player] + side, axis=1)
+    queens = pieces(QUEEN_CODE)
+    for type_code, directions in [(ROOK_CODE, ROOK_DIRECTIONS), (BISHOP_CODE, BISHOP_DIRECTIONS)]:
+        sliders = pieces(type_code) | queens
+        for direction in directions:
+            ray = sliders
+            for _ in xrange(MAX_RAY_LENGTH):
+                ray = numpy.roll(ray, direction, axis=1)
+                attacked |= ray
+                # The ray goes on through empty squares only, it stops at a piece or the frame.
+                ray &= empty
+                if not ray.any():
+                    break
+    return attacked
+
+def get_check_and_escape_flags(mailbox, turns):
+    """
+    (in check, has a king escape) bool arrays of the side to move, turns[i], of every mailbox row.
+    Positions without the king are neither.
+    """
+    rows = numpy.arange(len(mailbox))
+    player_bits = numpy.where(turns == BLACK, BLACK_BIT, 0).astype(numpy.uint8)
+    king_mask = mailbox == (player_bits | KING_CODE)[:, None]
+    has_king = king_mask.any(axis=1)
+    king_squares = king_mask.argmax(axis=1)
+    # The king is taken off for the attacks, so that it can't step back along the line of a slider.
+    attacked = get_attack_maps(numpy.where(king_mask, EMPTY_CODE, mailbox).astype(numpy.uint8), 1 - turns)
+    in_check = has_king & attacked[rows, king_squares]
+    own = (mailbox != EMPTY_CODE) & (mailbox != OFF_BOARD) & ((mailbox & BLACK_BIT) == player_bits[:, None])
+    blocked = own | (mailbox == OFF_BOARD) | attacked
+    has_escape = numpy.zeros(len(mailbox), bool)
+    for step in KING_STEPS:
+        has_escape |= ~blocked[rows, (king_squares + step) % MAILBOX_SIZE]
+    return in_check, has_king & has_escape
+
+def get_final_mailboxes(board, lines):
+    """
+    (N, 120) uint8 mailbox array of the final positions of lines, tuples of moves of the same length played
+    from board, and the player to move in them. The lines are applied to copies of board as array updates,
+    one ply at a time.
+    """
+    rows = numpy.arange(len(lines))
+    mailbox = numpy.tile(numpy.array(board.squares, numpy.uint8), (len(lines), 1))
+    player = board.turn
+    for ply in xrange(len(lines[0])):
+        moves = [line[ply] for line in lines]
+        old_squares = numpy.array([move.old_square for move in moves])
+        new_squares = numpy.array([move.new_square for move in moves])
+        promotions = numpy.array([piece_code(move.promotion_to_piece, player) if move.promotion_to_piece else 0
+                                  for move in moves], numpy.uint8)
+        moved = mailbox[rows, old_squares]
+        mailbox[rows, new_squares] = numpy.where(promotions != 0, promotions, moved)
+        mailbox[rows, old_squares] = EMPTY_CODE
+        player = next_turn(player)
+    return mailbox, player
+
+def get_mating_lines_numpy(board, lines):
+    """
+    Solver.get_mating_lines with every line's final position built and filtered in one batch.
+    """
+    if numpy is None:
+        return get_mating_lines(board, lines)
+    if not lines:
+        return []
+    mailbox, player = get_final_mailboxes(board, lines)
+    in_check, has_escape = get_check_and_escape_flags(mailbox, numpy.full(len(lines), player, numpy.int64))
+    candidates = in_check & ~has_escape
+    if not candidates.any():
+        return [False] * len(lines)
+    return [bool(candidate) and get_mating_lines(board, [line])[0] for line, candidate in zip(lines, candidates)]
+
+def get_mate_stalemate_flags_numpy(board, moves):
+    """
+    Solver.get_mate_stalemate_flags with the positions after the moves built and filtered in one batch.
+    """
+    if numpy is None:
+        return get_mate_stalemate_flags(board, moves)
+    mates = [False] * len(moves)
+    stalemates = [False] * len(moves)
+    if not moves:
+        return mates, stalemates
+    mailbox, player = get_final_mailboxes(board, [(move,) for move in moves])
+    in_check, has_escape = get_check_and_escape_flags(mailbox, numpy.full(len(moves), player, numpy.int64))
+    for i in numpy.flatnonzero(~has_escape):
+        board.push(moves[i])
+        mates[i] = board.is_mate()
+        stalemates[i] = board.is_stalemate()
+        board.pop()
+    return mates, stalemates
+
+LEAF_EVALUATORS = {"python": get_mating_lines, "numpy": get_mating_lines_numpy}
+MATE_FLAGS_EVALUATORS = {"python": get_mate_stalemate_flags, "numpy": get_mate_stalemate_flags_numpy}
@@ -0,0 +1,184 @@
+import multiprocessing
+
+from Solver import *
+from TranspositionTable import DEFAULT_SIZE_MB
+
+# Upper bound on the number of legal moves in a position, sizes the shared refuted-keys flags.
+MAX_ROOT_MOVES = 256
+
+PENDING, PROVEN, REFUTED, STALEMATE = range(4)
+
+# Worker process state, set by _init_worker.
+_generation = None
+_refuted_keys = None
+_best_key_index = None
+_transposition_table = None
+_move_ordering = None
+
+def _init_worker(generation, refuted_keys, best_key_index, tt_size_mb):
+    global _generation, _refuted_keys, _best_key_index, _transposition_table, _move_ordering
+    _generation = generation
+    _refuted_keys = refuted_keys
+    _best_key_index = best_key_index
+    _transposition_table = TranspositionTable(tt_size_mb)
+    _move_ordering = MoveOrdering()
+
+def _solve_key_defence(task):
+    """
+    Searches the mate after one (key, defence) pair. Skipped when the key was already refuted by another
+    defence, a key earlier in move order was proven, or the root search it belongs to is over.
+    Returns (key index, defence index, skipped, MateSolution or None).
+    """
+    generation, key_index, defence_index, position, key, defence, depth = task
+    if generation != _generation.value or _refuted_keys[key_index] or key_index > _best_key_index.value:
+        return key_index, defence_index, True, None
+    board = decode_position(position)
+    board.push(get_move(*key))
+    board.push(get_move(*defence))
+    return key_index, defence_index, False, search_mate(board, depth - 1, _transposition_table, _move_ordering)
+
+
+class RootKey(object):
+    """
+    Progress of one key candidate at the root.
+    """
+
+    def __init__(self, move, defences):
+        self.move = move
+        self.defences = defences
+        self.defence_solutions = {}
+        self.refutation_index = None
+        self.status = PENDING
+
+
+class ParallelSolver(object):
+    """
+    Splits the root of a mate-in-N search into (key, defence) pairs solved on a process pool.
+    The first key in move order that is proven is the answer, whatever order the pairs finish in,
+    so the output is the same as a serial solve. Queued pairs of refuted keys, and of keys after a
+    proven one, are skipped by the workers.
+    """
+
+    def __init__(self, jobs, tt_size_mb=DEFAULT_SIZE_MB):
+        self.generation = multiprocessing.Value('i', 0, lock=False)
+        self.refuted_keys = multiprocessing.Array('b', MAX_ROOT_MOVES, lock=False)
+        self.best_key_index = multiprocessing.Value('i', MAX_ROOT_MOVES, lock=False)
+        self.pool = multiprocessing.Pool(jobs, _init_worker,
+                                         (self.generation, self.refuted_keys, self.best_key_index, tt_size_mb))
+        self.num_tasks = 0
+        self.num_skipped = 0
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def get_root_keys(self, board, depth):
+        root_keys = []
+        for key in board.get_all_legal_moves():
+            board.push(key)
+            defences = board.get_all_legal_moves()
+            root_key = RootKey(key, defences)
+            if board.is_stalemate():
+                root_key.status = STALEMATE
+            elif not defences:
+                root_key.status = PROVEN
+            elif depth == 1:
+                root_key.status = REFUTED
+            board.pop()
+            root_keys.append(root_key)
+        return root_keys
+
+    def search_root(self, board, depth, verbose=False):
+        """
+        Returns the MateSolution of the first key in move order mating within depth moves, or None.
+        """
+        root_keys = self.get_root_keys(board, depth)
+        assert len(root_keys) <= MAX_ROOT_MOVES
+        # Starting a new generation makes workers skip whatever is left of the previous root search.
+        self.generation.value += 1
+        for key_index in xrange(MAX_ROOT_MOVES):
+            self.refuted_keys[key_index] = 0
+        self.best_key_index.value = MAX_ROOT_MOVES
+
+        position = encode_position(board)
+        tasks = [(self.generation.value, key_index, defence_index, position, move_to_tuple(root_key.move),
+                  move_to_tuple(defence), depth)
+                 for key_index, root_key in enumerate(root_keys) if root_key.status == PENDING
+                 for defence_index, defence in enumerate(root_key.defences)]
+        self.num_tasks += len(tasks)
+
+        next_key_index = self.report_resolved_keys(board, root_keys, 0, verbose)
+        if self.is_decided(root_keys, next_key_index):
+            tasks = []
+        for key_index, defence_index, skipped, solution in self.pool.imap_unordered(_solve_key_defence, tasks):
+            root_key = root_keys[key_index]
+            if skipped:
+                self.num_skipped += 1
+            elif root_key.status == PENDING and solution is None:
+                root_key.status = REFUTED
+                root_key.refutation_index = defence_index
+                self.refuted_keys[key_index] = 1
+            elif root_key.status == PENDING:
+                root_key.defence_solutions[root_key.defences[defence_index]] = solution
+                if len(root_key.defence_solutions) == len(root_key.defences):
+                    root_key.status = PROVEN
+                    self.best_key_index.value = min(self.best_key_index.value, key_index)
+            next_key_index = self.report_resolved_keys(board, root_keys, next_key_index, verbose)
+            if self.is_decided(root_keys, next_key_index):
+                break
+
+        for root_key in root_keys[:next_key_index]:
+            if root_key.status == PROVEN:
+                return MateSolution(root_key.move, root_key.defence_solutions)
+        return None
+
+    def is_decided(self, root_keys, next_key_index):
+        return next_key_index == len(root_keys) or \
+               (next_key_index > 0 and root_keys[next_key_index - 1].status == PROVEN)
+
+    def report_resolved_keys(self, board, root_keys, next_key_index, verbose):
+        # Prints the keys resolved so far in move order, up to the first proven one.
+        # Returns the index of the first key not reported yet.
+        while next_key_index < len(root_keys) and root_keys[next_key_index].status != PENDING:
+            root_key = root_keys[next_key_index]
+            next_key_index += 1
+            if verbose:
+                print_working_on_step(get_move_string(root_key.move, board))
+                if root_key.status == STALEMATE:
+                    print "  Stale mate"
+                elif root_key.status == REFUTED and root_key.refutation_index is not None:
+                    board.push(root_key.move)
+                    print_can_handle_with_step(root_key.defences[root_key.refutation_index], board)
+                    board.pop()
+            if root_key.status == PROVEN:
+                break
+        return next_key_index
+
+    def __str__(self):
+        return "Parallel search: {} (key, defence) tasks, {} skipped".format(self.num_tasks, self.num_skipped)
+
+def solve_mate_in_n_parallel(board, n, jobs, verbose=True, tt_size_mb=DEFAULT_SIZE_MB):
+    """
+    solve_mate_in_n with the root split across jobs worker processes, each keeping its own transposition
+    table of tt_size_mb. Returns the MateSolution, or None.
+    """
+    assert board.turn == WHITE
+    assert n >= 1
+    if verbose:
+        print board
+        print
+
+    parallel_solver = ParallelSolver(jobs, tt_size_mb)
+    try:
+        for depth in xrange(1, n + 1):
+            solution = parallel_solver.search_root(board, depth, verbose and depth == n)
+            if solution is not None:
+                break
+    finally:
+        parallel_solver.close()
+
+    if verbose:
+        print_mate_in_n_result(solution, board, n)
+        print parallel_solver
+        print
+    return solution
@@ -0,0 +1,164 @@
+import mmap
+import struct
+
+from Solver import *
+
+# A problem database file is a header, an index by stipulation and fixed-size problem records:
+#
+#   header: magic, number of records, number of index entries
+#   index entry: stipulation, number of moves, first record, number of records
+#   record: 64 squares a1 to h8 as 4-bit piece codes, two a byte, low nibble first, followed by
+#           the side to move, stipulation, number of moves and number of solutions, a byte each
+#
+# Records are sorted by (stipulation, number of moves), so every index entry is a contiguous range.
+DATABASE_EXTENSION = ".epdb"
+MAGIC = "ETUDEDB1"
+HEADER = struct.Struct("<8sII")
+INDEX_ENTRY = struct.Struct("<BBII")
+RECORD = struct.Struct("<32sBBBB")
+
+STIPULATIONS = ["mate", "selfmate", "helpmate"]
+STIPULATION_CODES = dict((stipulation, code) for code, stipulation in enumerate(STIPULATIONS))
+
+# (low nibble code, high nibble code) of every record byte.
+BYTE_TO_CODES = [(byte & 0xF, byte >> 4) for byte in xrange(256)]
+
+
+def type_to_stipulation(etude_type):
+    """
+    (stipulation, number of moves) of a solve.py etude type, e.g. ("mate", 3) for mate_in_3.
+    """
+    if etude_type in ("selfmate", "helpmate"):
+        return etude_type, 2
+    n = get_mate_in_n(etude_type)
+    if n is None:
+        raise ValueError("Invalid etude type: {}".format(etude_type))
+    return "mate", n
+
+def stipulation_to_type(stipulation, num_moves):
+    return "{}{}".format(MATE_IN_PREFIX, num_moves) if stipulation == "mate" else stipulation
+
+def problem_turn(etude_type):
+    # Side to move of an etude file, which doesn't say: black makes the first move of a helpmate.
+    return BLACK if etude_type == "helpmate" else WHITE
+
+def fen_to_board(fen, board_class=None):
+    """
+    Board of the first two fields of a FEN: the pieces and the side to move.
+    Castling and en-passent rights are ignored, as the solvers don't play them.
+    """
+    fields = fen.split()
+    rows = fields[0].split("/")
+    if len(rows) != 8 or len(fields) < 2 or fields[1] not in ("w", "b"):
+        raise ValueError("Invalid FEN: {}".format(fen))
+    state = []
+    for row in rows:
+        line = ''.join([EMPTY * int(char) if char.isdigit() else char for char in row])
+        if len(line) != 8 or any(piece not in PIECES for piece in line.lower()):
+            raise ValueError("Invalid FEN: {}".format(fen))
+        # FEN has white pieces in uppercase, the etude files the other way around.
+        state.append(line.swapcase())
+    return (board_class or Board)(state, WHITE if fields[1] == "w" else BLACK)
+
+def encode_record(board, etude_type, num_solutions=1):
+    stipulation, num_moves = type_to_stipulation(etude_type)
+    codes = [board.squares[square] for square in SQUARES]
+    squares = ''.join([chr(codes[i] | codes[i + 1] << 4) for i in xrange(0, len(codes), 2)])
+    return RECORD.pack(squares, board.turn, STIPULATION_CODES[stipulation], num_moves, num_solutions)
+
+def write_problem_database(filename, records):
+    """
+    Writes the encoded records, in any order, as a problem database.
+    """
+    records = sorted(records, key=lambda record: RECORD.unpack(record)[2:4])
+    ranges = []
+    for i, record in enumerate(records):
+        _, _, stipulation_code, num_moves, _ = RECORD.unpack(record)
+        if ranges and ranges[-1][:2] == [stipulation_code, num_moves]:
+            ranges[-1][3] += 1
+        else:
+            ranges.append([stipulation_code, num_moves, i, 1])
+    output = open(filename, "wb")
+    output.write(HEADER.pack(MAGIC, len(records), len(ranges)))
+    for entry in ranges:
+        output.write(INDEX_ENTRY.pack(*entry))
+    for record in records:
+        output.write(record)
+    output.close()
+
+
+class ProblemDatabase(object):
+    """
+    Read-only access to a problem database file through mmap, so only the records used are read in.
+    Problems are numbered from 0 in file order, which groups them by stipulation and number of moves.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as database_file:
+            self.data = mmap.mmap(database_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_records, num_index_entries = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a problem database: {}".format(filename))
+        # (stipulation, number of moves) -> (first record, number of records).
+        self.index = {}
+        for i in xrange(num_index_entries):
+            stipulation_code, num_moves, first, count = \
+                INDEX_ENTRY.unpack_from(self.data, HEADER.size + i * INDEX_ENTRY.size)
+            self.index[STIPULATIONS[stipulation_code], num_moves] = (first, count)
+        self.records_offset = HEADER.size + num_index_entries * INDEX_ENTRY.size
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.num_records
+
+    def get_record(self, i):
+        """
+        (packed squares, side to move, etude type, number of solutions) of problem i.
+        """
+        if not 0 <= i < self.num_records:
+            raise IndexError("No problem {} in {}".format(i, self.filename))
+        squares, turn, stipulation_code, num_moves, num_solutions = \
+            RECORD.unpack_from(self.data, self.records_offset + i * RECORD.size)
+        return squares, turn, stipulation_to_type(STIPULATIONS[stipulation_code], num_moves), num_solutions
+
+    def get_board(self, i, board_class=None):
+        squares, turn, _, _ = self.get_record(i)
+        mailbox = [OFF_BOARD] * MAILBOX_SIZE
+        for j, byte in enumerate(squares):
+            mailbox[SQUARES[2 * j]], mailbox[SQUARES[2 * j + 1]] = BYTE_TO_CODES[ord(byte)]
+        return (board_class or Board).from_squares(mailbox, turn)
+
+    def get_problem(self, i):
+        """
+        Problem i in the form of Batch.read_problems.
+        """
+        _, _, etude_type, num_solutions = self.get_record(i)
+        return {"input_filename": self.filename, "record": i, "type": etude_type, "num_solutions": num_solutions}
+
+    def iter_records(self, etude_type=None):
+        """
+        Numbers of the problems of etude_type, found through the index, or of every problem.
+        """
+        if etude_type is None:
+            return iter(xrange(self.num_records))
+        first, count = self.index.get(type_to_stipulation(etude_type), (0, 0))
+        return iter(xrange(first, first + count))
+
+    def get_types(self):
+        # Etude types in the database, with their number of problems.
+        return [(stipulation_to_type(stipulation, num_moves), count)
+                for (stipulation, num_moves), (_, count) in sorted(self.index.iteritems())]
+
+# Databases opened so far by this process, so that a worker maps every file once.
+_open_databases = {}
+
+def open_problem_database(filename):
+    if filename not in _open_databases:
+        _open_databases[filename] = ProblemDatabase(filename)
+    return _open_databases[filename]
+
+def is_problem_database(filename):
+    return filename.endswith(DATABASE_EXTENSION)
@@ -0,0 +1,198 @@
+from Solver import *
+
+INFINITY = float("inf")
+DEFAULT_MAX_NODES = 2000000
+# OR nodes with at most this many attacker moves left are solved by search_mate instead of expanded.
+DIRECT_SEARCH_DEPTH = 2
+
+
+class ProofNode(object):
+    """
+    Node of the proof-number search tree. OR nodes have the attacker to move, AND nodes the defender.
+    depth is the number of attacker moves still allowed from the node.
+    """
+
+    def __init__(self, move, parent, is_or_node, depth, proof=1, disproof=1):
+        self.move = move
+        self.parent = parent
+        self.is_or_node = is_or_node
+        self.depth = depth
+        self.proof = proof
+        self.disproof = disproof
+        self.children = None
+        self.solution = None # MateSolution of an OR node that was solved by search_mate.
+
+    def is_solved(self):
+        return self.proof == 0 or self.disproof == 0
+
+    def count_nodes(self):
+        return 1 + sum(child.count_nodes() for child in self.children or [])
+
+    def update_numbers(self):
+        if self.is_or_node:
+            self.proof = min(child.proof for child in self.children)
+            self.disproof = sum(child.disproof for child in self.children)
+        else:
+            self.proof = sum(child.proof for child in self.children)
+            self.disproof = min(child.disproof for child in self.children)
+
+
+class ProofNumberSearch(object):
+    """
+    Proof-number search for a mate in at most n moves. The tree is kept in memory, but the subtrees of
+    solved nodes are dropped except for the proof itself, and the search gives up after max_nodes nodes.
+    """
+
+    def __init__(self, board, n, max_nodes=DEFAULT_MAX_NODES):
+        assert board.turn == WHITE
+        self.board = board
+        self.root = ProofNode(None, None, True, n)
+        self.max_nodes = max_nodes
+        self.num_nodes = 1
+        self.num_expansions = 0
+        self.transposition_table = TranspositionTable()
+        self.move_ordering = MoveOrdering()
+
+    def search(self):
+        """
+        Returns True when the root is proven, False when it's disproven and None when the node store ran
+        out before either.
+        """
+        root = self.root
+        while not root.is_solved():
+            if self.num_nodes > self.max_nodes:
+                return None
+            node = self.select_most_proving_node()
+            self.expand(node)
+            self.update_ancestors(node)
+        return root.proof == 0
+
+    def select_most_proving_node(self):
+        # Descends from the root pushing moves on the board, which is left at the returned node.
+        node = self.root
+        while node.children is not None:
+            if node.is_or_node:
+                node = min(node.children, key=lambda child: child.proof)
+            else:
+                node = min(node.children, key=lambda child: child.disproof)
+            self.board.push(node.move)
+        return node
+
+    def update_ancestors(self, node):
+        # Walks back to the root, popping the moves select_most_proving_node pushed.
+        while node is not None:
+            if node.children: # Terminal nodes keep the numbers they were given.
+                node.update_numbers()
+                if node.is_solved():
+                    self.prune(node)
+            if node.parent is not None:
+                self.board.pop()
+            node = node.parent
+
+    def prune(self, node):
+        # Keeps only what the proof of node needs: every child of a proven AND node and the proving
+        # child of a proven OR node. Disproven subtrees aren't needed at all.
+        if node.proof == 0 and node.is_or_node:
+            kept = [next(child for child in node.children if child.proof == 0)]
+        elif node.proof == 0:
+            kept = node.children
+        else:
+            kept = []
+        for child in node.children:
+            if child not in kept:
+                self.num_nodes -= child.count_nodes()
+        node.children = kept
+
+    def expand(self, node):
+        board = self.board
+        self.num_expansions += 1
+        node.children = []
+        if node.is_or_node:
+            # Only a check mates in one.
+            for key in board.get_all_legal_moves() if node.depth > 1 else board.get_checking_moves():
+                node.children.append(self.evaluate_and_node(key, node))
+        else:
+            for defence in board.get_all_legal_moves():
+                node.children.append(self.evaluate_or_node(defence, node))
+        self.num_nodes += len(node.children)
+        if not node.children:
+            # Only OR nodes can run out of moves here, AND nodes without moves are solved when created.
+            node.proof, node.disproof = INFINITY, 0
+
+    def evaluate_and_node(self, key, parent):
+        board = self.board
+        child = ProofNode(key, parent, False, parent.depth - 1)
+        board.push(key)
+        if child.depth == 0:
+            is_mate = board.is_mate()
+            child.proof, child.disproof = (0, INFINITY) if is_mate else (INFINITY, 0)
+            if is_mate:
+                child.children = []
+        else:
+            defences = board.get_all_legal_moves()
+            if not defences:
+                if board.is_in_check():
+                    child.proof, child.disproof = 0, INFINITY
+                    child.children = []
+                else:
+                    child.proof, child.disproof = INFINITY, 0
+            else:
+                child.proof = len(defences)
+        board.pop()
+        return child
+
+    def evaluate_or_node(self, defence, parent):
+        board = self.board
+        child = ProofNode(defence, parent, True, parent.depth)
+        if child.depth <= DIRECT_SEARCH_DEPTH:
+            # Short mates are cheaper to search depth-first than to expand.
+            board.push(defence)
+            child.solution = search_mate(board, child.depth, self.transposition_table, self.move_ordering)
+            board.pop()
+            if child.solution is None:
+                child.proof, child.disproof = INFINITY, 0
+            else:
+                child.proof, child.disproof = 0, INFINITY
+                child.children = []
+        return child
+
+    def get_solution(self, node=None):
+        """
+        MateSolution of a proven OR node, the root by default.
+        """
+        node = node or self.root
+        assert node.is_or_node and node.proof == 0
+        if node.solution is not None:
+            return node.solution
+        key_node = next(child for child in node.children if child.proof == 0)
+        return MateSolution(key_node.move, dict((defence_node.move, self.get_solution(defence_node))
+                                                for defence_node in key_node.children))
+
+    def __str__(self):
+        return "Proof-number search: {} expansions, {} nodes in store".format(self.num_expansions,
+                                                                             self.num_nodes)
+
+def solve_mate_in_n_pns(board, n, verbose=True, max_nodes=DEFAULT_MAX_NODES):
+    """
+    Same stipulation and result as solve_mate_in_n, searched best-first by proof and disproof numbers.
+    Returns the MateSolution, or None.
+    """
+    if verbose:
+        print board
+        print
+    pns = ProofNumberSearch(board, n, max_nodes)
+    proven = pns.search()
+    solution = pns.get_solution() if proven else None
+    if verbose:
+        if proven:
+            print_success(get_move_string(solution.move, board))
+            board.push(solution.move)
+            print_mate_solution(solution, board)
+            board.pop()
+        elif proven is None:
+            print "Node limit of {} reached before the problem was solved.".format(max_nodes)
+        else:
+            print_didnt_solve()
+        print pns
+        print
+    return solution
@@ -0,0 +1,234 @@
+import json
+import sqlite3
+import time
+
+from Solver import *
+from Tablebase import get_board_signature
+
+DEFAULT_CACHE_FILENAME = "solution_cache.sqlite"
+DEFAULT_CACHE_SIZE_MB = 256
+# Rough per-row cost on top of the position and result, for the size limit.
+ROW_OVERHEAD_BYTES = 64
+# Most cached mates stored in the transposition table of a search, the most recently used first.
+MAX_PRIMED_ROWS = 10000
+
+MATE_STIPULATION = "mate"
+SELFMATE_STIPULATION = "selfmate"
+HELPMATE_STIPULATION = "helpmate"
+
+
+def mate_solution_to_tuple(solution):
+    # JSON-ready form of a MateSolution: (key, [(defence, solution), ...]).
+    return move_to_tuple(solution.move), [(move_to_tuple(defence), mate_solution_to_tuple(defence_solution))
+                                          for defence, defence_solution in solution.defences.iteritems()]
+
+def tuple_to_mate_solution(solution_tuple):
+    move, defences = solution_tuple
+    return MateSolution(get_move(*move), dict((get_move(*defence), tuple_to_mate_solution(defence_solution))
+                                          for defence, defence_solution in defences))
+
+
+class SolutionCache(object):
+    """
+    Solved problems in a local SQLite file, kept across runs. Rows are keyed by the position
+    (encode_position), the stipulation and the depth, and hold the result as JSON, null for a problem
+    proven to have no solution.
+
+    Mate-in-N solutions also store every position of their solution tree as a proven mate of its own,
+    so a later search of another problem can start with them in its transposition table. Only rows of
+    the material of that problem (its Tablebase signature) are looked at, so priming the table doesn't
+    grow with the whole cache.
+    Once the rows take more than size_mb, the least recently used ones are evicted.
+    """
+
+    def __init__(self, filename=DEFAULT_CACHE_FILENAME, size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.max_size_bytes = int(size_mb * 2 ** 20)
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.text_factory = str
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results (position BLOB, stipulation TEXT, "
+                                "depth INTEGER, result TEXT, size INTEGER, last_used REAL, material TEXT, "
+                                "PRIMARY KEY (position, stipulation, depth))")
+        columns = [column[1] for column in self.connection.execute("PRAGMA table_info(results)")]
+        if "material" not in columns:
+            # A cache of before the material column, whose rows are then never primed.
+            self.connection.execute("ALTER TABLE results ADD COLUMN material TEXT")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_material ON results (stipulation, material)")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.connection.close()
+
+    def get(self, board, stipulation, depth):
+        """
+        Returns (True, result) for a cached result, (False, None) otherwise.
+        """
+        return self.get_row("position = ? AND stipulation = ? AND depth = ?",
+                            (sqlite3.Binary(encode_position(board)), stipulation, depth))
+
+    def get_row(self, condition, parameters):
+        row = self.connection.execute("SELECT rowid, result FROM results WHERE " + condition,
+                                      parameters).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self.connection.execute("UPDATE results SET last_used = ? WHERE rowid = ?", (time.time(), row[0]))
+        self.connection.commit()
+        return True, json.loads(row[1])
+
+    def put(self, board, stipulation, depth, result, commit=True):
+        position = encode_position(board)
+        result = json.dumps(result)
+        self.connection.execute("INSERT OR REPLACE INTO results (position, stipulation, depth, result, size, "
+                                "last_used, material) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (sqlite3.Binary(position), stipulation, depth, result,
+                                 len(position) + len(result) + ROW_OVERHEAD_BYTES, time.time(),
+                                 get_board_signature(board)))
+        if commit:
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if size <= self.max_size_bytes:
+            return
+        # Drops the least recently used rows down to 90% of the limit, so that eviction isn't needed
+        # again on the very next store.
+        target_size = 0.9 * self.max_size_bytes
+        rows = self.connection.execute("SELECT rowid, size FROM results ORDER BY last_used").fetchall()
+        evicted_rowids = []
+        for rowid, row_size in rows:
+            if size <= target_size:
+                break
+            evicted_rowids.append((rowid,))
+            size -= row_size
+        self.connection.executemany("DELETE FROM results WHERE rowid = ?", evicted_rowids)
+
+    def get_mate_solution(self, board, n):
+        """
+        Returns (True, MateSolution or None) for a cached mate-in-n result of board, (False, None) otherwise.
+        Like the transposition table, a mate within fewer moves or no mate within more moves answers too.
+        """
+        found, result = self.get_row("position = ? AND stipulation = ? AND "
+                                     "((depth <= ? AND result != 'null') OR (depth >= ? AND result = 'null')) "
+                                     "ORDER BY depth LIMIT 1",
+                                     (sqlite3.Binary(encode_position(board)), MATE_STIPULATION, n, n))
+        if not found:
+            return False, None
+        return True, tuple_to_mate_solution(result) if result is not None else None
+
+    def put_mate_solution(self, board, n, solution):
+        """
+        Stores the mate-in-n result of board, and every position along the solution tree as proven
+        mates within their own depths.
+        """
+        self.put(board, MATE_STIPULATION, n, mate_solution_to_tuple(solution) if solution is not None else None,
+                 commit=False)
+        if solution is not None:
+            self.put_mate_subsolutions(board, solution)
+        self.evict()
+        self.connection.commit()
+
+    def put_mate_subsolutions(self, board, solution):
+        board.push(solution.move)
+        for defence, defence_solution in solution.defences.iteritems():
+            board.push(defence)
+            self.put(board, MATE_STIPULATION, defence_solution.depth(), mate_solution_to_tuple(defence_solution),
+                     commit=False)
+            self.put_mate_subsolutions(board, defence_solution)
+            board.pop()
+        board.pop()
+
+    def prime_transposition_table(self, transposition_table, board, max_depth, max_rows=MAX_PRIMED_ROWS):
+        """
+        Stores the cached proven mates within max_depth moves of the same material as board in
+        transposition_table, at most max_rows of them. Returns the number of entries stored.
+        """
+        num_entries = 0
+        for position, depth, result in self.connection.execute(
+                "SELECT position, depth, result FROM results WHERE stipulation = ? AND material = ? "
+                "AND depth <= ? AND result != 'null' ORDER BY last_used DESC LIMIT ?",
+                (MATE_STIPULATION, get_board_signature(board), max_depth, max_rows)):
+            cached_board = decode_position(str(position))
+            transposition_table.store(cached_board.zobrist_hash, cached_board.turn, depth,
+                                      tuple_to_mate_solution(json.loads(result)))
+            num_entries += 1
+        return num_entries
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __str__(self):
+        return "Solution cache: {} hits, {} misses, {} rows".format(self.hits, self.misses, len(self))
+
+def solve_mate_in_n_cached(cache, board, n, search, verbose=True, transposition_table=None):
+    """
+    Mate-in-n result of board from cache, or else from search(transposition_table), given the table
+    primed with the cached proven mates of board's material, and then stored. Returns the MateSolution, or None.
+    """
+    found, solution = cache.get_mate_solution(board, n)
+    if found:
+        if verbose:
+            print board
+            print
+            print "Found in the solution cache."
+            print_mate_in_n_result(solution, board, n)
+        return solution
+    if transposition_table is None:
+        transposition_table = TranspositionTable()
+    cache.prime_transposition_table(transposition_table, board, n - 1)
+    solution = search(transposition_table)
+    cache.put_mate_solution(board, n, solution)
+    return solution
+
+def solve_selfmate_in_two_cached(cache, board, search, verbose=True):
+    """
+    Selfmate result of board, as returned by solve_selfmate_in_two, from cache or else from search().
+    """
+    found, result = cache.get(board, SELFMATE_STIPULATION, 2)
+    if not found:
+        selfmate_solution = search()
+        if selfmate_solution is not None:
+            step1, solutions_dict = selfmate_solution
+            result = move_to_tuple(step1), [(move_to_tuple(step2), move_to_tuple(step3))
+                                            for step2, step3 in solutions_dict.iteritems()]
+        cache.put(board, SELFMATE_STIPULATION, 2, result if selfmate_solution is not None else None)
+        return selfmate_solution
+    if result is None:
+        selfmate_solution = None
+    else:
+        selfmate_solution = get_move(*result[0]), dict((get_move(*step2), get_move(*step3)) for step2, step3 in result[1])
+    if verbose:
+        print board
+        print
+        print "Found in the solution cache."
+        if selfmate_solution is None:
+            print_didnt_solve()
+        else:
+            print_success(get_move_string(selfmate_solution[0], board))
+            board.push(selfmate_solution[0])
+            print_solutions(selfmate_solution[1], board)
+            board.pop()
+    return selfmate_solution
+
+def solve_helpmate_in_two_cached(cache, board, num_solutions, search, verbose=True):
+    """
+    Helpmate solutions of board, as returned by solve_helpmate_in_two, from cache or else from search().
+    Every number of solutions asked for is cached on its own.
+    """
+    stipulation = "{}/{}".format(HELPMATE_STIPULATION, num_solutions)
+    found, solutions = cache.get(board, stipulation, 2)
+    if not found:
+        solutions = search()
+        cache.put(board, stipulation, 2, solutions)
+        return solutions
+    if verbose:
+        print board
+        print
+        print "Found in the solution cache.\n"
+        for i, solution in enumerate(solutions):
+            print "  Solution #{} is: {}".format(i+1, solution)
+        print
+    return solutions
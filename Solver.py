@@ -1,4 +1,7 @@
-import copy
+import random
+import time
+
+from TranspositionTable import TranspositionTable
 
 BLACK, WHITE = [0, 1]
 PLAYERS = [BLACK, WHITE]
@@ -11,6 +14,32 @@ MIN_ROW = 1
 MAX_ROW = 8
 COLUMNS = "abcdefgh"
 
+# The board is a 10x12 mailbox: a1 is square 21, h1 is 28, a8 is 91 and h8 is 98.
+# The frame around the 8x8 board holds OFF_BOARD, so move generation never checks bounds.
+MAILBOX_SIZE = 120
+
+# Piece codes: piece type in the low bits, BLACK_BIT set for black pieces.
+EMPTY_CODE, PAWN_CODE, KNIGHT_CODE, BISHOP_CODE, ROOK_CODE, QUEEN_CODE, KING_CODE, OFF_BOARD = range(8)
+TYPE_MASK = 7
+BLACK_BIT = 8
+PLAYER_BITS = [BLACK_BIT, 0] # Indexed by player.
+
+PIECE_TO_TYPE_CODE = {EMPTY: EMPTY_CODE, PAWN: PAWN_CODE, KNIGHT: KNIGHT_CODE, BISHOP: BISHOP_CODE,
+                      ROOK: ROOK_CODE, QUEEN: QUEEN_CODE, KING: KING_CODE}
+TYPE_CODE_TO_PIECE = dict((type_code, piece) for piece, type_code in PIECE_TO_TYPE_CODE.iteritems())
+
+ROOK_DIRECTIONS = [1, -1, 10, -10]
+BISHOP_DIRECTIONS = [11, -9, 9, -11]
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KING_STEPS = QUEEN_DIRECTIONS
+KNIGHT_JUMPS = [-21, -19, -12, -8, 8, 12, 19, 21]
+PAWN_FORWARD = [-10, 10] # Indexed by player.
+PAWN_START_ROW = [7, 2] # Indexed by player.
+PAWN_PROMOTION_ROW = [2, 7] # Row a pawn promotes from, indexed by player.
+POSSIBLE_PROMOTIONS = [QUEEN, KNIGHT, ROOK, BISHOP]
+# Offsets from a square to the pawns of player that attack it, indexed by player.
+PAWN_ATTACKER_OFFSETS = [[10 - 1, 10 + 1], [-10 - 1, -10 + 1]]
+
 next_turn = lambda turn : 1 - turn
 
 widen = lambda line : ''.join([' '+piece for piece in line])
@@ -19,136 +48,273 @@ piece_char_to_player = lambda piece_char : BLACK if piece_char.isupper() else WH
 
 piece_to_char = lambda piece : piece.type if piece.player == WHITE else piece.type.upper()
 
-position_to_ord_col_row = lambda position : (ord(position[0]), int(position[1]))
-
 ord_col_row_to_position = lambda ord_col, row : "{}{}".format(chr(ord_col), row)
 
-is_square_in_board = lambda ord_col, row : row >= MIN_ROW and row <= MAX_ROW and ord_col >= MIN_COL and ord_col <= MAX_COL
+ord_col_row_to_square = lambda ord_col, row : 21 + (ord_col - MIN_COL) + 10 * (row - MIN_ROW)
 
-def get_legal_bishop_moves_no_check(player, position, board):
-    col, row = position_to_ord_col_row(position)
-    
-    moves = []
-    
-    # Right Up.
-    for i in xrange(1, min(MAX_COL - col, MAX_ROW - row) + 1):
-        new_col = col + i
-        new_row = row + i
-        new_pos = ord_col_row_to_position(new_col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
+square_row = lambda square : square // 10 - 1
 
-    # Right Down.
-    for i in xrange(1, min(MAX_COL - col, row - MIN_ROW) + 1):
-        new_col = col + i
-        new_row = row - i
-        new_pos = ord_col_row_to_position(new_col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
+square_ord_col = lambda square : MIN_COL + square % 10 - 1
 
-    # Left Up.
-    for i in xrange(1, min(col - MIN_COL, MAX_ROW - row) + 1):
-        new_col = col - i
-        new_row = row + i
-        new_pos = ord_col_row_to_position(new_col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
+piece_code = lambda piece_type, player : PIECE_TO_TYPE_CODE[piece_type] | PLAYER_BITS[player]
 
-    # Left Down.
-    for i in xrange(1, min(col - MIN_COL, row - MIN_ROW) + 1):
-        new_col = col - i
-        new_row = row - i
-        new_pos = ord_col_row_to_position(new_col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
+code_to_player = lambda code : BLACK if code & BLACK_BIT else WHITE
+
+piece_char_to_code = lambda piece_char : EMPTY_CODE if piece_char == EMPTY else \
+                                         piece_code(piece_char.lower(), piece_char_to_player(piece_char))
+
+code_to_piece_char = lambda code : EMPTY if code == EMPTY_CODE else \
+                                   TYPE_CODE_TO_PIECE[code & TYPE_MASK].upper() if code & BLACK_BIT else \
+                                   TYPE_CODE_TO_PIECE[code & TYPE_MASK]
+
+# All 64 board squares, a1 to h8.
+SQUARES = [ord_col_row_to_square(col, row) for row in xrange(MIN_ROW, MAX_ROW + 1)
+           for col in xrange(MIN_COL, MAX_COL + 1)]
 
+SQUARE_TO_POSITION = [None] * MAILBOX_SIZE
+for _square in SQUARES:
+    SQUARE_TO_POSITION[_square] = ord_col_row_to_position(square_ord_col(_square), square_row(_square))
+POSITION_TO_SQUARE = dict((SQUARE_TO_POSITION[square], square) for square in SQUARES)
+
+# IS_PLAYER_PIECE[player][code] is True when code is one of player's pieces.
+# CAN_LAND_ON[player][code] is True when a piece of player may move to a square holding code.
+IS_PLAYER_PIECE = [tuple(code & TYPE_MASK not in (EMPTY_CODE, OFF_BOARD) and code_to_player(code) == player
+                         for code in xrange(2 * BLACK_BIT))
+                   for player in PLAYERS]
+CAN_LAND_ON = [tuple(code == EMPTY_CODE or IS_PLAYER_PIECE[next_turn(player)][code]
+                     for code in xrange(2 * BLACK_BIT))
+               for player in PLAYERS]
+
+# Zobrist keys: ZOBRIST_PIECE_KEYS[code][square] for every piece code on every square (zero for empty
+# squares), and ZOBRIST_TURN_KEY toggled with the side to move. 63 bits keep the hash a plain int.
+_zobrist_random = random.Random(0)
+ZOBRIST_PIECE_KEYS = [[_zobrist_random.getrandbits(63) if IS_PLAYER_PIECE[BLACK][code] or IS_PLAYER_PIECE[WHITE][code]
+                       else 0 for square in xrange(MAILBOX_SIZE)]
+                      for code in xrange(2 * BLACK_BIT)]
+ZOBRIST_TURN_KEY = _zobrist_random.getrandbits(63)
+
+def square_move(old_square, new_square, promotion_to_piece=None):
+    if promotion_to_piece:
+        return PROMOTION_MOVES[old_square, new_square][POSSIBLE_PROMOTIONS.index(promotion_to_piece)]
+    return MOVE_TABLE[old_square][new_square]
+
+def get_legal_sliding_moves_no_check(player, square, board, directions):
+    squares = board.squares
+    is_enemy = IS_PLAYER_PIECE[next_turn(player)]
+    moves_from = MOVE_TABLE[square]
+    
+    moves = []
+    
+    for direction in directions:
+        new_square = square + direction
+        while squares[new_square] == EMPTY_CODE:
+            moves.append(moves_from[new_square])
+            new_square += direction
+        if is_enemy[squares[new_square]]:
+            moves.append(moves_from[new_square])
+    
     return moves
 
-def get_legal_rook_moves_no_check(player, position, board):
-    col, row = position_to_ord_col_row(position)
+def get_legal_step_moves_no_check(player, square, board, steps):
+    squares = board.squares
+    can_land_on = CAN_LAND_ON[player]
+    moves_from = MOVE_TABLE[square]
+    return [moves_from[square + step] for step in steps if can_land_on[squares[square + step]]]
+
+def get_legal_bishop_moves_no_check(player, square, board):
+    return get_legal_sliding_moves_no_check(player, square, board, BISHOP_DIRECTIONS)
+
+def get_legal_rook_moves_no_check(player, square, board):
+    """
+    Doesn't include castling
+    """
+    return get_legal_sliding_moves_no_check(player, square, board, ROOK_DIRECTIONS)
+
+def get_legal_queen_moves_no_check(player, square, board):
+    return get_legal_sliding_moves_no_check(player, square, board, QUEEN_DIRECTIONS)
+
+def get_legal_knight_moves_no_check(player, square, board):
+    return get_legal_step_moves_no_check(player, square, board, KNIGHT_JUMPS)
+
+def get_legal_king_moves_no_check(player, square, board):
+    # Don't check if king is in check in new square. Only if it's taken by a piece of the same player.
+    # Not including castling.
+    return get_legal_step_moves_no_check(player, square, board, KING_STEPS)
+
+def get_legal_pawn_moves_no_check(player, square, board):
+    """
+    Not including en-passent.
+    """
+    squares = board.squares
+    row = square_row(square)
     
     moves = []
     
-    # Right.
-    for new_col in xrange(col + 1, MAX_COL + 1):
-        new_pos = ord_col_row_to_position(new_col, row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
+    if row == MIN_ROW or row == MAX_ROW:
+        return moves
     
-    # Left.
-    for new_col in xrange(col - 1, MIN_COL - 1, -1):
-        new_pos = ord_col_row_to_position(new_col, row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
+    promotes = row == PAWN_PROMOTION_ROW[player]
+    forward = PAWN_FORWARD[player]
+    new_square = square + forward
+    moves_from = MOVE_TABLE[square]
     
-    # Up.
-    for new_row in xrange(row + 1, MAX_ROW + 1):
-        new_pos = ord_col_row_to_position(col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
-        else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
-
-    # Down.
-    for new_row in xrange(row - 1, MIN_ROW - 1, -1):
-        new_pos = ord_col_row_to_position(col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-            moves.append(Move(position, new_pos))
+    # One step forward:
+    if squares[new_square] == EMPTY_CODE:
+        
+        # Promotion:
+        if promotes:
+            moves += PROMOTION_MOVES[square, new_square]
         else:
-            if board.positions_to_pieces[new_pos].player != player:
-                moves.append(Move(position, new_pos))
-            break
-            
+            moves.append(moves_from[new_square])
+        
+        # Two steps forward:
+        if row == PAWN_START_ROW[player] and squares[new_square + forward] == EMPTY_CODE:
+            moves.append(moves_from[new_square + forward])
+    
+    # Capture:
+    is_enemy = IS_PLAYER_PIECE[next_turn(player)]
+    for capture_square in [new_square - 1, new_square + 1]:
+        if is_enemy[squares[capture_square]]:
+            if promotes:
+                moves += PROMOTION_MOVES[square, capture_square]
+            else:
+                moves.append(moves_from[capture_square])
+    
     return moves
 
+# Move generator per piece type code.
+TYPE_CODE_TO_MOVES_GENERATOR = {PAWN_CODE: get_legal_pawn_moves_no_check,
+                                KNIGHT_CODE: get_legal_knight_moves_no_check,
+                                BISHOP_CODE: get_legal_bishop_moves_no_check,
+                                ROOK_CODE: get_legal_rook_moves_no_check,
+                                QUEEN_CODE: get_legal_queen_moves_no_check,
+                                KING_CODE: get_legal_king_moves_no_check}
+
+# Checking moves are generated from the lines to the enemy king, instead of by playing every move.
+
+def get_ray_squares(squares, square, directions):
+    """
+    The squares a slider on square sees along directions: the empty ones, and the first piece of every ray.
+    """
+    ray_squares = set()
+    for direction in directions:
+        ray_square = square + direction
+        while squares[ray_square] == EMPTY_CODE:
+            ray_squares.add(ray_square)
+            ray_square += direction
+        if squares[ray_square] != OFF_BOARD:
+            ray_squares.add(ray_square)
+    return ray_squares
+
+def get_check_squares(squares, king_square, player):
+    """
+    {type code: the squares a piece of that type of player checks the king on king_square from}.
+    """
+    rook_squares = get_ray_squares(squares, king_square, ROOK_DIRECTIONS)
+    bishop_squares = get_ray_squares(squares, king_square, BISHOP_DIRECTIONS)
+    return {PAWN_CODE: set(king_square - PAWN_FORWARD[player] + side for side in [-1, 1]),
+            KNIGHT_CODE: set(king_square + jump for jump in KNIGHT_JUMPS),
+            BISHOP_CODE: bishop_squares,
+            ROOK_CODE: rook_squares,
+            QUEEN_CODE: rook_squares | bishop_squares,
+            KING_CODE: set()}
+
+def get_discovered_check_lines(squares, king_square, player):
+    """
+    {square of a piece of player standing between one of player's sliders and the king on king_square:
+    the empty squares of that line}. Every move of the piece off its line uncovers a check.
+    """
+    lines = {}
+    is_player_piece = IS_PLAYER_PIECE[player]
+    queen = QUEEN_CODE | PLAYER_BITS[player]
+    for directions, slider in [(ROOK_DIRECTIONS, ROOK_CODE | PLAYER_BITS[player]),
+                               (BISHOP_DIRECTIONS, BISHOP_CODE | PLAYER_BITS[player])]:
+        for direction in directions:
+            line = set()
+            line_square = king_square + direction
+            while squares[line_square] == EMPTY_CODE:
+                line.add(line_square)
+                line_square += direction
+            if not is_player_piece[squares[line_square]]:
+                continue
+            blocker_square = line_square
+            line_square += direction
+            while squares[line_square] == EMPTY_CODE:
+                line.add(line_square)
+                line_square += direction
+            if squares[line_square] == slider or squares[line_square] == queen:
+                lines[blocker_square] = line
+    return lines
+
 
 class Move(object):
+    """
+    Immutable. Every possible move is made once, into MOVE_TABLE and PROMOTION_MOVES, and the move
+    generators and get_move hand out those, so the search doesn't allocate moves.
+    key numbers the move, from its squares and promotion, and is its hash.
+    """
+    __slots__ = ["old_pos", "new_pos", "promotion_to_piece", "old_square", "new_square", "key"]
 
     def __init__(self, old_pos, new_pos, promotion_to_piece=None):
         self.old_pos = old_pos
         self.new_pos = new_pos
         self.promotion_to_piece = promotion_to_piece
+        self.old_square = POSITION_TO_SQUARE[old_pos]
+        self.new_square = POSITION_TO_SQUARE[new_pos]
+        promotion_index = POSSIBLE_PROMOTIONS.index(promotion_to_piece) + 1 if promotion_to_piece else 0
+        self.key = (self.old_square * MAILBOX_SIZE + self.new_square) * (len(POSSIBLE_PROMOTIONS) + 1) + \
+                   promotion_index
 
     def __eq__(self, other):
-        if other is None:
-            return False
-        return self.old_pos == other.old_pos and \
-               self.new_pos == other.new_pos and \
-               self.promotion_to_piece == other.promotion_to_piece
+        return self is other or (isinstance(other, Move) and self.key == other.key)
+
+    def __ne__(self, other):
+        return not self == other
 
     def __repr__(self):
         return "[{} => {}]".format(self.old_pos, self.new_pos)
 
     def __hash__(self):
-        return hash((self.old_pos, self.new_pos, self.promotion_to_piece))
+        return self.key
+
+    def __reduce__(self):
+        # Unpickled as the interned move.
+        return get_move, move_to_tuple(self)
+
+# MOVE_TABLE[old_square][new_square] is the move between two board squares, and
+# PROMOTION_MOVES[old_square, new_square] the list of a pawn's promotions, in POSSIBLE_PROMOTIONS order.
+MOVE_TABLE = [[None] * MAILBOX_SIZE for _square in xrange(MAILBOX_SIZE)]
+for _old_square in SQUARES:
+    for _new_square in SQUARES:
+        if _new_square != _old_square:
+            MOVE_TABLE[_old_square][_new_square] = Move(SQUARE_TO_POSITION[_old_square],
+                                                        SQUARE_TO_POSITION[_new_square])
+PROMOTION_MOVES = {}
+for _old_square in SQUARES:
+    for _player in PLAYERS:
+        if square_row(_old_square) == PAWN_PROMOTION_ROW[_player]:
+            for _new_square in [_old_square + PAWN_FORWARD[_player] + side for side in [-1, 0, 1]]:
+                if SQUARE_TO_POSITION[_new_square] is not None:
+                    PROMOTION_MOVES[_old_square, _new_square] = [
+                        Move(SQUARE_TO_POSITION[_old_square], SQUARE_TO_POSITION[_new_square], piece)
+                        for piece in POSSIBLE_PROMOTIONS]
+
+def get_move(old_pos, new_pos, promotion_to_piece=None):
+    """
+    The interned move, e.g. of a move tuple.
+    """
+    return square_move(POSITION_TO_SQUARE[old_pos], POSITION_TO_SQUARE[new_pos], promotion_to_piece)
+
+def move_to_tuple(move):
+    # Picklable (and JSON-ready) form of a move, get_move(*move_tuple) makes it back.
+    return move.old_pos, move.new_pos, move.promotion_to_piece
 
 class Piece(object):
+    """
+    String-keyed view of a single square, as returned by board[position].
+    The board itself only stores piece codes.
+    """
+    __slots__ = ["type", "position", "player"]
     
     def __init__(self, type, position, player):
         self.type = type
@@ -161,148 +327,45 @@ class Piece(object):
     def __eq__(self, piece_char):
         return self.type == piece_char.lower() and self.player == piece_char_to_player(piece_char)
 
-    def get_move(self, new_pos):
-        return Move(self.position, new_pos)
-
 class King(Piece):
+    __slots__ = []
 
     def __init__(self, position, player):
         Piece.__init__(self, KING, position, player)
 
-    def get_all_possible_moves(self):
-        moves = []
-        col, row = position_to_ord_col_row(self.position)
-        for i, j in [(-1, -1), (-1, 1), (1, 1), (1, -1), (-1, 0), (1, 0), (0, -1), (0, 1)]:
-            new_col = col + i
-            new_row = row + j
-            if not is_square_in_board(new_col, new_row):
-                continue
-            new_pos = ord_col_row_to_position(new_col, new_row)
-            moves.append(self.get_move(new_pos))
-        return moves
-    
-    def get_legal_moves(self, board):
-        # Don't check if king is in check in new square. Only if it's taken by a piece of the same player.
-        # Not including castling.
-        return [move for move in self.get_all_possible_moves()
-                if board.positions_to_pieces[move.new_pos].type == EMPTY
-                or board.positions_to_pieces[move.new_pos].player != self.player]
-
-
 class Queen(Piece):
+    __slots__ = []
 
     def __init__(self, position, player):
         Piece.__init__(self, QUEEN, position, player)
     
-    def get_legal_moves(self, board):
-        return get_legal_bishop_moves_no_check(self.player, self.position, board) + \
-               get_legal_rook_moves_no_check(self.player, self.position, board)
-    
 class Knight(Piece):
+    __slots__ = []
 
     def __init__(self, position, player):
         Piece.__init__(self, KNIGHT, position, player)
-
-    def get_all_possible_moves(self):
-        """
-        Doesn't include castling
-        """
-        moves = []
-        col, row = position_to_ord_col_row(self.position)
-        for i, j in [(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)]:
-            new_col = col+i
-            new_row = row+j
-            if not is_square_in_board(new_col, new_row):
-                continue
-            new_pos = ord_col_row_to_position(new_col, new_row)
-            moves.append(self.get_move(new_pos))
-        return moves
-    
-    def get_legal_moves(self, board):
-        return [move for move in self.get_all_possible_moves()
-                if board.positions_to_pieces[move.new_pos].type == EMPTY
-                or board.positions_to_pieces[move.new_pos].player != self.player]
     
 class Rook(Piece):
+    __slots__ = []
 
     def __init__(self, position, player):
         Piece.__init__(self, ROOK, position, player)
 
-    def get_legal_moves(self, board):
-        """
-        Doesn't include castling
-        """
-        return get_legal_rook_moves_no_check(self.player, self.position, board)
-
 class Bishop(Piece):
+    __slots__ = []
 
     def __init__(self, position, player):
         Piece.__init__(self, BISHOP, position, player)
-
-    def get_legal_moves(self, board):
-        return get_legal_bishop_moves_no_check(self.player, self.position, board)
     
 class Pawn(Piece):
-
-    POSSIBLE_PROMOTIONS = [QUEEN, KNIGHT, ROOK, BISHOP]
+    __slots__ = []
 
     def __init__(self, position, player):
         Piece.__init__(self, PAWN, position, player)
 
-    def next_move_promotes(self, row):
-        return (row == 7 and self.player == WHITE) or (row == 2 and self.player == BLACK)
-
-    def get_legal_moves(self, board):
-        """
-        Return string moves for new pawn positions.
-        Not including en-passent.
-        """
-        moves = []
-        col, row = position_to_ord_col_row(self.position)
-
-        if row == MIN_ROW or row == MAX_ROW:
-            return []
-
-        assert row != MIN_ROW
-        assert row != MAX_ROW
-        
-        row_const = (1 if self.player == WHITE else -1)
-        new_row = row + row_const
-        
-        # One step forward:
-        new_pos = ord_col_row_to_position(col, new_row)
-        if board.positions_to_pieces[new_pos].type == EMPTY:
-
-            # Promotion:
-            if self.next_move_promotes(row):
-                moves += [Move(self.position, new_pos, promotion_to_piece=piece)
-                          for piece in self.POSSIBLE_PROMOTIONS]
-            else:
-                moves.append(self.get_move(new_pos))
-
-            # Two steps forward:
-            if (row == 7 and self.player == BLACK) or (row == 2 and self.player == WHITE):
-                new_pos = ord_col_row_to_position(col, new_row + row_const)
-                if board.positions_to_pieces[new_pos].type == EMPTY:
-                    moves.append(self.get_move(new_pos))
-        
-        # Capture:
-        for i in [-1, 1]:
-            new_col = col + i
-            if not is_square_in_board(new_col, new_row):
-                continue
-            new_pos = ord_col_row_to_position(new_col, new_row)
-            if board.positions_to_pieces[new_pos].type != EMPTY and board.positions_to_pieces[new_pos].player != self.player:
-                if self.next_move_promotes(row):
-                    moves += [Move(self.position, new_pos, promotion_to_piece=piece)
-                              for piece in self.POSSIBLE_PROMOTIONS]
-                else:
-                    moves.append(self.get_move(new_pos))
-        
-        return moves
-
 
 class Empty(Piece):
+    __slots__ = []
 
     def __init__(self, position, player = None):
         Piece.__init__(self, EMPTY, position, player)
@@ -316,7 +379,7 @@ def piece_to_class(piece, position, player=None):
         player = piece_char_to_player(piece)
     return piece_class(position, player)
 
-def read_board(filename, turn=WHITE):
+def read_board(filename, turn=WHITE, board_class=None):
     lines = [line.strip() for line in open(filename).readlines() if line.strip()!=""]
     assert len(lines) == 8
     for line in lines:
@@ -324,7 +387,32 @@ def read_board(filename, turn=WHITE):
         for piece in line.lower():
             assert piece in PIECES
     assert turn in PLAYERS
-    return Board(lines, turn)
+    return (board_class or Board)(lines, turn)
+
+def state_to_squares(state):
+    squares = [OFF_BOARD] * MAILBOX_SIZE
+    for i, line in enumerate(state):
+        for j, piece_char in enumerate(line):
+            squares[ord_col_row_to_square(MIN_COL + j, MAX_ROW - i)] = piece_char_to_code(piece_char)
+    return squares
+
+def squares_to_state(squares):
+    return [''.join([code_to_piece_char(squares[ord_col_row_to_square(col, row)])
+                     for col in xrange(MIN_COL, MAX_COL + 1)])
+            for row in xrange(MAX_ROW, MIN_ROW - 1, -1)]
+
+def encode_position(board):
+    """
+    Compact position string: the piece code of every square from a1 to h8, one byte each,
+    followed by the side to move.
+    """
+    return ''.join([chr(board.squares[square]) for square in SQUARES]) + chr(board.turn)
+
+def decode_position(position):
+    squares = [OFF_BOARD] * MAILBOX_SIZE
+    for square, code in zip(SQUARES, position):
+        squares[square] = ord(code)
+    return Board.from_squares(squares, ord(position[len(SQUARES)]))
 
 def state_to_positions_pieces_dict(state):
     d = {}
@@ -335,44 +423,111 @@ def state_to_positions_pieces_dict(state):
             d[position] = piece
     return d
 
-def positions_pieces_dict_to_state(positions_pieces_dict):
-    return [''.join([piece_to_char(positions_pieces_dict[ord_col_row_to_position(col, row)])
-                     for col in xrange(MIN_COL, MAX_COL + 1)])
-            for row in xrange(MAX_ROW, MIN_ROW - 1, -1)]
-
-def get_move_string(move, board_before_step):
-    # Doesn't include:
-    #  Promotion, en-passent, castling.
-    #  Ambiguity: two same pieces that can move to the same square.
-    old_pos = move.old_pos
-    new_pos = move.new_pos
-    piece = board_before_step[old_pos]
-    assert piece.type != EMPTY
-    if board_before_step[new_pos].type == EMPTY:
-        prefix = piece.type.upper() if piece.type != PAWN else ''
+def get_disambiguation(move, board):
+    """
+    The file, rank or both of the square move leaves, telling its piece from the other pieces of the same
+    type that can move to the same square, or '' when there are none.
+    """
+    squares = board.squares
+    player = board.turn
+    old_square = move.old_square
+    code = squares[old_square]
+    other_squares = [square for square in SQUARES if squares[square] == code and square != old_square and
+                     any(other.new_square == move.new_square and board.is_move_legal(other, player)
+                         for other in TYPE_CODE_TO_MOVES_GENERATOR[code & TYPE_MASK](player, square, board))]
+    if not other_squares:
+        return ''
+    if all(square_ord_col(square) != square_ord_col(old_square) for square in other_squares):
+        return move.old_pos[0]
+    if all(square_row(square) != square_row(old_square) for square in other_squares):
+        return move.old_pos[1]
+    return move.old_pos
+
+def get_move_string(move, board_before_step, mates=None):
+    """
+    Algebraic notation of move on board_before_step, disambiguated as needed, with "=Q" for a promotion
+    and "+" or "#" for a check or mate. mates tells whether the move is known to mate, from the search
+    that found it, which saves the escape test. Doesn't include en-passent and castling.
+    The moves notation plays aren't counted as search nodes.
+    """
+    squares = board_before_step.squares
+    type_code = squares[move.old_square] & TYPE_MASK
+    assert type_code != EMPTY_CODE
+    num_nodes = board_before_step.num_nodes
+    capture = 'x' if squares[move.new_square] != EMPTY_CODE else ''
+    if type_code == PAWN_CODE:
+        prefix = move.old_pos[0] + capture if capture else ''
+    elif type_code == KING_CODE:
+        prefix = KING.upper() + capture
     else:
-        prefix = (piece.type.upper() if piece.type != PAWN else old_pos[0]) + 'x'
+        prefix = TYPE_CODE_TO_PIECE[type_code].upper() + get_disambiguation(move, board_before_step) + capture
     
-    board_after_step = board_before_step.make_move(move)
     suffix = ''
     if move.promotion_to_piece:
         suffix += "={}".format(move.promotion_to_piece.upper())
-    if board_after_step.is_in_check():
-        if board_after_step.get_all_legal_moves() == []:
-            suffix += '#'
-        else:
-            suffix += '+'
+    if mates:
+        suffix += '#'
+    else:
+        board_before_step.push(move)
+        if board_before_step.is_in_check():
+            suffix += '+' if mates is not None or board_before_step.has_check_evasion() else '#'
+        board_before_step.pop()
+    board_before_step.num_nodes = num_nodes
     
-    return prefix + new_pos + suffix
+    return prefix + move.new_pos + suffix
     
     
 class Board(object):
+    """
+    Mutable search board. push(move) plays a move in place and pop() takes back the last pushed move,
+    so the solvers walk the search tree on a single board.
+    """
 
     def __init__(self, state, turn):
-        self.state = state
+        self.squares = state_to_squares(state)
         self.turn = turn
-        self.positions_to_pieces = state_to_positions_pieces_dict(self.state)
-        self.internal_check = False
+        self.undo_stack = []
+        self.num_nodes = 0 # Moves pushed so far.
+        self.king_squares = [self.find_king_square(player) for player in PLAYERS]
+        self.num_pieces = self.count_pieces()
+        self.zobrist_hash = self.compute_zobrist_hash()
+
+    @classmethod
+    def from_squares(cls, squares, turn):
+        board = cls.__new__(cls)
+        board.squares = squares
+        board.turn = turn
+        board.undo_stack = []
+        board.num_nodes = 0
+        board.king_squares = [board.find_king_square(player) for player in PLAYERS]
+        board.num_pieces = board.count_pieces()
+        board.zobrist_hash = board.compute_zobrist_hash()
+        return board
+
+    def copy(self):
+        return self.__class__.from_squares(self.squares[:], self.turn)
+
+    def find_king_square(self, player):
+        king_code = KING_CODE | PLAYER_BITS[player]
+        return self.squares.index(king_code) if king_code in self.squares else None
+
+    def count_pieces(self):
+        # Pieces of both players, kings included.
+        return sum(1 for square in SQUARES if self.squares[square] != EMPTY_CODE)
+
+    def compute_zobrist_hash(self):
+        zobrist_hash = ZOBRIST_TURN_KEY if self.turn == WHITE else 0
+        for square in SQUARES:
+            zobrist_hash ^= ZOBRIST_PIECE_KEYS[self.squares[square]][square]
+        return zobrist_hash
+
+    @property
+    def state(self):
+        return squares_to_state(self.squares)
+
+    @property
+    def positions_to_pieces(self):
+        return state_to_positions_pieces_dict(self.state)
     
     def is_in_check(self):
         if self.turn == BLACK:
@@ -380,83 +535,298 @@ class Board(object):
         return self.is_white_in_check()
     
     def is_mate(self):
-        return self.is_in_check() and self.get_all_legal_moves() == []
+        return self.is_in_check() and not self.has_check_evasion()
+    
+    def is_stalemate(self):
+        return not self.is_in_check() and not self.has_any_legal_move()
     
     def get_all_legal_moves(self):
         moves = []
+        player = self.turn
         
-        if self.turn == BLACK:
-            for move in self.get_all_black_legal_moves_no_check():
-                new_board = self.make_move(move)
-                new_board.internal_check = True
-                if not new_board.is_black_in_check():
-                    moves.append(move)
-        else:
-            for move in self.get_all_white_legal_moves_no_check():
-                new_board = self.make_move(move)
-                new_board.internal_check = True
-                if not new_board.is_white_in_check():
-                    moves.append(move)
+        for move in self.get_all_player_legal_moves_no_check(player):
+            self.push(move)
+            if not self.is_player_in_check(player):
+                moves.append(move)
+            self.pop()
         
         return moves
 
+    def is_legal(self, move):
+        """
+        Whether move, e.g. one that was legal in an earlier position, is a legal move of the side to move.
+        """
+        player = self.turn
+        code = self.squares[move.old_square]
+        if not IS_PLAYER_PIECE[player][code]:
+            return False
+        return move in TYPE_CODE_TO_MOVES_GENERATOR[code & TYPE_MASK](player, move.old_square, self) and \
+               self.is_move_legal(move, player)
+
+    def is_move_legal(self, move, player):
+        # move is one of player's moves that ignore checked king.
+        self.push(move)
+        is_legal = not self.is_player_in_check(player)
+        self.pop()
+        return is_legal
+
+    def iter_legal_moves(self):
+        """
+        Yields the legal moves of get_all_legal_moves one at a time, so callers can stop early.
+        The board may be pushed and popped in between, as long as it's back in the same position
+        when the next move is taken.
+        """
+        player = self.turn
+        squares = self.squares
+        is_player_piece = IS_PLAYER_PIECE[player]
+        for square in SQUARES:
+            code = squares[square]
+            if is_player_piece[code]:
+                for move in TYPE_CODE_TO_MOVES_GENERATOR[code & TYPE_MASK](player, square, self):
+                    if self.is_move_legal(move, player):
+                        yield move
+
+    def has_any_legal_move(self):
+        """
+        Whether the side to move has a legal move. Stops at the first one, trying the king's moves
+        first since they're the usual escapes from a check.
+        """
+        player = self.turn
+        king_square = self.king_squares[player]
+        if king_square is not None:
+            for move in get_legal_king_moves_no_check(player, king_square, self):
+                if self.is_move_legal(move, player):
+                    return True
+        squares = self.squares
+        is_player_piece = IS_PLAYER_PIECE[player]
+        for square in SQUARES:
+            code = squares[square]
+            if is_player_piece[code] and square != king_square:
+                for move in TYPE_CODE_TO_MOVES_GENERATOR[code & TYPE_MASK](player, square, self):
+                    if self.is_move_legal(move, player):
+                        return True
+        return False
+
+    def get_checking_moves(self):
+        """
+        The legal moves of the side to move that check the enemy king: direct checks, moves uncovering
+        a slider's line to the king, and checking promotions. A move is only played to test its
+        legality, and for a promotion, whose pawn may uncover the new piece's own line, its check too.
+        """
+        player = self.turn
+        enemy_king_square = self.king_squares[next_turn(player)]
+        if enemy_king_square is None:
+            return []
+        squares = self.squares
+        check_squares = get_check_squares(squares, enemy_king_square, player)
+        discovered_check_lines = get_discovered_check_lines(squares, enemy_king_square, player)
+        is_player_piece = IS_PLAYER_PIECE[player]
+        moves = []
+        for square in SQUARES:
+            code = squares[square]
+            if not is_player_piece[code]:
+                continue
+            type_code = code & TYPE_MASK
+            targets = check_squares[type_code]
+            line = discovered_check_lines.get(square)
+            if not targets and line is None:
+                continue
+            for move in TYPE_CODE_TO_MOVES_GENERATOR[type_code](player, square, self):
+                if move.promotion_to_piece:
+                    self.push(move)
+                    gives_check = self.is_in_check() and not self.is_player_in_check(player)
+                    self.pop()
+                    if gives_check:
+                        moves.append(move)
+                elif (move.new_square in targets or (line is not None and move.new_square not in line)) and \
+                     self.is_move_legal(move, player):
+                    moves.append(move)
+        return moves
+
+    def has_check_evasion(self):
+        """
+        Whether the side to move, in check, has a legal move. Only the king's moves and, against a single
+        checker, the moves capturing it or blocking its line are tried.
+        """
+        player = self.turn
+        king_square = self.king_squares[player]
+        for move in get_legal_king_moves_no_check(player, king_square, self):
+            if self.is_move_legal(move, player):
+                return True
+        checker_squares = self.get_attacker_squares(king_square, next_turn(player))
+        if len(checker_squares) != 1: # Only the king moves out of a double check.
+            return False
+        squares = self.squares
+        targets = set(checker_squares)
+        if squares[checker_squares[0]] & TYPE_MASK in (BISHOP_CODE, ROOK_CODE, QUEEN_CODE):
+            for direction in QUEEN_DIRECTIONS:
+                line = []
+                line_square = king_square + direction
+                while squares[line_square] == EMPTY_CODE:
+                    line.append(line_square)
+                    line_square += direction
+                if line_square == checker_squares[0]:
+                    targets.update(line)
+                    break
+        is_player_piece = IS_PLAYER_PIECE[player]
+        for square in SQUARES:
+            code = squares[square]
+            if is_player_piece[code] and square != king_square:
+                for move in TYPE_CODE_TO_MOVES_GENERATOR[code & TYPE_MASK](player, square, self):
+                    if move.new_square in targets and self.is_move_legal(move, player):
+                        return True
+        return False
+
+    def get_attacker_squares(self, square, player):
+        """
+        The squares of the pieces of player attacking square, found as is_square_attacked finds the first.
+        """
+        squares = self.squares
+        player_bits = PLAYER_BITS[player]
+        attacker_squares = []
+        for offsets, attacker in [(PAWN_ATTACKER_OFFSETS[player], PAWN_CODE | player_bits),
+                                  (KNIGHT_JUMPS, KNIGHT_CODE | player_bits),
+                                  (KING_STEPS, KING_CODE | player_bits)]:
+            attacker_squares += [square + offset for offset in offsets if squares[square + offset] == attacker]
+        queen = QUEEN_CODE | player_bits
+        for directions, slider in [(ROOK_DIRECTIONS, ROOK_CODE | player_bits),
+                                   (BISHOP_DIRECTIONS, BISHOP_CODE | player_bits)]:
+            for direction in directions:
+                attacker_square = square + direction
+                while squares[attacker_square] == EMPTY_CODE:
+                    attacker_square += direction
+                if squares[attacker_square] == slider or squares[attacker_square] == queen:
+                    attacker_squares.append(attacker_square)
+        return attacker_squares
+
+    def is_player_in_check(self, player):
+        return self.is_square_attacked(self.king_squares[player], next_turn(player))
+
+    def is_square_attacked(self, square, player):
+        """
+        Whether a piece of player attacks square. Looks outward from square for pawns, knights and the
+        king, and along the rays for sliders, instead of generating player's moves.
+        """
+        squares = self.squares
+        player_bits = PLAYER_BITS[player]
+
+        pawn = PAWN_CODE | player_bits
+        for offset in PAWN_ATTACKER_OFFSETS[player]:
+            if squares[square + offset] == pawn:
+                return True
+
+        knight = KNIGHT_CODE | player_bits
+        for jump in KNIGHT_JUMPS:
+            if squares[square + jump] == knight:
+                return True
+
+        king = KING_CODE | player_bits
+        for step in KING_STEPS:
+            if squares[square + step] == king:
+                return True
+
+        queen = QUEEN_CODE | player_bits
+        for directions, slider in [(ROOK_DIRECTIONS, ROOK_CODE | player_bits),
+                                   (BISHOP_DIRECTIONS, BISHOP_CODE | player_bits)]:
+            for direction in directions:
+                attacker_square = square + direction
+                while squares[attacker_square] == EMPTY_CODE:
+                    attacker_square += direction
+                if squares[attacker_square] == slider or squares[attacker_square] == queen:
+                    return True
+
+        return False
+
     def is_black_in_check(self):
-        if not self.internal_check:
-            assert self.turn == BLACK
-        black_king_position = next(position for position, piece
-                                   in self.positions_to_pieces.iteritems() if piece == 'K')
-        return black_king_position in [move.new_pos for move in self.get_all_white_legal_moves_no_check()]
+        assert self.turn == BLACK
+        return self.is_player_in_check(BLACK)
     
     def is_white_in_check(self):
-        if not self.internal_check:
-            assert self.turn == WHITE
-        white_king_position = next(position for position, piece
-                                   in self.positions_to_pieces.iteritems() if piece == 'k')
-        return white_king_position in [move.new_pos for move in self.get_all_black_legal_moves_no_check()]
+        assert self.turn == WHITE
+        return self.is_player_in_check(WHITE)
     
-    def get_all_black_legal_moves_no_check(self):
+    def get_all_player_legal_moves_no_check(self, player):
         # Legal moves ignore checked king.
         moves = []
-        for position in self.positions_to_pieces:
-            piece = self.positions_to_pieces[position]
-            if piece.player == BLACK:
-                moves += piece.get_legal_moves(self)
+        squares = self.squares
+        is_player_piece = IS_PLAYER_PIECE[player]
+        for square in SQUARES:
+            code = squares[square]
+            if is_player_piece[code]:
+                moves += TYPE_CODE_TO_MOVES_GENERATOR[code & TYPE_MASK](player, square, self)
         return moves
     
-    def get_all_white_legal_moves_no_check(self):
-        # Legal moves ignore checked king.
-        moves = []
-        for position in self.positions_to_pieces:
-            piece = self.positions_to_pieces[position]
-            if piece.player == WHITE:
-                moves += piece.get_legal_moves(self)
-        return moves
+    def get_all_black_legal_moves_no_check(self):
+        return self.get_all_player_legal_moves_no_check(BLACK)
     
-    def make_move(self, move):
-        new_positions_to_pieces_dict = copy.copy(self.positions_to_pieces)
-        old_pos = move.old_pos
-        new_pos = move.new_pos
+    def get_all_white_legal_moves_no_check(self):
+        return self.get_all_player_legal_moves_no_check(WHITE)
+
+    def push(self, move):
+        squares = self.squares
+        old_square = move.old_square
+        new_square = move.new_square
+        moved_piece = squares[old_square]
+        captured_piece = squares[new_square]
         
-        assert new_positions_to_pieces_dict[old_pos].type != EMPTY
-        assert new_positions_to_pieces_dict[old_pos].player == self.turn
-        assert new_positions_to_pieces_dict[new_pos].player != self.turn
+        assert IS_PLAYER_PIECE[self.turn][moved_piece]
+        assert not IS_PLAYER_PIECE[self.turn][captured_piece]
         
-        new_positions_to_pieces_dict[new_pos] = copy.copy(new_positions_to_pieces_dict[old_pos])
-        new_positions_to_pieces_dict[new_pos].position = new_pos
+        self.num_nodes += 1
+        self.undo_stack.append((move, moved_piece, captured_piece, self.zobrist_hash))
+        squares[new_square] = moved_piece
+        if moved_piece & TYPE_MASK == KING_CODE:
+            self.king_squares[self.turn] = new_square
+        if captured_piece != EMPTY_CODE:
+            self.num_pieces -= 1
 
         # Promotion:
         if move.promotion_to_piece:
-            _, row = position_to_ord_col_row(new_pos)
-            assert (self.turn == WHITE and row == 8) or (self.turn == BLACK and row == 1)
-            new_positions_to_pieces_dict[new_pos] = piece_to_class(move.promotion_to_piece, new_pos, self.turn)
+            assert (self.turn == WHITE and square_row(new_square) == MAX_ROW) or \
+                   (self.turn == BLACK and square_row(new_square) == MIN_ROW)
+            squares[new_square] = piece_code(move.promotion_to_piece, self.turn)
+
+        squares[old_square] = EMPTY_CODE
+        self.turn = next_turn(self.turn)
+        self.zobrist_hash ^= ZOBRIST_PIECE_KEYS[moved_piece][old_square] ^ \
+                             ZOBRIST_PIECE_KEYS[captured_piece][new_square] ^ \
+                             ZOBRIST_PIECE_KEYS[squares[new_square]][new_square] ^ ZOBRIST_TURN_KEY
+
+    def pop(self):
+        move, moved_piece, captured_piece, self.zobrist_hash = self.undo_stack.pop()
+        if move is None:
+            # A null move.
+            self.turn = next_turn(self.turn)
+            return None
+        self.squares[move.old_square] = moved_piece
+        self.squares[move.new_square] = captured_piece
+        self.turn = next_turn(self.turn)
+        if moved_piece & TYPE_MASK == KING_CODE:
+            self.king_squares[self.turn] = move.old_square
+        if captured_piece != EMPTY_CODE:
+            self.num_pieces += 1
+        return move
+
+    def push_null_move(self):
+        # The side to move passes, to find the other side's threat. Not legal when in check.
+        # Kept on the undo stack as a None move, so that pop undoes it in turn with the others.
+        assert not self.is_in_check()
+        self.undo_stack.append((None, EMPTY_CODE, EMPTY_CODE, self.zobrist_hash))
+        self.turn = next_turn(self.turn)
+        self.zobrist_hash ^= ZOBRIST_TURN_KEY
+
+    def pop_null_move(self):
+        move = self.pop()
+        assert move is None
 
-        new_positions_to_pieces_dict[old_pos] = Empty(old_pos)
-        new_state = positions_pieces_dict_to_state(new_positions_to_pieces_dict)
-        
-        return Board(new_state, next_turn(self.turn))
+    def make_move(self, move):
+        new_board = self.copy()
+        new_board.push(move)
+        new_board.undo_stack = []
+        return new_board
     
     def __getitem__(self, position):
-        return self.positions_to_pieces[position]
+        return piece_to_class(code_to_piece_char(self.squares[POSITION_TO_SQUARE[position]]), position)
     
     def __str__(self):
         return """ +-----------------+
@@ -467,14 +837,47 @@ class Board(object):
     def __repr__(self):
         return str(self)
 
-def single_move_gives_mate(board, ret_step = False):
-    for step1 in board.get_all_legal_moves():
-        board2 = board.make_move(step1)
-        if board2.is_mate():
-            if ret_step:
-                return step1
-            return True
-    return False
+def move_gives_mate(board, move):
+    board.push(move)
+    is_mate = board.is_mate()
+    board.pop()
+    return is_mate
+
+def get_mating_lines(board, lines):
+    """
+    Whether each line, a tuple of moves played from board, ends in mate. Lines sharing their first moves
+    should come one after the other, which are then played once for all of them.
+    The reference leaf evaluator, LeafEvaluation.get_mating_lines_numpy does the same in batches.
+    """
+    mates = []
+    played = ()
+    for line in lines:
+        prefix = line[:-1]
+        if prefix != played:
+            for _ in played:
+                board.pop()
+            for move in prefix:
+                board.push(move)
+            played = prefix
+        mates.append(move_gives_mate(board, line[-1]))
+    for _ in played:
+        board.pop()
+    return mates
+
+def get_mate_stalemate_flags(board, moves):
+    """
+    (mate, stalemate) lists of whether each move of the side to move on board mates or stalemates the
+    other side. The reference evaluator, LeafEvaluation.get_mate_stalemate_flags_numpy does the same in one
+    batch.
+    """
+    mates = []
+    stalemates = []
+    for move in moves:
+        board.push(move)
+        mates.append(board.is_mate())
+        stalemates.append(board.is_stalemate())
+        board.pop()
+    return mates, stalemates
 
 def print_working_on_step(step_string):
     print "Working on step: 1.", step_string
@@ -490,39 +893,11 @@ def print_didnt_solve():
     print "Didn't solve :("
     print "Check maybe solution involves promotion, castling or en-passent."
 
-def solve_mate_in_two(board, verbose=True):
-    assert board.turn == WHITE
-    if verbose:
-        print board
-        print
-    for step1 in board.get_all_legal_moves():
-        if verbose:
-            step_string = get_move_string(step1, board)
-            print_working_on_step(step_string)
-        board2 = board.make_move(step1)
-        all_legal_moves = board2.get_all_legal_moves()
-        if not all_legal_moves and not board2.is_in_check():
-            if verbose:
-                print "  Stale mate"
-            continue
-
-        found = False
-        for step2 in all_legal_moves:
-            board3 = board2.make_move(step2)
-            if not single_move_gives_mate(board3):
-                if verbose:
-                    print_can_handle_with_step(step2, board2)
-                found = True
-                break
-        if not found:
-            if verbose:
-                print_success(step_string)
-            return step1
-    
-    if verbose:
-        print_didnt_solve()
-    
-    return None
+def print_transposition_table_stats(transposition_table, move_ordering=None):
+    print transposition_table
+    if move_ordering is not None:
+        print move_ordering
+    print
 
 PRINT_SOLUTIONS_PREFIX = "    "
 
@@ -569,161 +944,745 @@ def print_solutions_doubled_dict(solutions_doubled_dict, board_before_step2, pre
             print "{}  {}. {}".format(PRINT_SOLUTIONS_PREFIX * (prefix_level + 1),
                                       prefix_level + 2, get_move_string(step5, board_after_step4))
         
-def solve_mate_in_three(board, verbose=True):
-    assert board.turn == WHITE
-    if verbose:
-        print board
-        print
-    for step1 in board.get_all_legal_moves():
-        if verbose:
-            step_string = get_move_string(step1, board)
-            print_working_on_step(step_string)
-        board2 = board.make_move(step1)
-        all_legal_moves = board2.get_all_legal_moves()
-        if not all_legal_moves and not board2.is_in_check():
-            if verbose:
-                print "  Stale mate"
-            continue
+# Kinds of the progress events of the solvers. A candidate is a key, or the first move of a helpmate.
+CANDIDATE_STARTED = "candidate_started"
+CANDIDATE_REFUTED = "candidate_refuted"
+CANDIDATE_SOLVED = "candidate_solved"
+SOLUTION_FOUND = "solution_found"
+# A shallower iteration of the mate-in-N search found no mate within depth moves.
+DEPTH_COMPLETED = "depth_completed"
+FINISHED = "finished"
+
+
+class SolverEvent(object):
+    """
+    Progress event of a solver, passed to its on_event callback. move is the candidate, refutation the
+    defence that refuted it (None for a stalemate, a mate on the wrong side or a helpmate first move
+    without solutions), and solution a helpmate solution string or, on FINISHED, the SolveResult.
+    On DEPTH_COMPLETED, depth is the number of moves searched and refutations the (candidate, refutation)
+    strings of every candidate at that depth, the refutation None when unknown or for a stalemate.
+    Moves come with their algebraic notation, as the board they were played on has moved on since.
+    """
+
+    def __init__(self, kind, move=None, move_string=None, refutation=None, refutation_string=None,
+                 solution=None, nodes=0, depth=None, refutations=None):
+        self.kind = kind
+        self.move = move
+        self.move_string = move_string
+        self.refutation = refutation
+        self.refutation_string = refutation_string
+        self.solution = solution
+        self.nodes = nodes
+        self.depth = depth
+        self.refutations = refutations
 
-        solutions_dict = {}
-        found = False
-        for step2 in all_legal_moves:
-            board3 = board2.make_move(step2)
-            step3 = solve_mate_in_two(board3, False)
-            if step3 == None:
-                if verbose:
-                    print_can_handle_with_step(step2, board2)
-                found = True
+    def __repr__(self):
+        if self.kind == DEPTH_COMPLETED:
+            return "{}: no mate in {}, {} candidates refuted".format(self.kind, self.depth,
+                                                                     len(self.refutations))
+        details = [self.move_string] if self.move_string else []
+        if self.refutation_string:
+            details.append("by " + self.refutation_string)
+        if self.solution is not None:
+            details.append(str(self.solution))
+        return "{}: {}".format(self.kind, " ".join(details))
+
+def emit_depth_completed(on_event, board, depth, refutations):
+    # No key on board mates within depth moves. refutations maps those that were tried to their refutations.
+    if on_event is None:
+        return
+    refutation_strings = []
+    for move in board.get_all_legal_moves():
+        refutation = refutations.get(move)
+        refutation_string = None
+        if refutation is not None:
+            board.push(move)
+            refutation_string = get_move_string(refutation, board)
+            board.pop()
+        refutation_strings.append((get_move_string(move, board), refutation_string))
+    on_event(SolverEvent(DEPTH_COMPLETED, nodes=board.num_nodes, depth=depth, refutations=refutation_strings))
+
+def emit_event(on_event, kind, board, move=None, refutation=None, solution=None):
+    # move was played on board, and refutation after it. Called with neither pushed.
+    if on_event is None:
+        return
+    move_string = get_move_string(move, board) if move is not None else None
+    refutation_string = None
+    if refutation is not None:
+        board.push(move)
+        refutation_string = get_move_string(refutation, board)
+        board.pop()
+    on_event(SolverEvent(kind, move, move_string, refutation, refutation_string, solution, board.num_nodes))
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+class CancellationToken(object):
+    """
+    Cooperative cancellation of a search: cancel() may be called from another thread, and the search
+    raises SearchCancelled at its next check, every node of the mate search and every second and third
+    move of the helpmate and selfmate solvers. The board is then left with the moves pushed so far.
+    stop_reason says why the search was stopped.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.stop_reason = None
+
+    def cancel(self, stop_reason="cancelled"):
+        self.stop_reason = stop_reason
+        self.cancelled = True
+
+    def should_stop(self, board):
+        return self.cancelled
+
+    def check(self, board):
+        if self.should_stop(board):
+            raise SearchCancelled()
+
+# Nodes searched between two looks at the clock of a SearchBudget.
+NODES_PER_TIME_CHECK = 1000
+
+
+class SearchBudget(CancellationToken):
+    """
+    CancellationToken that also cancels itself once the search has pushed max_nodes moves, counted
+    from its first check, or time_limit seconds have passed since it was made. Either may be None.
+    Most checks only compare the node count of the board, the clock is read every NODES_PER_TIME_CHECK
+    nodes. A parent CancellationToken cancels the budget too.
+    """
+
+    def __init__(self, max_nodes=None, time_limit=None, parent=None):
+        CancellationToken.__init__(self)
+        self.parent = parent
+        self.max_nodes = max_nodes
+        self.deadline = time.time() + time_limit if time_limit is not None else None
+        self.node_limit = None
+        self.next_check_nodes = 0
+
+    def should_stop(self, board):
+        return self.cancelled or (board.num_nodes >= self.next_check_nodes and self.check_budget(board))
+
+    def check_budget(self, board):
+        if self.parent is not None and self.parent.cancelled:
+            self.cancel(self.parent.stop_reason)
+            return True
+        num_nodes = board.num_nodes
+        if self.node_limit is None:
+            self.node_limit = num_nodes + self.max_nodes if self.max_nodes is not None else float("inf")
+        if num_nodes >= self.node_limit:
+            self.cancel("max_nodes")
+        elif self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("time_limit")
+        else:
+            self.next_check_nodes = min(self.node_limit, num_nodes + NODES_PER_TIME_CHECK)
+        return self.cancelled
+
+class MateSolution(object):
+    """
+    Solution tree of a directmate: the attacker's move, and the solution following every defence to it.
+    defences maps each defence to its MateSolution. It is empty when move mates.
+    """
+    __slots__ = ["move", "defences"]
+
+    def __init__(self, move, defences):
+        self.move = move
+        self.defences = defences
+
+    def depth(self):
+        return 1 + max([solution.depth() for solution in self.defences.itervalues()] or [0])
+
+    def __repr__(self):
+        return "MateSolution: {}, {} defences".format(self.move, len(self.defences))
+
+    def __reduce__(self):
+        return MateSolution, (self.move, self.defences)
+
+# Move ordering scores, on top of the history score of a move.
+KILLER_MOVE_BONUS = 1 << 30
+CHECK_BONUS = 1 << 28
+CAPTURE_BONUS = 1 << 27 # Also given to promotions.
+NUM_KILLER_MOVES = 2
+
+def move_ordering_key(move):
+    return move.old_square * MAILBOX_SIZE + move.new_square
+
+
+class MoveOrdering(object):
+    """
+    Orders the moves of the mate search so that the move ending a node comes early: the attacker's
+    mating replies and the defender's refutations found so far first (two killer moves per player and
+    remaining depth, then a history score per move), then checks, captures and promotions.
+    The tables are shared by the whole search, so the defence that refuted one key candidate is the
+    first one tried against the next candidate.
+
+    Disabled, the moves keep their generation order, but cutoffs are still counted for comparison.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.killers = [{}, {}] # Indexed by player, then by remaining depth.
+        self.history = [{}, {}] # Indexed by player.
+        self.num_cutoffs = 0
+        self.num_first_move_cutoffs = 0
+        self.num_moves_before_cutoffs = 0
+
+    def order_moves(self, board, moves, depth, checks_first=False):
+        """
+        Returns moves, the legal moves of the side to move on board, best first.
+        checks_first makes checks go first too, at the cost of playing every move to test it.
+        """
+        if not self.enabled or len(moves) < 2:
+            return moves
+        player = board.turn
+        killers = self.killers[player].get(depth, ())
+        history = self.history[player]
+        squares = board.squares
+        scores = []
+        for move in moves:
+            key = move_ordering_key(move)
+            score = history.get(key, 0)
+            if key in killers:
+                score += KILLER_MOVE_BONUS
+            if squares[move.new_square] != EMPTY_CODE or move.promotion_to_piece:
+                score += CAPTURE_BONUS
+            if checks_first:
+                board.push(move)
+                if board.is_in_check():
+                    score += CHECK_BONUS
+                board.pop()
+            scores.append(score)
+        order = sorted(xrange(len(moves)), key=scores.__getitem__, reverse=True)
+        return [moves[index] for index in order]
+
+    def record_cutoff(self, player, move, depth, move_index):
+        """
+        move of player ended its node at remaining depth, as the move_index-th move tried there:
+        a mating reply of the attacker or a refutation of the defender.
+        """
+        self.num_cutoffs += 1
+        self.num_moves_before_cutoffs += move_index
+        if move_index == 0:
+            self.num_first_move_cutoffs += 1
+        key = move_ordering_key(move)
+        history = self.history[player]
+        history[key] = history.get(key, 0) + depth * depth
+        killers = self.killers[player].setdefault(depth, [])
+        if key not in killers:
+            killers.insert(0, key)
+            del killers[NUM_KILLER_MOVES:]
+
+    def __str__(self):
+        return "Move ordering{}: {} cutoffs, {:.1%} on the first move, {:.2f} moves tried before a cutoff".format(
+            "" if self.enabled else " (disabled)", self.num_cutoffs,
+            float(self.num_first_move_cutoffs) / self.num_cutoffs if self.num_cutoffs else 0.0,
+            float(self.num_moves_before_cutoffs) / self.num_cutoffs if self.num_cutoffs else 0.0)
+
+def search_mate(board, depth, transposition_table, move_ordering=None, cancel_token=None, tablebases=None,
+                refutations=None):
+    """
+    Returns a MateSolution for the side to move mating within depth moves, or None.
+    Positions covered by tablebases, a Tablebase.TablebaseSet, are answered from the tables.
+    refutations, a dict, gets the refutation of every key tried, see search_defences.
+    """
+    found, solution = transposition_table.probe(board.zobrist_hash, board.turn, depth)
+    if found:
+        return solution
+    if tablebases is not None and board.num_pieces <= tablebases.max_pieces:
+        found, solution = tablebases.probe(board, depth)
+        if found:
+            return solution
+    if cancel_token is not None and cancel_token.should_stop(board):
+        raise SearchCancelled()
+    
+    solution = None
+    # Only a check mates in one.
+    keys = board.get_all_legal_moves() if depth > 1 else board.get_checking_moves()
+    if move_ordering is not None:
+        keys = move_ordering.order_moves(board, keys, depth, depth > 1)
+    for key_index, key in enumerate(keys):
+        defences = search_defences(board, key, depth, transposition_table, move_ordering, cancel_token, tablebases,
+                                   refutations)
+        if defences is not None:
+            solution = MateSolution(key, defences)
+            if move_ordering is not None:
+                move_ordering.record_cutoff(board.turn, key, depth, key_index)
+            break
+    
+    transposition_table.store(board.zobrist_hash, board.turn, depth, solution)
+    return solution
+
+def search_defences(board, key, depth, transposition_table, move_ordering=None, cancel_token=None,
+                    tablebases=None, refutations=None):
+    """
+    Plays key and returns the defences dict of its MateSolution, or None when key doesn't mate within
+    depth moves: it stalemates, or some defence escapes. Stops at the first escaping defence.
+    refutations, a dict, then maps key to that defence, or to None for a stalemate or a mate in one
+    missed.
+    """
+    board.push(key)
+    
+    if depth == 1:
+        # Mates in one are found without listing the defences, the first escape is enough.
+        defences = {} if board.is_mate() else None
+        board.pop()
+        if defences is None and refutations is not None:
+            refutations[key] = None
+        return defences
+    
+    all_legal_moves = board.get_all_legal_moves()
+    if not all_legal_moves:
+        defences = {} if board.is_in_check() else None
+    else:
+        if move_ordering is not None:
+            all_legal_moves = move_ordering.order_moves(board, all_legal_moves, depth)
+        defences = {}
+        for defence_index, defence in enumerate(all_legal_moves):
+            board.push(defence)
+            solution = search_mate(board, depth - 1, transposition_table, move_ordering, cancel_token, tablebases)
+            board.pop()
+            if solution is None:
+                if move_ordering is not None:
+                    move_ordering.record_cutoff(board.turn, defence, depth, defence_index)
+                if refutations is not None:
+                    refutations[key] = defence
+                defences = None
                 break
-            solutions_dict[step2] = step3
-        if not found:
-            if verbose:
-                print_success(step_string)
-                print_solutions(solutions_dict, board2)
-            return step1, solutions_dict
+            defences[defence] = solution
     
-    if verbose:
+    board.pop()
+    if defences is None and refutations is not None and key not in refutations:
+        refutations[key] = None
+    return defences
+
+# Transposition table of the threat of a solution printed without its search's table.
+THREAT_TT_SIZE_MB = 16
+
+def search_threat(board, depth, transposition_table, move_ordering=None, cancel_token=None, tablebases=None):
+    """
+    The threat of the attacker on board, where the defender is to move: the MateSolution of the shortest
+    mate within depth moves were the defender to pass, or None when there is none (a zugzwang).
+    The defender may not pass when in check, which the caller makes sure of.
+    """
+    # Cancelled, the null move is left on the undo stack with the moves of the search, for the caller
+    # to pop.
+    board.push_null_move()
+    solution = None
+    for threat_depth in xrange(1, depth + 1):
+        solution = search_mate(board, threat_depth, transposition_table, move_ordering, cancel_token, tablebases)
+        if solution is not None:
+            break
+    board.pop_null_move()
+    return solution
+
+def search_threat_mate(board, threat, depth, transposition_table, move_ordering=None, cancel_token=None,
+                       tablebases=None):
+    """
+    The MateSolution of the threat move on board, after a defence, when it's still legal and still mates
+    within depth moves, or None when the defence parried it.
+    """
+    found, solution = transposition_table.probe(board.zobrist_hash, board.turn, depth)
+    if found:
+        return solution
+    if not board.is_legal(threat):
+        return None
+    defences = search_defences(board, threat, depth, transposition_table, move_ordering, cancel_token, tablebases)
+    if defences is None:
+        return None
+    solution = MateSolution(threat, defences)
+    transposition_table.store(board.zobrist_hash, board.turn, depth, solution)
+    return solution
+
+def print_threat(board_before_step2, depth, transposition_table=None):
+    """
+    Prints the threat of the key, as in a composer's solution: "Threat: 2. X", or that the key is a
+    zugzwang. Nothing is printed after a checking key, which threatens nothing.
+    """
+    if board_before_step2.is_in_check():
+        return
+    if transposition_table is None:
+        transposition_table = TranspositionTable(THREAT_TT_SIZE_MB)
+    num_nodes = board_before_step2.num_nodes
+    threat = search_threat(board_before_step2, depth - 1, transposition_table)
+    board_before_step2.num_nodes = num_nodes
+    if threat is None:
+        print "  Zugzwang: no threat.\n"
+        return
+    board_before_step2.push_null_move()
+    threat_string = get_move_string(threat.move, board_before_step2, not threat.defences)
+    board_before_step2.pop_null_move()
+    print "  Threat: 2. {}\n".format(threat_string)
+
+def print_solution_tree(solution, board_before_step2, prefix_level=1):
+    for step2, step2_solution in solution.defences.iteritems():
+        print "{}{}... {}".format(PRINT_SOLUTIONS_PREFIX * prefix_level,
+                                  prefix_level, get_move_string(step2, board_before_step2))
+        board_before_step2.push(step2)
+        print "{}  {}. {}".format(PRINT_SOLUTIONS_PREFIX * prefix_level, prefix_level + 1,
+                                  get_move_string(step2_solution.move, board_before_step2,
+                                                  not step2_solution.defences))
+        board_before_step2.push(step2_solution.move)
+        print_solution_tree(step2_solution, board_before_step2, prefix_level + 1)
+        board_before_step2.pop()
+        board_before_step2.pop()
+
+def solution_to_solutions_dict(solution):
+    return dict((step2, step2_solution.move) for step2, step2_solution in solution.defences.iteritems())
+
+def solution_to_solutions_doubled_dict(solution):
+    return dict((step2, (step2_solution.move, solution_to_solutions_dict(step2_solution)))
+                for step2, step2_solution in solution.defences.iteritems())
+
+def print_mate_solution(solution, board_before_step2, transposition_table=None):
+    """
+    Prints the threat of the key and the solution tree. transposition_table, the one of the search when
+    given, makes finding the threat quick.
+    """
+    depth = solution.depth()
+    if depth >= 2:
+        print_threat(board_before_step2, depth, transposition_table)
+    if depth == 3:
+        print_solutions(solution_to_solutions_dict(solution), board_before_step2)
+    elif depth == 4:
+        print_solutions_doubled_dict(solution_to_solutions_doubled_dict(solution), board_before_step2)
+        print
+    elif depth > 4:
+        print_solution_tree(solution, board_before_step2)
+        print
+
+def print_mate_in_n_result(solution, board, n):
+    if solution is not None:
+        if solution.depth() < n:
+            print "Found a mate in {}.".format(solution.depth())
+        print_success(get_move_string(solution.move, board))
+        board.push(solution.move)
+        print_mate_solution(solution, board)
+        board.pop()
+    else:
         print_didnt_solve()
-    
+
+MATE_IN_PREFIX = "mate_in_"
+
+def get_mate_in_n(etude_type):
+    """
+    N of a mate_in_<N> etude type, None for other types.
+    """
+    if etude_type is not None and etude_type.startswith(MATE_IN_PREFIX) and \
+       etude_type[len(MATE_IN_PREFIX):].isdigit():
+        return int(etude_type[len(MATE_IN_PREFIX):])
     return None
 
-def solve_mate_in_four(board, verbose=True):
+def solve_mate_in_n(board, n, verbose=True, transposition_table=None, stats=None, move_ordering=None,
+                    on_event=None, cancel_token=None, tablebases=None, threats=True):
+    """
+    Searches mates in 1, 2, ... n moves in turn, so the shortest mate is found first. Every iteration
+    leaves its proven results in transposition_table, and its killer moves in move_ordering, for the
+    deeper ones. The keys at the root keep their generation order, so the first mating key is found.
+    A SearchStats given as stats gets a timeline span for every key and defence tried at depth n.
+    on_event gets a SolverEvent for every key tried at depth n, for the solution, and a DEPTH_COMPLETED
+    one with the refutation of every key after each shallower depth without a mate.
+    Raises SearchCancelled once cancel_token, which may be a SearchBudget, is cancelled.
+    tablebases, a Tablebase.TablebaseSet, answers the positions of the endings it covers.
+    With threats, the threat of every key at depth n that survives its first defence, found by letting the
+    defender pass, is tried first after each further defence, and the defence only gets a full search when
+    it parries the threat. The solution is printed with the threat of its key.
+    Returns the MateSolution, or None.
+    """
     assert board.turn == WHITE
+    assert n >= 1
+    if transposition_table is None:
+        transposition_table = TranspositionTable()
+    if move_ordering is None:
+        move_ordering = MoveOrdering()
     if verbose:
         print board
         print
+    
+    for depth in xrange(1, n):
+        refutations = {} if on_event is not None else None
+        solution = search_mate(board, depth, transposition_table, move_ordering, cancel_token, tablebases,
+                               refutations)
+        if solution is not None:
+            emit_event(on_event, CANDIDATE_SOLVED, board, solution.move)
+            if verbose:
+                print "Found a mate in {}.".format(depth)
+                step_string = get_move_string(solution.move, board)
+                print_success(step_string)
+                board.push(solution.move)
+                print_mate_solution(solution, board, transposition_table)
+                board.pop()
+                print_transposition_table_stats(transposition_table, move_ordering)
+            return solution
+        emit_depth_completed(on_event, board, depth, refutations)
+    
     for step1 in board.get_all_legal_moves():
         if verbose:
             step_string = get_move_string(step1, board)
             print_working_on_step(step_string)
-        board2 = board.make_move(step1)
-        all_legal_moves = board2.get_all_legal_moves()
-        if not all_legal_moves and not board2.is_in_check():
+        if stats is not None:
+            stats.begin("key", step1, board)
+        emit_event(on_event, CANDIDATE_STARTED, board, step1)
+        board.push(step1)
+        if board.is_stalemate():
             if verbose:
                 print "  Stale mate"
+            board.pop()
+            if stats is not None:
+                stats.end(board, "stalemate")
+            emit_event(on_event, CANDIDATE_REFUTED, board, step1)
             continue
-
-        solutions_doubled_dict = {}
-        found = False
-        for step2 in all_legal_moves:
-            print "  Working on step2: 1...", get_move_string(step2, board2)
-            board3 = board2.make_move(step2)
-            res = solve_mate_in_three(board3, False)
-            if res == None:
-                if verbose:
-                    print_can_handle_with_step(step2, board2)
-                found = True
-                break
-            solutions_doubled_dict[step2] = res
-        if not found:
+        all_legal_moves = board.get_all_legal_moves()
+        
+        refutation = None
+        if n == 1:
+            defences = None if all_legal_moves else {}
+        else:
+            # Looked for once the key has survived its first defence, as most keys are refuted by it.
+            threat = None
+            find_threat = threats and not board.is_in_check()
+            defences = {}
+            for step2_index, step2 in enumerate(move_ordering.order_moves(board, all_legal_moves, n)):
+                if verbose and n > 3:
+                    print "  Working on step2: 1...", get_move_string(step2, board)
+                if find_threat and step2_index == 1:
+                    threat = search_threat(board, n - 1, transposition_table, move_ordering, cancel_token,
+                                           tablebases)
+                if stats is not None:
+                    stats.begin("defence", step2, board)
+                board.push(step2)
+                step2_solution = None
+                if threat is not None:
+                    step2_solution = search_threat_mate(board, threat.move, n - 1, transposition_table,
+                                                        move_ordering, cancel_token, tablebases)
+                if step2_solution is None:
+                    step2_solution = search_mate(board, n - 1, transposition_table, move_ordering, cancel_token,
+                                                 tablebases)
+                board.pop()
+                if stats is not None:
+                    stats.end(board, "refutation" if step2_solution is None else "mated")
+                if step2_solution is None:
+                    move_ordering.record_cutoff(board.turn, step2, n, step2_index)
+                    if verbose:
+                        print_can_handle_with_step(step2, board)
+                    refutation = step2
+                    defences = None
+                    break
+                defences[step2] = step2_solution
+        
+        if defences is not None:
+            solution = MateSolution(step1, defences)
             if verbose:
                 print_success(step_string)
-                print_solutions_doubled_dict(solutions_doubled_dict, board2)
-            return step1, solutions_doubled_dict
+                print_mate_solution(solution, board, transposition_table)
+                print_transposition_table_stats(transposition_table, move_ordering)
+            board.pop()
+            if stats is not None:
+                stats.end(board, "solution")
+            emit_event(on_event, CANDIDATE_SOLVED, board, step1)
+            transposition_table.store(board.zobrist_hash, board.turn, n, solution)
+            return solution
+        board.pop()
+        if stats is not None:
+            stats.end(board, "refuted")
+        emit_event(on_event, CANDIDATE_REFUTED, board, step1, refutation)
     
     if verbose:
         print_didnt_solve()
+        print_transposition_table_stats(transposition_table, move_ordering)
     
+    transposition_table.store(board.zobrist_hash, board.turn, n, None)
     return None
 
+def solve_mate_in_two(board, verbose=True, transposition_table=None):
+    """
+    Returns the key move, or None.
+    """
+    solution = solve_mate_in_n(board, 2, verbose, transposition_table)
+    return solution.move if solution is not None else None
+
+def solve_mate_in_three(board, verbose=True, transposition_table=None):
+    """
+    Returns (key move, {defence: white's second move}), or None.
+    """
+    solution = solve_mate_in_n(board, 3, verbose, transposition_table)
+    return (solution.move, solution_to_solutions_dict(solution)) if solution is not None else None
+
+def solve_mate_in_four(board, verbose=True, transposition_table=None):
+    """
+    Returns (key move, {defence: (white's second move, {defence: white's third move})}), or None.
+    """
+    solution = solve_mate_in_n(board, 4, verbose, transposition_table)
+    return (solution.move, solution_to_solutions_doubled_dict(solution)) if solution is not None else None
+
 def get_helpmate_solution_string(step1, step2, step3, step4, board):
     board2 = board.make_move(step1)
     board3 = board2.make_move(step2)
     board4 = board3.make_move(step3)
+    # Only the last move mates.
     return "1. {} {} 2. {} {}".format(
-        get_move_string(step1, board), get_move_string(step2, board2),
-        get_move_string(step3, board3), get_move_string(step4, board4))
+        get_move_string(step1, board, False), get_move_string(step2, board2, False),
+        get_move_string(step3, board3, False), get_move_string(step4, board4, True))
     
-def solve_helpmate_in_two(board, num_solutions=1):
+def solve_helpmate_in_two(board, num_solutions=1, verbose=True, stats=None, on_event=None, cancel_token=None,
+                          leaf_evaluator=get_mating_lines):
+    """
+    Returns the list of solution strings found, at most num_solutions of them.
+    A SearchStats given as stats gets a timeline span for every first move tried.
+    on_event gets a SolverEvent for every first move tried and every solution found.
+    Raises SearchCancelled once cancel_token is cancelled.
+    The last two moves after every second move are tested for mate together, by leaf_evaluator.
+    """
     assert board.turn == BLACK
-    print board
-    print
+    if verbose:
+        print board
+        print
+    initial_board = board.copy()
     solutions = []
     for step1 in board.get_all_legal_moves():
-        print_working_on_step(get_move_string(step1, board))
-        board2 = board.make_move(step1)
-        for step2 in board2.get_all_legal_moves():
-            print "  Working on step2: 1...", get_move_string(step2, board2)
-            board3 = board2.make_move(step2)
-            for step3 in board3.get_all_legal_moves():
-                board4 = board3.make_move(step3)
-                for step4 in board4.get_all_legal_moves():
-                    board5 = board4.make_move(step4)
-                    if board5.is_mate():
-                        solution = get_helpmate_solution_string(step1, step2, step3, step4, board)
+        if verbose:
+            print_working_on_step(get_move_string(step1, board))
+        if stats is not None:
+            stats.begin("key", step1, board)
+        emit_event(on_event, CANDIDATE_STARTED, board, step1)
+        num_step1_solutions = 0
+        board.push(step1)
+        for step2 in board.get_all_legal_moves():
+            if verbose:
+                print "  Working on step2: 1...", get_move_string(step2, board)
+            if cancel_token is not None:
+                cancel_token.check(board)
+            board.push(step2)
+            lines = []
+            for step3 in board.get_all_legal_moves():
+                if cancel_token is not None:
+                    cancel_token.check(board)
+                board.push(step3)
+                lines += [(step3, step4) for step4 in board.get_checking_moves()]
+                board.pop()
+            for (step3, step4), mates in zip(lines, leaf_evaluator(board, lines)):
+                if mates:
+                    solution = get_helpmate_solution_string(step1, step2, step3, step4, initial_board)
+                    solutions.append(solution)
+                    num_step1_solutions += 1
+                    if verbose:
                         print "  Success!!! Solution:", solution
-                        solutions.append(solution)
-                        if len(solutions) == num_solutions:
+                    if on_event is not None:
+                        on_event(SolverEvent(SOLUTION_FOUND, step1, get_move_string(step1, initial_board),
+                                             solution=solution, nodes=board.num_nodes))
+                    if len(solutions) == num_solutions:
+                        for _ in xrange(2):
+                            board.pop()
+                        if stats is not None:
+                            stats.end(board, "solution")
+                        emit_event(on_event, CANDIDATE_SOLVED, board, step1)
+                        if verbose:
                             print "\nAll solutions were found!\n"
                             for i, solution in enumerate(solutions):
                                 print "  Solution #{} is: {}".format(i+1, solution)
                             print
-                            return
+                        return solutions
+            board.pop()
+        board.pop()
+        if stats is not None:
+            stats.end(board)
+        emit_event(on_event, CANDIDATE_SOLVED if num_step1_solutions else CANDIDATE_REFUTED, board, step1)
     
-    print "\nFound following solutions:\n"
-    for i, solution in enumerate(solutions):
-        print "  Solution #{} is: {}".format(i+1, solution)
-
-    print_didnt_solve()
+    if verbose:
+        print "\nFound following solutions:\n"
+        for i, solution in enumerate(solutions):
+            print "  Solution #{} is: {}".format(i+1, solution)
 
-def solve_selfmate_in_two(board):
+        print_didnt_solve()
+    
+    return solutions
+
+def get_selfmate_continuations(board, first_only=True, cancel_token=None):
+    """
+    White's moves on board, after black's defence, that force black to mate: every black reply mates
+    and white doesn't mate black. Stops at the first one when first_only.
+    """
+    continuations = []
+    for step3 in board.iter_legal_moves(): # White move
+        if cancel_token is not None:
+            cancel_token.check(board)
+        board.push(step3)
+        forces_mate = board.has_any_legal_move() and \
+                      all(move_gives_mate(board, step4) for step4 in board.iter_legal_moves())
+        board.pop()
+        if forces_mate: # Every black move mates, and a mate on black was not made.
+            continuations.append(step3)
+            if first_only:
+                break
+    return continuations
+
+def solve_selfmate_in_two(board, verbose=True, stats=None, on_event=None, cancel_token=None,
+                          mate_flags_evaluator=get_mate_stalemate_flags):
+    """
+    Returns (key move, {black defence: white's second move}), or None.
+    The black defences after every key are tested for mate and stalemate on white together, by
+    mate_flags_evaluator.
+    A SearchStats given as stats gets a timeline span for every key tried.
+    on_event gets a SolverEvent for every key tried. Raises SearchCancelled once cancel_token is cancelled.
+    """
     assert board.turn == WHITE
-    print board
-    print
+    if verbose:
+        print board
+        print
     for step1 in board.get_all_legal_moves(): # White move
-        step_string = get_move_string(step1, board)
-        print_working_on_step(step_string)
-        board2 = board.make_move(step1)
-        black_moves1 = board2.get_all_legal_moves()
+        if verbose:
+            step_string = get_move_string(step1, board)
+            print_working_on_step(step_string)
+        if stats is not None:
+            stats.begin("key", step1, board)
+        emit_event(on_event, CANDIDATE_STARTED, board, step1)
+        board.push(step1)
+        black_moves1 = board.get_all_legal_moves()
         if black_moves1 == []: # We don't want mate on black.
-            print "  This is a mate move. Continue."
+            if verbose:
+                print "  This is a mate move. Continue."
+            board.pop()
+            if stats is not None:
+                stats.end(board, "mate")
+            emit_event(on_event, CANDIDATE_REFUTED, board, step1)
             continue
         solutions_dict = {}
         found = False
-        for step2 in black_moves1: # Black move
-            board3 = board2.make_move(step2)
-            white_moves = board3.get_all_legal_moves()
-            if white_moves == []: # We don't want mate on white.
+        mates, stalemates = mate_flags_evaluator(board, black_moves1)
+        for step2, mate, stalemate in zip(black_moves1, mates, stalemates): # Black move
+            if cancel_token is not None:
+                cancel_token.check(board)
+            if mate or stalemate: # We don't want mate on white.
                 continue
-            found2 = False
-            for step3 in white_moves: # White move
-                board4 = board3.make_move(step3)
-                black_moves2 = board4.get_all_legal_moves()
-                if black_moves2 == []: # We don't want mate on black.
-                    continue
-                if [step4 for step4 in black_moves2 if not board4.make_move(step4).is_mate()] == []:
-                    solutions_dict[step2] = step3
-                    found2 = True
-                    break
+            board.push(step2)
+            continuations = get_selfmate_continuations(board, cancel_token=cancel_token)
+            found2 = bool(continuations)
+            if found2:
+                solutions_dict[step2] = continuations[0]
+            board.pop()
             if not found2:
-                print_can_handle_with_step(step2, board2)
+                if verbose:
+                    print_can_handle_with_step(step2, board)
+                refutation = step2
                 found = True
                 break
         
         if not found:
-            print_success(step_string)
-            print_solutions(solutions_dict, board2)
-            return
+            if verbose:
+                print_success(step_string)
+                print_solutions(solutions_dict, board)
+            board.pop()
+            if stats is not None:
+                stats.end(board, "solution")
+            emit_event(on_event, CANDIDATE_SOLVED, board, step1)
+            return step1, solutions_dict
+        board.pop()
+        if stats is not None:
+            stats.end(board, "refuted")
+        emit_event(on_event, CANDIDATE_REFUTED, board, step1, refutation)
     
-    print_didnt_solve()
-
+    if verbose:
+        print_didnt_solve()
+    
+    return None
@@ -0,0 +1,190 @@
+import Queue
+import threading
+import time
+
+from Solver import *
+
+
+class SolveResult(object):
+    """
+    Outcome of solve(), the same for every etude type:
+    solved: whether the key was found, or num_solutions helpmate solutions.
+    key, key_string: the key move, or None, as for every helpmate.
+    solution: the MateSolution of a mate-in-N, the (key, {defence: move}) of a selfmate, or None.
+    solutions: the helpmate solution strings found, or the key string alone for the other types.
+    cancelled: whether the search was stopped before it finished, and stop_reason why: "cancelled",
+    "max_nodes" or "time_limit". The partial result of a stopped search is then:
+    refuted: (candidate, refutation) strings of the candidates proven not to work, the refutation
+    being None for a stalemate, a mate on the wrong side or a helpmate first move without solutions.
+    unresolved: the candidates neither refuted nor solved.
+    completed_depth: the deepest number of moves a mate-in-N search proved no candidate mates within,
+    short of N, or 0, and depth_refutations the (candidate, refutation) strings at that depth, the
+    refutation None for a stalemate or a mate in one missed.
+    """
+
+    def __init__(self, etude_type):
+        self.type = etude_type
+        self.solved = False
+        self.key = None
+        self.key_string = None
+        self.solution = None
+        self.solutions = []
+        self.cancelled = False
+        self.stop_reason = None
+        self.refuted = []
+        self.unresolved = []
+        self.completed_depth = 0
+        self.depth_refutations = []
+        self.nodes = 0
+        self.wall_time = 0.0
+
+    def __repr__(self):
+        status = self.stop_reason if self.cancelled else "solved" if self.solved else "not solved"
+        return "SolveResult: {} {}, {} nodes in {:.2f} s{}".format(
+            self.type, status, self.nodes, self.wall_time,
+            "".join(", " + solution for solution in self.solutions))
+
+def solve(board, etude_type, num_solutions=1, on_event=None, cancel_token=None, transposition_table=None,
+          max_nodes=None, time_limit=None):
+    """
+    Solves board as etude_type (mate_in_<N>, selfmate or helpmate) without printing anything.
+    on_event gets a SolverEvent for every candidate tried, every solution found, and a last FINISHED
+    event with the result. Once cancel_token is cancelled, or the search has pushed max_nodes moves or
+    run for time_limit seconds, the search stops at its next check and the partial result is returned
+    with cancelled set, and board back in its starting position.
+    Returns a SolveResult.
+    """
+    result = SolveResult(etude_type)
+    if max_nodes is not None or time_limit is not None:
+        cancel_token = SearchBudget(max_nodes, time_limit, cancel_token)
+    # Named only when the search stops before resolving them.
+    candidates = board.get_all_legal_moves()
+    resolved_candidates = set()
+    helpmate_solutions = []
+
+    def record_event(event):
+        if event.kind == CANDIDATE_REFUTED:
+            result.refuted.append((event.move_string, event.refutation_string))
+            resolved_candidates.add(move_to_tuple(event.move))
+        elif event.kind == CANDIDATE_SOLVED:
+            resolved_candidates.add(move_to_tuple(event.move))
+        elif event.kind == SOLUTION_FOUND:
+            helpmate_solutions.append(event.solution)
+        elif event.kind == DEPTH_COMPLETED:
+            result.completed_depth = event.depth
+            result.depth_refutations = event.refutations
+        if on_event is not None:
+            on_event(event)
+
+    num_pushed = len(board.undo_stack)
+    start_nodes = board.num_nodes
+    start_time = time.time()
+    n = get_mate_in_n(etude_type)
+    try:
+        if cancel_token is not None:
+            # Starts the node count of a SearchBudget here, rather than at the first check of the search.
+            cancel_token.check(board)
+        if n is not None:
+            solution = solve_mate_in_n(board, n, False, transposition_table, on_event=record_event,
+                                       cancel_token=cancel_token)
+            if solution is not None:
+                result.key = solution.move
+                result.solution = solution
+        elif etude_type == "selfmate":
+            selfmate_solution = solve_selfmate_in_two(board, False, on_event=record_event, cancel_token=cancel_token)
+            if selfmate_solution is not None:
+                result.key = selfmate_solution[0]
+                result.solution = selfmate_solution
+        elif etude_type == "helpmate":
+            solve_helpmate_in_two(board, num_solutions, False, on_event=record_event, cancel_token=cancel_token)
+        else:
+            raise ValueError("Invalid etude type: {}".format(etude_type))
+    except SearchCancelled:
+        result.cancelled = True
+        result.stop_reason = cancel_token.stop_reason or "cancelled"
+        while len(board.undo_stack) > num_pushed:
+            board.pop()
+    if etude_type == "helpmate":
+        result.solutions = helpmate_solutions
+        result.solved = len(helpmate_solutions) == num_solutions
+    if result.cancelled:
+        result.unresolved = [get_move_string(move, board) for move in candidates
+                             if move_to_tuple(move) not in resolved_candidates]
+    if result.key is not None:
+        result.solved = True
+        result.key_string = get_move_string(result.key, board)
+        result.solutions = [result.key_string]
+    result.nodes = board.num_nodes - start_nodes
+    result.wall_time = time.time() - start_time
+    if on_event is not None:
+        on_event(SolverEvent(FINISHED, result.key, result.key_string, solution=result, nodes=board.num_nodes))
+    return result
+
+def _solve_to_queue(events, *args):
+    # Thread target of iter_solve: an error ends the events too, and is raised by the generator.
+    try:
+        solve(*args)
+    except Exception, e:
+        events.put(e)
+
+def iter_solve(board, etude_type, num_solutions=1, transposition_table=None, max_nodes=None, time_limit=None):
+    """
+    Generator form of solve(): yields its SolverEvents as they happen, the last one FINISHED with the
+    SolveResult as its solution. The search runs on a thread of its own, and is cancelled when the
+    generator is closed or dropped before it finishes, as well as at the budgets of solve().
+    """
+    events = Queue.Queue()
+    cancel_token = CancellationToken()
+    thread = threading.Thread(target=_solve_to_queue, args=(events, board, etude_type, num_solutions, events.put,
+                                                            cancel_token, transposition_table, max_nodes,
+                                                            time_limit))
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            # A timeout keeps the wait interruptible by KeyboardInterrupt.
+            try:
+                event = events.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if isinstance(event, Exception):
+                raise event
+            yield event
+            if event.kind == FINISHED:
+                break
+    finally:
+        cancel_token.cancel()
+        thread.join()
+
+def print_event(event):
+    if event.kind != FINISHED:
+        print event
+
+def print_solve_result(result):
+    if result.cancelled:
+        print "\nStopped at the {} after {} nodes in {:.2f} s.\n".format(
+            result.stop_reason.replace("_", " "), result.nodes, result.wall_time)
+        for candidate, refutation in result.refuted:
+            print "  Refuted: 1. {}{}".format(candidate, " by 1... " + refutation if refutation is not None else "")
+        print "  Unresolved:", ", ".join(result.unresolved) or "none"
+        if result.completed_depth:
+            print "  No mate in {}:".format(result.completed_depth)
+            unresolved = set(result.unresolved)
+            for candidate, refutation in result.depth_refutations:
+                if candidate in unresolved:
+                    print "    1. {}{}".format(candidate, " by 1... " + refutation if refutation is not None else "")
+        if result.type == "helpmate":
+            for i, solution in enumerate(result.solutions):
+                print "  Solution #{} is: {}".format(i+1, solution)
+        print
+    elif result.type == "helpmate":
+        print
+        for i, solution in enumerate(result.solutions):
+            print "  Solution #{} is: {}".format(i+1, solution)
+        print
+        if not result.solved:
+            print_didnt_solve()
+    elif result.solved:
+        print_success(result.key_string)
+    else:
+        print_didnt_solve()
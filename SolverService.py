@@ -0,0 +1,204 @@
+import BaseHTTPServer
+import SocketServer
+import collections
+import json
+import multiprocessing
+import threading
+import time
+import urllib2
+
+from Batch import solve_problem
+from Solver import encode_position
+from ProblemDatabase import fen_to_board, type_to_stipulation
+
+DEFAULT_PORT = 8765
+DEFAULT_LRU_SIZE = 10000
+# Latencies kept for the metrics percentiles.
+NUM_LATENCIES = 1000
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+def make_service_problem(request):
+    """
+    Problem of a solve request, {"fen": ..., "type": ..., "num_solutions": ...}, in the form of
+    Batch.solve_problem, and the key it's coalesced and cached by. Raises ValueError for a bad request.
+    """
+    if not isinstance(request, dict) or "fen" not in request or "type" not in request:
+        raise ValueError("Expected a JSON object with fen and type.")
+    type_to_stipulation(request["type"])
+    num_solutions = int(request.get("num_solutions", 1))
+    board = fen_to_board(request["fen"])
+    problem = {"fen": request["fen"], "type": request["type"], "num_solutions": num_solutions}
+    # The position as the solver sees it, so that FENs differing only in their move counters share a key.
+    return problem, (encode_position(board), request["type"], num_solutions)
+
+def get_percentiles(values):
+    values = sorted(values)
+    return dict(("p{}".format(percentile), values[min(len(values) - 1, len(values) * percentile // 100)]
+                 if values else 0.0) for percentile in LATENCY_PERCENTILES)
+
+
+def solve_service_problem(problem):
+    """
+    Batch.solve_problem that always returns a result, one with the error when it raises outside of its
+    search, e.g. opening the solution cache, so that the requests waiting for it are answered.
+    """
+    start_time = time.time()
+    try:
+        return solve_problem(problem)
+    except Exception, e:
+        return dict(problem, error="{}: {}".format(e.__class__.__name__, e), wall_time=time.time() - start_time)
+
+
+class PendingSolve(object):
+    """
+    A problem sent to the pool, waited for by every request for it that came in meanwhile.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SolverService(object):
+    """
+    Solves problems on a pool of worker processes started once, so a request doesn't pay for the
+    interpreter start-up and imports. Identical requests in flight share one solve, and the results
+    of the last lru_size problems are kept in memory to answer repeats at once.
+    """
+
+    def __init__(self, jobs=1, lru_size=DEFAULT_LRU_SIZE, cache_filename=None, board="mailbox"):
+        self.pool = multiprocessing.Pool(jobs)
+        self.lru_size = lru_size
+        self.cache_filename = cache_filename
+        self.board = board
+        self.lock = threading.Lock()
+        self.results = collections.OrderedDict() # Least recently used first.
+        self.pending = {}
+        self.num_requests = 0
+        self.num_lru_hits = 0
+        self.num_coalesced = 0
+        self.num_solves = 0
+        self.num_errors = 0
+        self.latencies = collections.deque(maxlen=NUM_LATENCIES)
+        self.solve_times = collections.deque(maxlen=NUM_LATENCIES)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def solve(self, request):
+        """
+        JSON-ready result of Batch.solve_problem for a solve request, with "source" telling whether it
+        came from the LRU, another request in flight or a solve of its own.
+        """
+        start_time = time.time()
+        problem, key = make_service_problem(request)
+        with self.lock:
+            self.num_requests += 1
+            if key in self.results:
+                self.num_lru_hits += 1
+                result = self.results.pop(key)
+                self.results[key] = result
+                source = "lru"
+            elif key in self.pending:
+                self.num_coalesced += 1
+                pending = self.pending[key]
+                source = "coalesced"
+            else:
+                pending = self.pending[key] = PendingSolve()
+                self.submit(problem, key, pending)
+                source = "solver"
+        if source != "lru":
+            pending.done.wait()
+            result = pending.result
+        with self.lock:
+            self.latencies.append(time.time() - start_time)
+        return dict(result, source=source)
+
+    def submit(self, problem, key, pending):
+        # Called with the lock held.
+        self.num_solves += 1
+        problem = dict(problem, board=self.board)
+        if self.cache_filename:
+            problem["cache_filename"] = self.cache_filename
+
+        def finish(result):
+            with self.lock:
+                del self.pending[key]
+                self.solve_times.append(result["wall_time"])
+                if "error" in result:
+                    self.num_errors += 1
+                else:
+                    self.results[key] = result
+                    while len(self.results) > self.lru_size:
+                        self.results.popitem(last=False)
+            pending.result = result
+            pending.done.set()
+
+        self.pool.apply_async(solve_service_problem, (problem,), callback=finish)
+
+    def get_metrics(self):
+        with self.lock:
+            return {"requests": self.num_requests,
+                    "lru_hits": self.num_lru_hits,
+                    "coalesced": self.num_coalesced,
+                    "solves": self.num_solves,
+                    "errors": self.num_errors,
+                    # Problems sent to the pool and not done yet, queued or being solved.
+                    "queue_depth": len(self.pending),
+                    "lru_entries": len(self.results),
+                    "latency": get_percentiles(self.latencies),
+                    "solve_time": get_percentiles(self.solve_times)}
+
+
+class SolverRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    POST /solve with a JSON solve request answers its result, GET /metrics the service metrics.
+    """
+
+    def do_POST(self):
+        if self.path != "/solve":
+            return self.send_json(404, {"error": "Unknown path: {}".format(self.path)})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+            result = self.server.service.solve(request)
+        except ValueError, e:
+            return self.send_json(400, {"error": str(e)})
+        self.send_json(200, result)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            return self.send_json(404, {"error": "Unknown path: {}".format(self.path)})
+        self.send_json(200, self.server.service.get_metrics())
+
+    def send_json(self, status, response):
+        body = json.dumps(response, sort_keys=True)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class SolverServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server of a SolverService, a thread per connection.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, SolverRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+def request_solution(fen, etude_type, num_solutions=1, host="localhost", port=DEFAULT_PORT):
+    """
+    Client side: the result of a SolverServer for a position.
+    """
+    request = json.dumps({"fen": fen, "type": etude_type, "num_solutions": num_solutions})
+    return json.load(urllib2.urlopen("http://{}:{}/solve".format(host, port), request))
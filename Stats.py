@@ -0,0 +1,117 @@
+import json
+import sys
+import time
+
+import Solver
+
+# Instrumented phases, and the Board methods and Solver functions timed as each of them.
+# Times are inclusive: a legal move generation includes the pushes and check tests it makes.
+PHASES = ["movegen", "make_move", "check", "mate", "san"]
+BOARD_METHODS = [("get_all_legal_moves", "movegen"),
+                 ("get_all_player_legal_moves_no_check", "movegen"),
+                 ("has_any_legal_move", "movegen"),
+                 ("get_checking_moves", "movegen"),
+                 ("push", "make_move"),
+                 ("pop", "make_move"),
+                 ("make_move", "make_move"),
+                 ("is_player_in_check", "check"),
+                 ("is_mate", "mate"),
+                 ("has_check_evasion", "mate")]
+SOLVER_FUNCTIONS = [("move_gives_mate", "mate"),
+                    ("get_move_string", "san")]
+
+
+class SearchStats(object):
+    """
+    Call counts and time per search phase, and a timeline of the root candidates (key moves) and their
+    defences in Chrome trace-event format (chrome://tracing, Perfetto).
+
+    install() wraps the Board methods and Solver functions of every phase with counting ones, and
+    uninstall() puts the originals back, so nothing is added to the search when stats are off.
+    The solvers mark the timeline spans through begin() and end() when given a SearchStats.
+    """
+
+    def __init__(self):
+        self.calls = dict((phase, 0) for phase in PHASES)
+        self.times = dict((phase, 0.0) for phase in PHASES)
+        self.active = dict((phase, 0) for phase in PHASES)
+        self.trace_events = []
+        self.open_spans = []
+        self.originals = []
+        self.start_time = time.time()
+        self.get_move_string = Solver.get_move_string
+
+    def timed(self, phase, function):
+        calls, times, active = self.calls, self.times, self.active
+        clock = time.time
+
+        def timed_function(*args, **kwargs):
+            # Only the outermost call of a phase is counted, e.g. move_gives_mate calls is_mate.
+            if active[phase]:
+                return function(*args, **kwargs)
+            calls[phase] += 1
+            active[phase] = 1
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times[phase] += clock() - start
+                active[phase] = 0
+
+        timed_function.__name__ = function.__name__
+        return timed_function
+
+    def install(self):
+        assert not self.originals
+        # Board subclasses, such as BitBoard, have their own versions of some of the methods.
+        for board_class in [Solver.Board] + Solver.Board.__subclasses__():
+            for name, phase in BOARD_METHODS:
+                if name in board_class.__dict__:
+                    original = board_class.__dict__[name]
+                    self.originals.append((board_class, name, original))
+                    setattr(board_class, name, self.timed(phase, original))
+        for name, phase in SOLVER_FUNCTIONS:
+            original = getattr(Solver, name)
+            timed_function = self.timed(phase, original)
+            # Modules that did "from Solver import *" hold their own reference to the function.
+            for module in sys.modules.values():
+                if module is not None and getattr(module, name, None) is original:
+                    self.originals.append((module, name, original))
+                    setattr(module, name, timed_function)
+
+    def uninstall(self):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def begin(self, category, move, board):
+        """
+        Opens a timeline span for move, about to be played on board.
+        """
+        self.open_spans.append((category, self.get_move_string(move, board), time.time(), board.num_nodes,
+                                dict(self.calls)))
+
+    def end(self, board, result=None):
+        """
+        Closes the last span opened, with the nodes and phase calls made since it opened.
+        """
+        category, name, start_time, start_nodes, start_calls = self.open_spans.pop()
+        args = dict((phase, self.calls[phase] - start_calls[phase]) for phase in PHASES)
+        args["nodes"] = board.num_nodes - start_nodes
+        if result is not None:
+            args["result"] = result
+        self.trace_events.append({"name": name, "cat": category, "ph": "X", "pid": 1, "tid": 1,
+                                  "ts": int((start_time - self.start_time) * 1e6),
+                                  "dur": int((time.time() - start_time) * 1e6),
+                                  "args": args})
+
+    def write_trace(self, filename):
+        json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, open(filename, "w"))
+
+    def __str__(self):
+        lines = ["Search stats (inclusive times):"]
+        for phase in PHASES:
+            calls = self.calls[phase]
+            lines.append("  {:<10} {:>10} calls {:>9.3f} s {:>8.2f} us/call".format(
+                phase, calls, self.times[phase], 1e6 * self.times[phase] / calls if calls else 0.0))
+        return "\n".join(lines)
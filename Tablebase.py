@@ -0,0 +1,370 @@
+import array
+import collections
+import itertools
+import mmap
+import os
+import struct
+import time
+
+from Solver import *
+
+# An endgame tablebase holds, for every position of one material signature (e.g. KQvK, white king and
+# queen against the black king) with either side to move, the number of plies to white's mate with best
+# play: white mating as soon as it can, and black holding out as long as it can. Only white's mates are
+# kept, as the mate-in-N solvers only ask whether white mates; NO_MATE stands for everything else.
+#
+# The tables are built by retrograde analysis over the Board rules, back from the mates: a position with
+# white to move is won in p plies once one of its moves leads to a position won in p - 1, and a position
+# with black to move once all of its moves lead to won positions, the longest in p - 1. Captures and
+# promotions lead into the tables of other signatures, which are built first.
+#
+# A tablebase file is a header (magic, signature) followed by one byte per position, at
+#
+#   index = turn + 2 * (square of piece 0 + 64 * square of piece 1 + 64 ** 2 * square of piece 2 ...)
+#
+# with squares numbered from 0 (a1) to 63 (h8), and the pieces in signature order: white's, then black's,
+# each side's king first and pieces of the same type in increasing square order. Illegal positions and
+# the other orders of pieces of the same type are NO_MATE, and never probed.
+TABLEBASE_EXTENSION = ".etb"
+DEFAULT_TABLEBASE_DIR = "tablebases"
+TABLEBASE_MAGIC = "ETUDETB1"
+TABLEBASE_HEADER = struct.Struct("<8s16s")
+NO_MATE = 255
+
+# Piece types in signature order.
+SIGNATURE_PIECES = [KING, QUEEN, ROOK, BISHOP, KNIGHT, PAWN]
+# Sort key of a piece code in signature order.
+CODE_ORDER = dict((piece_code(piece, player), (player == BLACK, SIGNATURE_PIECES.index(piece)))
+                  for player in PLAYERS for piece in SIGNATURE_PIECES)
+SQUARE_TO_INDEX = dict((square, i) for i, square in enumerate(SQUARES))
+
+
+def parse_signature(signature):
+    """
+    Piece codes of a signature such as KQvK or KRvKP, in signature order. Raises ValueError for a bad one.
+    """
+    sides = signature.upper().split("V")
+    if len(sides) != 2:
+        raise ValueError("Invalid material signature: {}".format(signature))
+    codes = []
+    for player, side in zip([WHITE, BLACK], sides):
+        pieces = [char.lower() for char in side]
+        if pieces.count(KING) != 1 or any(piece not in SIGNATURE_PIECES for piece in pieces):
+            raise ValueError("Invalid material signature: {}".format(signature))
+        codes += [piece_code(piece, player) for piece in sorted(pieces, key=SIGNATURE_PIECES.index)]
+    return codes
+
+def get_signature(codes):
+    # Signature of piece codes in signature order.
+    return "v".join(''.join(TYPE_CODE_TO_PIECE[code & TYPE_MASK].upper() for code in codes
+                            if code_to_player(code) == player) for player in [WHITE, BLACK])
+
+def encode_pieces(pieces, turn):
+    """
+    (signature, index) of the position of pieces, (piece code, square) pairs in any order, with turn to move.
+    """
+    pieces = sorted(pieces, key=lambda (code, square): (CODE_ORDER[code], square))
+    index = 0
+    for _, square in reversed(pieces):
+        index = index * 64 + SQUARE_TO_INDEX[square]
+    return get_signature([code for code, _ in pieces]), turn + 2 * index
+
+def get_board_pieces(board):
+    squares = board.squares
+    return [(squares[square], square) for square in SQUARES if squares[square] != EMPTY_CODE]
+
+def get_board_signature(board):
+    return get_signature(sorted([code for code, _ in get_board_pieces(board)], key=CODE_ORDER.get))
+
+def get_successor_signatures(codes):
+    # Signatures a capture or a promotion leads to from a position of the piece codes.
+    signatures = set()
+    for i, code in enumerate(codes):
+        if code & TYPE_MASK != KING_CODE:
+            signatures.add(get_signature(codes[:i] + codes[i+1:]))
+        if code & TYPE_MASK == PAWN_CODE:
+            for piece in POSSIBLE_PROMOTIONS:
+                promoted = codes[:i] + codes[i+1:] + [piece_code(piece, code_to_player(code))]
+                signatures.add(get_signature(sorted(promoted, key=CODE_ORDER.get)))
+    return signatures
+
+def is_bare_king_signature(signature):
+    # White can't check, let alone mate, with its king alone.
+    return signature.startswith("Kv")
+
+
+class Tablebase(object):
+    """
+    Read-only access to a tablebase file through mmap, so only the positions probed are read in.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as tablebase_file:
+            self.data = mmap.mmap(tablebase_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, signature = TABLEBASE_HEADER.unpack_from(self.data, 0)
+        if magic != TABLEBASE_MAGIC:
+            raise ValueError("Not a tablebase: {}".format(filename))
+        self.signature = signature.rstrip("\0")
+
+    def close(self):
+        self.data.close()
+
+    def __getitem__(self, index):
+        return ord(self.data[TABLEBASE_HEADER.size + index])
+
+
+class TablebaseSet(object):
+    """
+    The tablebases of a directory, opened as they're first probed. probe() answers search_mate for the
+    positions of the signatures covered, those of the tablebases and those where white has its king alone.
+    """
+
+    def __init__(self, directory=DEFAULT_TABLEBASE_DIR):
+        self.directory = directory
+        self.signatures = set(filename[:-len(TABLEBASE_EXTENSION)] for filename in os.listdir(directory)
+                              if filename.endswith(TABLEBASE_EXTENSION)) if os.path.isdir(directory) else set()
+        self.tablebases = {}
+        # Pieces of the largest signature, kings included: boards with more are never probed.
+        self.max_pieces = max([len(signature) - 1 for signature in self.signatures] or [0])
+        self.probes = 0
+        self.hits = 0
+
+    def get_filename(self, signature):
+        return os.path.join(self.directory, signature + TABLEBASE_EXTENSION)
+
+    def add(self, signature):
+        # signature's tablebase was just written to the directory.
+        self.signatures.add(signature)
+        self.max_pieces = max(self.max_pieces, len(signature) - 1)
+
+    def is_covered(self, signature):
+        return signature in self.signatures or is_bare_king_signature(signature)
+
+    def get_value(self, signature, index):
+        """
+        Plies to white's mate of position index of signature, NO_MATE, or None when signature isn't covered.
+        """
+        if is_bare_king_signature(signature):
+            return NO_MATE
+        if signature not in self.tablebases:
+            if signature not in self.signatures:
+                return None
+            self.tablebases[signature] = Tablebase(self.get_filename(signature))
+        return self.tablebases[signature][index]
+
+    def get_board_value(self, board):
+        return self.get_value(*encode_pieces(get_board_pieces(board), board.turn))
+
+    def probe(self, board, depth):
+        """
+        As TranspositionTable.probe: (True, MateSolution or None) for white to move on a board of a covered
+        signature, mating within depth moves or not, and (False, None) otherwise.
+        """
+        self.probes += 1
+        if board.turn != WHITE:
+            return False, None
+        plies = self.get_board_value(board)
+        if plies is None:
+            return False, None
+        self.hits += 1
+        if plies == NO_MATE or (plies + 1) // 2 > depth:
+            return True, None
+        return True, TablebaseSolution(board, self, plies)
+
+    def get_mating_move(self, board, plies):
+        # A move of white on board, won in plies, keeping the shortest mate.
+        for move in board.get_all_legal_moves():
+            board.push(move)
+            value = self.get_board_value(board)
+            board.pop()
+            if value == plies - 1:
+                return move
+        raise ValueError("Inconsistent tablebases in {}".format(self.directory))
+
+    def close(self):
+        for tablebase in self.tablebases.itervalues():
+            tablebase.close()
+        self.tablebases = {}
+
+    def __str__(self):
+        return "Tablebases: {} signatures in {}, {} probes, {} hits".format(
+            len(self.signatures), self.directory, self.probes, self.hits)
+
+
+class TablebaseSolution(MateSolution):
+    """
+    MateSolution of a position won in a tablebase. Its defences are read off the tables when first asked
+    for, so a probe costs the key's lookups rather than the whole solution tree.
+    """
+    __slots__ = ["position", "tablebases", "plies", "solution_defences"]
+
+    def __init__(self, board, tablebases, plies):
+        self.position = encode_position(board)
+        self.tablebases = tablebases
+        self.plies = plies
+        self.move = tablebases.get_mating_move(board, plies)
+        self.solution_defences = None
+
+    @property
+    def defences(self):
+        if self.solution_defences is None:
+            board = decode_position(self.position)
+            board.push(self.move)
+            self.solution_defences = {}
+            for defence in board.get_all_legal_moves():
+                board.push(defence)
+                self.solution_defences[defence] = TablebaseSolution(board, self.tablebases,
+                                                                    self.tablebases.get_board_value(board))
+                board.pop()
+        return self.solution_defences
+
+    def depth(self):
+        return (self.plies + 1) // 2
+
+def build_tablebase(codes, tablebases):
+    """
+    bytearray of the plies to white's mate of every position of the piece codes, in signature order.
+    The positions that captures and promotions lead to are looked up in tablebases.
+    Returns (values, number of legal positions).
+    """
+    signature = get_signature(codes)
+    num_pieces = len(codes)
+    size = 2 * 64 ** num_pieces
+    values = bytearray([NO_MATE]) * size
+    # Black to move: moves not yet known to lose within the table, -1 when one doesn't lose.
+    remaining = array.array('i', [0]) * size
+    # Black to move: the longest mate among the moves known to lose.
+    longest = bytearray(size)
+    # Moves between two positions of the table, (from, to), to be turned into predecessor lists.
+    edges_from = array.array('i')
+    edges_to = array.array('i')
+    buckets = collections.defaultdict(list) # Positions by the plies they're won in, to be confirmed.
+    # Index weight of every piece. Pieces of the same type are kept in square order by encode_pieces,
+    # but a move of one of them may change that order, so then the index is computed again.
+    weights = [2 * 64 ** i for i in xrange(num_pieces)]
+    has_same_types = len(set(codes)) < num_pieces
+    empty_mailbox = [OFF_BOARD] * MAILBOX_SIZE
+    for square in SQUARES:
+        empty_mailbox[square] = EMPTY_CODE
+    num_positions = 0
+
+    for piece_indices in itertools.product(xrange(64), repeat=num_pieces):
+        if len(set(piece_indices)) < num_pieces:
+            continue
+        piece_squares = [SQUARES[i] for i in piece_indices]
+        if any(code & TYPE_MASK == PAWN_CODE and square_row(square) in (MIN_ROW, MAX_ROW)
+               for code, square in zip(codes, piece_squares)):
+            continue
+        if any(codes[i] == codes[i - 1] and piece_indices[i] < piece_indices[i - 1] for i in xrange(1, num_pieces)):
+            continue
+        mailbox = empty_mailbox[:]
+        for code, square in zip(codes, piece_squares):
+            mailbox[square] = code
+        square_to_piece = dict((square, i) for i, square in enumerate(piece_squares))
+        for turn in PLAYERS:
+            board = Board.from_squares(mailbox[:], turn)
+            if board.is_player_in_check(next_turn(turn)):
+                continue
+            num_positions += 1
+            index = turn + sum(weight * piece_index for weight, piece_index in zip(weights, piece_indices))
+            shortest = NO_MATE
+            num_internal = 0
+            moves = board.get_all_legal_moves()
+            for move in moves:
+                if mailbox[move.new_square] == EMPTY_CODE and not move.promotion_to_piece and not has_same_types:
+                    edges_from.append(index)
+                    edges_to.append((index ^ 1) + weights[square_to_piece[move.old_square]] *
+                                    (SQUARE_TO_INDEX[move.new_square] - SQUARE_TO_INDEX[move.old_square]))
+                    num_internal += 1
+                    continue
+                pieces = [(code, square) for code, square in zip(codes, piece_squares)
+                          if square not in (move.old_square, move.new_square)]
+                moved = piece_code(move.promotion_to_piece, turn) if move.promotion_to_piece else \
+                        mailbox[move.old_square]
+                successor_signature, successor_index = encode_pieces(pieces + [(moved, move.new_square)],
+                                                                     next_turn(turn))
+                if successor_signature == signature:
+                    edges_from.append(index)
+                    edges_to.append(successor_index)
+                    num_internal += 1
+                    continue
+                value = tablebases.get_value(successor_signature, successor_index)
+                assert value is not None, "No tablebase for " + successor_signature
+                if turn == WHITE:
+                    shortest = min(shortest, value)
+                elif value == NO_MATE:
+                    remaining[index] = -1
+                else:
+                    longest[index] = max(longest[index], value)
+            if turn == WHITE:
+                if shortest != NO_MATE:
+                    buckets[shortest + 1].append(index)
+            elif not moves:
+                if board.is_in_check():
+                    buckets[0].append(index)
+                else:
+                    remaining[index] = -1
+            elif remaining[index] == 0:
+                remaining[index] = num_internal
+                if num_internal == 0:
+                    buckets[longest[index] + 1].append(index)
+
+    # Predecessor lists: the positions with a move to position i are predecessors[starts[i]:starts[i + 1]].
+    starts = array.array('i', [0]) * (size + 1)
+    for to_index in edges_to:
+        starts[to_index + 1] += 1
+    for i in xrange(size):
+        starts[i + 1] += starts[i]
+    predecessors = array.array('i', [0]) * len(edges_to)
+    filled = array.array('i', starts)
+    for from_index, to_index in itertools.izip(edges_from, edges_to):
+        predecessors[filled[to_index]] = from_index
+        filled[to_index] += 1
+    del edges_from, edges_to, filled
+
+    # The positions are confirmed in order of plies, so that every one is confirmed with its shortest mate.
+    plies = 0
+    while buckets:
+        for index in buckets.pop(plies, []):
+            if values[index] != NO_MATE:
+                continue
+            assert plies < NO_MATE
+            values[index] = plies
+            for predecessor in predecessors[starts[index]:starts[index + 1]]:
+                if values[predecessor] != NO_MATE:
+                    continue
+                if predecessor & 1 == WHITE:
+                    buckets[plies + 1].append(predecessor)
+                elif remaining[predecessor] > 0:
+                    remaining[predecessor] -= 1
+                    longest[predecessor] = max(longest[predecessor], plies)
+                    if remaining[predecessor] == 0:
+                        buckets[longest[predecessor] + 1].append(predecessor)
+        plies += 1
+    return values, num_positions
+
+def write_tablebase(filename, signature, values):
+    output = open(filename, "wb")
+    output.write(TABLEBASE_HEADER.pack(TABLEBASE_MAGIC, signature))
+    output.write(values)
+    output.close()
+
+def generate_tablebase(signature, tablebases, verbose=True):
+    """
+    Builds the tablebase of signature into the directory of tablebases, after those of the signatures
+    its captures and promotions lead to that aren't there yet.
+    """
+    codes = parse_signature(signature)
+    signature = get_signature(codes)
+    for successor_signature in sorted(get_successor_signatures(codes)):
+        if not tablebases.is_covered(successor_signature):
+            generate_tablebase(successor_signature, tablebases, verbose)
+    start_time = time.time()
+    values, num_positions = build_tablebase(codes, tablebases)
+    write_tablebase(tablebases.get_filename(signature), signature, values)
+    tablebases.add(signature)
+    if verbose:
+        white_wins = [plies for plies in values[1::2] if plies != NO_MATE]
+        print "{}: {} positions, {} won with white to move, longest mate in {} moves, {:.1f} s".format(
+            signature, num_positions, len(white_wins), (max(white_wins or [-1]) + 1) // 2, time.time() - start_time)
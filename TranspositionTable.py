@@ -0,0 +1,62 @@
+DEFAULT_SIZE_MB = 64
+
+# Rough cost of one stored entry: the entry tuple, its hash and the bucket slot pointing at it.
+ENTRY_SIZE_BYTES = 128
+
+
+class TranspositionTable(object):
+    """
+    Solved sub-results keyed by (Zobrist hash, side to move, remaining depth).
+    Every bucket has two slots: a depth-preferred slot that keeps the deepest (most expensive) result,
+    and an always-replace slot that keeps the most recent one.
+
+    A result is a proven mate (any value but None) or a proven no-mate (None). A mate within some depth
+    is also a mate within any greater depth, and no mate within some depth means no mate within any
+    smaller one, so probes are answered from entries of other depths too.
+    """
+
+    def __init__(self, size_mb=DEFAULT_SIZE_MB):
+        self.num_buckets = max(1, int(size_mb * 2 ** 20) // (2 * ENTRY_SIZE_BYTES))
+        self.depth_preferred = [None] * self.num_buckets
+        self.always_replace = [None] * self.num_buckets
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def probe(self, zobrist_hash, turn, depth):
+        """
+        Returns (True, result) for a stored result, (False, None) otherwise.
+        """
+        self.probes += 1
+        index = zobrist_hash % self.num_buckets
+        for entry in (self.depth_preferred[index], self.always_replace[index]):
+            if entry is not None and entry[0] == zobrist_hash and entry[1] == turn:
+                entry_depth, result = entry[2], entry[3]
+                if entry_depth == depth or (entry_depth < depth and result is not None) or \
+                   (entry_depth > depth and result is None):
+                    self.hits += 1
+                    return True, result
+        return False, None
+
+    def store(self, zobrist_hash, turn, depth, result):
+        self.stores += 1
+        index = zobrist_hash % self.num_buckets
+        entry = (zobrist_hash, turn, depth, result)
+        current = self.depth_preferred[index]
+        if current is None or depth >= current[2]:
+            self.depth_preferred[index] = entry
+            if current is not None and current[:3] != entry[:3]:
+                self.always_replace[index] = current
+        else:
+            self.always_replace[index] = entry
+
+    def hit_rate(self):
+        return float(self.hits) / self.probes if self.probes else 0.0
+
+    def __len__(self):
+        return sum(1 for entry in self.depth_preferred if entry is not None) + \
+               sum(1 for entry in self.always_replace if entry is not None)
+
+    def __str__(self):
+        return "Transposition table: {} probes, {} hits ({:.1%}), {} stores, {} entries in {} buckets".format(
+            self.probes, self.hits, self.hit_rate(), self.stores, len(self), self.num_buckets)
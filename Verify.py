@@ -0,0 +1,159 @@
+import sys
+
+from Solver import *
+
+# Verification proves the whole key set of a problem instead of stopping at the first key, and lists
+# every continuation after each defence of every key, so that cooks (keys beyond the first) and duals
+# (defences met by more than one continuation) are found. A directmate's candidates all share one
+# transposition table and move ordering, so the refutations and mates proven for one are reused by
+# the next, and the continuation searches mostly hit positions the key search already proved.
+
+
+class KeyVerification(object):
+    """
+    A key proven to work: depth is the number of moves it mates in (selfmates always 2), and
+    continuations lists (defence, [every move that still works after it]). For a directmate those
+    are the moves of the shortest mate left, as a longer mate next to a shorter one isn't a dual.
+    A defence that mates or stalemates at once has no continuations.
+    """
+
+    def __init__(self, move, depth):
+        self.move = move
+        self.depth = depth
+        self.continuations = []
+
+    def get_duals(self):
+        return [(defence, moves) for defence, moves in self.continuations if len(moves) > 1]
+
+
+class VerificationResult(object):
+    """
+    The keys of a directmate or selfmate, or the solutions of a helpmate, with what the stipulation
+    calls for: one key without duals, or exactly num_solutions helpmate solutions.
+    """
+
+    def __init__(self, etude_type, num_solutions=1):
+        self.type = etude_type
+        self.num_solutions = num_solutions
+        self.keys = []
+        self.solutions = []
+        self.num_nodes = 0
+
+    def get_cooks(self):
+        return self.keys[1:]
+
+    def is_sound(self):
+        if self.type == "helpmate":
+            return len(self.solutions) == self.num_solutions
+        return len(self.keys) == 1 and not self.keys[0].get_duals()
+
+def get_shortest_mating_keys(board, max_depth, transposition_table, move_ordering=None):
+    """
+    Every move of the side to move on board that mates in the fewest moves possible, up to max_depth.
+    """
+    moves = board.get_all_legal_moves()
+    for depth in xrange(1, max_depth + 1):
+        keys = [key for key in moves
+                if search_defences(board, key, depth, transposition_table, move_ordering) is not None]
+        if keys:
+            return keys
+    return []
+
+def verify_mate_in_n(board, n, transposition_table=None, move_ordering=None):
+    """
+    Proves every key of a mate in n, with its shortest mate, and every continuation of each defence.
+    Returns a VerificationResult.
+    """
+    assert board.turn == WHITE
+    if transposition_table is None:
+        transposition_table = TranspositionTable()
+    if move_ordering is None:
+        move_ordering = MoveOrdering()
+    result = VerificationResult("{}{}".format(MATE_IN_PREFIX, n))
+    start_nodes = board.num_nodes
+    # The shallower searches first, as solve_mate_in_n does, leave their results for the deeper ones.
+    for depth in xrange(1, n):
+        search_mate(board, depth, transposition_table, move_ordering)
+    for key in board.get_all_legal_moves():
+        for depth in xrange(1, n + 1):
+            if search_defences(board, key, depth, transposition_table, move_ordering) is not None:
+                result.keys.append(KeyVerification(key, depth))
+                break
+    for key_verification in result.keys:
+        board.push(key_verification.move)
+        if key_verification.depth > 1:
+            for defence in board.get_all_legal_moves():
+                board.push(defence)
+                key_verification.continuations.append(
+                    (defence, get_shortest_mating_keys(board, key_verification.depth - 1, transposition_table,
+                                                       move_ordering)))
+                board.pop()
+        board.pop()
+    result.num_nodes = board.num_nodes - start_nodes
+    return result
+
+def verify_selfmate_in_two(board):
+    """
+    Proves every key of a selfmate in two, and every white second move after each black defence.
+    Returns a VerificationResult.
+    """
+    assert board.turn == WHITE
+    result = VerificationResult("selfmate")
+    start_nodes = board.num_nodes
+    for step1 in board.get_all_legal_moves():
+        board.push(step1)
+        continuations = []
+        is_key = board.has_any_legal_move() # We don't want mate on black.
+        for step2 in board.get_all_legal_moves() if is_key else []:
+            board.push(step2)
+            if board.has_any_legal_move(): # We don't want mate on white.
+                step3s = get_selfmate_continuations(board, first_only=False)
+                continuations.append((step2, step3s))
+                is_key = bool(step3s)
+            board.pop()
+            if not is_key:
+                break
+        board.pop()
+        if is_key:
+            key_verification = KeyVerification(step1, 2)
+            key_verification.continuations = continuations
+            result.keys.append(key_verification)
+    result.num_nodes = board.num_nodes - start_nodes
+    return result
+
+def verify_helpmate_in_two(board, num_solutions=1):
+    """
+    Finds every solution of a helpmate in two, to compare with the num_solutions it should have.
+    Returns a VerificationResult.
+    """
+    result = VerificationResult("helpmate", num_solutions)
+    start_nodes = board.num_nodes
+    # No problem has this many solutions, so the search goes through the whole tree.
+    result.solutions = solve_helpmate_in_two(board, sys.maxint, verbose=False)
+    result.num_nodes = board.num_nodes - start_nodes
+    return result
+
+def print_verification(result, board):
+    if result.type == "helpmate":
+        print "Found {} solutions, {} expected:\n".format(len(result.solutions), result.num_solutions)
+        for i, solution in enumerate(result.solutions):
+            print "  Solution #{} is: {}".format(i+1, solution)
+    elif not result.keys:
+        print "No key."
+    else:
+        for i, key_verification in enumerate(result.keys):
+            print "{}: 1. {}{}".format("Key" if i == 0 else "Cook", get_move_string(key_verification.move, board),
+                                       " (mate in {})".format(key_verification.depth)
+                                       if result.type != "selfmate" else "")
+            board.push(key_verification.move)
+            for defence, moves in key_verification.continuations:
+                defence_string = get_move_string(defence, board)
+                board.push(defence)
+                print "    1... {:<8} {}{}".format(defence_string,
+                                                  ", ".join("2. " + get_move_string(move, board) for move in moves),
+                                                  "  (dual)" if len(moves) > 1 else "")
+                board.pop()
+            board.pop()
+    print
+    print "Sound." if result.is_sound() else "Not sound."
+    print "Nodes searched:", result.num_nodes
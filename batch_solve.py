@@ -0,0 +1,48 @@
+import json
+import multiprocessing
+import os
+import sys
+
+from Batch import read_problems, solve_problem
+from SolutionCache import DEFAULT_CACHE_FILENAME
+from Tablebase import DEFAULT_TABLEBASE_DIR
+from optparse import OptionParser
+
+
+def Main():
+    parser = OptionParser(usage="%prog [options] <etudes directory, manifest file or problem database>")
+    parser.add_option("-o", "--output_filename", help="JSON lines output file, standard output by default.")
+    parser.add_option("-j", "--jobs", default=multiprocessing.cpu_count(), type=int,
+                      help="Worker processes, one problem each at a time.")
+    parser.add_option("-t", "--type", help="Only solve the problems of this etude type.")
+    parser.add_option("--cache_filename", default=DEFAULT_CACHE_FILENAME,
+                      help="SQLite file of the solutions kept across runs.")
+    parser.add_option("--no_cache", "--no-cache", action="store_true", default=False,
+                      help="Neither read nor update the solution cache.")
+    parser.add_option("--tablebase_dir", default=DEFAULT_TABLEBASE_DIR,
+                      help="Endgame tablebases of make_tablebase.py, probed by the mate-in-N searches.")
+
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Expected one etudes directory, manifest file or problem database.")
+
+    problems = read_problems(args[0], options.type)
+    if not options.no_cache:
+        problems = (dict(problem, cache_filename=options.cache_filename) for problem in problems)
+    if os.path.isdir(options.tablebase_dir):
+        problems = (dict(problem, tablebase_dir=options.tablebase_dir) for problem in problems)
+    output = open(options.output_filename, "w") if options.output_filename else sys.stdout
+
+    if options.jobs > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        results = pool.imap_unordered(solve_problem, problems)
+    else:
+        results = (solve_problem(problem) for problem in problems)
+
+    # Every result is written as soon as its problem is solved.
+    for result in results:
+        output.write(json.dumps(result, sort_keys=True) + "\n")
+        output.flush()
+
+if __name__ == '__main__':
+    Main()
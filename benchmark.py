@@ -0,0 +1,172 @@
+import json
+import multiprocessing
+import os
+import resource
+import sys
+
+from Batch import read_problems, solve_problem
+from BitBoard import BOARD_CLASSES
+from optparse import OptionParser
+
+GOLDEN_ANSWERS_FILENAME = "golden_answers.json"
+DEFAULT_THRESHOLD = 0.1
+# Metrics where a larger value is a regression.
+COMPARED_METRICS = ["nodes", "wall_time", "peak_memory_mb"]
+# Wall times below this many seconds are too noisy to compare.
+MIN_COMPARED_WALL_TIME = 0.1
+
+
+def benchmark_problem(problem):
+    """
+    Solves one problem and returns its key (or helpmate solutions), nodes, nodes/sec, wall time and
+    peak memory. Meant to run in a fresh process, since the peak memory is that of the whole process.
+    """
+    result = solve_problem(problem)
+    result.pop("solution", None)
+    if "nodes" in result:
+        result["nodes_per_sec"] = result["nodes"] / result["wall_time"] if result["wall_time"] else 0.0
+    # ru_maxrss is in KB on Linux.
+    result["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return result
+
+def read_golden_answers(filename):
+    """
+    Expected answers by etude file name: {"key": ...} or, for helpmates, {"solutions": [...]}.
+    An answer may also give the "type" of an etude whose file name doesn't tell it.
+    """
+    if filename is None or not os.path.exists(filename):
+        return {}
+    return json.load(open(filename))
+
+def check_answer(result, golden_answers):
+    """
+    True when the result matches its golden answer, False when it doesn't or the problem failed with an
+    error, and None when there's no golden answer. Helpmate solutions are compared as a set.
+    """
+    if "error" in result:
+        return False
+    expected = golden_answers.get(os.path.basename(result["input_filename"]))
+    if expected is None:
+        return None
+    if "solutions" in expected:
+        return sorted(result.get("solutions", [])) == sorted(expected["solutions"])
+    return result.get("key") == expected["key"]
+
+def get_totals(results):
+    nodes = sum(result.get("nodes", 0) for result in results)
+    wall_time = sum(result["wall_time"] for result in results)
+    return {"nodes": nodes,
+            "wall_time": wall_time,
+            "nodes_per_sec": nodes / wall_time if wall_time else 0.0,
+            "peak_memory_mb": max([result["peak_memory_mb"] for result in results] or [0.0]),
+            "num_problems": len(results),
+            "num_correct": sum(1 for result in results if result["correct"]),
+            "num_wrong": sum(1 for result in results if result["correct"] is False and "error" not in result),
+            "num_errors": sum(1 for result in results if "error" in result)}
+
+def compare_results(results, baseline_results, threshold):
+    """
+    Returns the lines describing every regression against the baseline: an error, a wrong answer, or a
+    compared metric more than threshold (a fraction) above its baseline value.
+    """
+    baseline_by_filename = dict((os.path.basename(result["input_filename"]), result)
+                                for result in baseline_results)
+    regressions = []
+    for result in results:
+        filename = os.path.basename(result["input_filename"])
+        if "error" in result:
+            regressions.append("{}: error {}".format(filename, result["error"]))
+        elif result["correct"] is False:
+            regressions.append("{}: wrong answer".format(filename))
+        baseline = baseline_by_filename.get(filename)
+        if baseline is None:
+            continue
+        for metric in COMPARED_METRICS:
+            value, baseline_value = result.get(metric), baseline.get(metric)
+            if value is None or not baseline_value:
+                continue
+            if metric == "wall_time" and max(value, baseline_value) < MIN_COMPARED_WALL_TIME:
+                continue
+            change = float(value) / baseline_value - 1
+            if change > threshold:
+                regressions.append("{}: {} {:.6g} -> {:.6g} ({:+.1%})".format(
+                    filename, metric, baseline_value, value, change))
+    return regressions
+
+def print_result(result):
+    if "error" in result:
+        status = "ERROR " + result["error"]
+    else:
+        status = {True: "OK", False: "WRONG", None: "no golden answer"}[result["correct"]]
+    print "{:<40} {:>10} nodes {:>9.1f} s {:>10.0f} nodes/s {:>7.1f} MB  {}".format(
+        os.path.basename(result["input_filename"]), result.get("nodes", 0), result["wall_time"],
+        result.get("nodes_per_sec", 0.0), result["peak_memory_mb"], status)
+    sys.stdout.flush()
+
+def Main():
+    parser = OptionParser(usage="%prog [options] [<etudes directory or manifest file>]")
+    parser.add_option("-o", "--output_filename", help="JSON results file.")
+    parser.add_option("-g", "--golden_answers",
+                      help="Expected answers JSON, {} next to the etudes by default.".format(
+                          GOLDEN_ANSWERS_FILENAME))
+    parser.add_option("-c", "--compare", metavar="BASELINE",
+                      help="JSON results file of an earlier run to check for regressions against.")
+    parser.add_option("--threshold", default=DEFAULT_THRESHOLD, type=float,
+                      help="Relative increase in nodes, wall time or peak memory that is a regression.")
+    parser.add_option("--board", type="choice", choices=sorted(BOARD_CLASSES), default="mailbox",
+                      help="Board implementation to solve with.")
+    parser.add_option("-j", "--jobs", default=1, type=int,
+                      help="Worker processes. More than one makes the wall times less comparable.")
+
+    options, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error("Expected at most one etudes directory or manifest file.")
+    path = args[0] if args else "etudes"
+
+    golden_answers_filename = options.golden_answers
+    if golden_answers_filename is None:
+        golden_answers_filename = os.path.join(path if os.path.isdir(path) else os.path.dirname(path),
+                                               GOLDEN_ANSWERS_FILENAME)
+    golden_answers = read_golden_answers(golden_answers_filename)
+
+    problems = list(read_problems(path))
+    for problem in problems:
+        problem["board"] = options.board
+        if problem["type"] is None:
+            problem["type"] = golden_answers.get(os.path.basename(problem["input_filename"]), {}).get("type")
+    # A fresh process per problem, so that every peak memory is the problem's own.
+    pool = multiprocessing.Pool(options.jobs, maxtasksperchild=1)
+    results = []
+    for result in pool.imap(benchmark_problem, problems):
+        result["correct"] = check_answer(result, golden_answers)
+        print_result(result)
+        results.append(result)
+    pool.close()
+    pool.join()
+
+    totals = get_totals(results)
+    print
+    print "Total: {nodes} nodes in {wall_time:.1f} s, {nodes_per_sec:.0f} nodes/s, " \
+          "{num_correct} of {num_problems} correct, {num_wrong} wrong, {num_errors} errors".format(**totals)
+
+    if options.output_filename:
+        json.dump({"problems": results, "totals": totals}, open(options.output_filename, "w"),
+                  indent=4, sort_keys=True, separators=(",", ": "))
+
+    # Errors and wrong answers fail the run even without a baseline to compare against.
+    regressions = [] if totals["num_wrong"] + totals["num_errors"] == 0 else \
+        ["{} wrong answers, {} errors".format(totals["num_wrong"], totals["num_errors"])]
+    if options.compare:
+        baseline_results = json.load(open(options.compare))["problems"]
+        regressions = compare_results(results, baseline_results, options.threshold)
+        print
+        if regressions:
+            print "Regressions against {} (threshold {:.0%}):".format(options.compare, options.threshold)
+            for regression in regressions:
+                print "  " + regression
+        else:
+            print "No regressions against {}.".format(options.compare)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,85 @@
+import random
+
+from BitBoard import BitBoard
+from Batch import read_problems
+from Solver import *
+from optparse import OptionParser
+
+
+def cross_check_position(board, bit_board):
+    """
+    Returns the description of the first difference between the two boards' legal moves, check,
+    escape test and hash, or between the legal moves and the checking moves and check evasions of
+    board, or None.
+    """
+    moves = sorted(board.get_all_legal_moves(), key=move_to_tuple)
+    bit_board_moves = bit_board.get_all_legal_moves()
+    if moves != sorted(bit_board_moves, key=move_to_tuple):
+        return "legal moves {} != {}".format(moves, sorted(bit_board_moves, key=move_to_tuple))
+    if list(bit_board.iter_legal_moves()) != bit_board_moves:
+        return "iter_legal_moves differs from get_all_legal_moves"
+    if board.is_in_check() != bit_board.is_in_check():
+        return "is_in_check {} != {}".format(board.is_in_check(), bit_board.is_in_check())
+    if board.has_any_legal_move() != bit_board.has_any_legal_move():
+        return "has_any_legal_move {} != {}".format(board.has_any_legal_move(), bit_board.has_any_legal_move())
+    if board.zobrist_hash != bit_board.zobrist_hash:
+        return "zobrist hash differs"
+    checking_moves = [move for move in moves if board.make_move(move).is_in_check()]
+    if sorted(board.get_checking_moves(), key=move_to_tuple) != checking_moves:
+        return "checking moves {} != {}".format(sorted(board.get_checking_moves(), key=move_to_tuple),
+                                                 checking_moves)
+    if board.is_in_check() and board.has_check_evasion() != board.has_any_legal_move():
+        return "has_check_evasion {} != {}".format(board.has_check_evasion(), board.has_any_legal_move())
+    if board.is_in_check() and bit_board.has_check_evasion() != board.has_any_legal_move():
+        return "bit board has_check_evasion {} != {}".format(bit_board.has_check_evasion(),
+                                                             board.has_any_legal_move())
+    return None
+
+def cross_check_etude(input_filename, num_walks, max_plies, rnd):
+    """
+    Plays random games from the etude, with either side to move first, on a Board and a BitBoard
+    together. Returns (number of positions checked, first difference or None).
+    """
+    num_positions = 0
+    for turn in PLAYERS:
+        board = read_board(input_filename, turn)
+        bit_board = read_board(input_filename, turn, BitBoard)
+        for _ in xrange(num_walks):
+            plies = 0
+            while True:
+                num_positions += 1
+                difference = cross_check_position(board, bit_board)
+                if difference is not None:
+                    return num_positions, "{}\n{}".format(difference, board)
+                moves = board.get_all_legal_moves()
+                if not moves or plies == max_plies:
+                    break
+                move = rnd.choice(moves)
+                board.push(move)
+                bit_board.push(move)
+                plies += 1
+            for _ in xrange(plies):
+                board.pop()
+                bit_board.pop()
+    return num_positions, None
+
+def Main():
+    parser = OptionParser(usage="%prog [options] [<etudes directory or manifest file>]")
+    parser.add_option("--walks", default=30, type=int, help="Random games per etude and side to move.")
+    parser.add_option("--plies", default=12, type=int, help="Length of every random game.")
+    parser.add_option("--seed", default=0, type=int)
+
+    options, args = parser.parse_args()
+    rnd = random.Random(options.seed)
+    total_positions = 0
+    num_differences = 0
+    for problem in read_problems(args[0] if args else "etudes"):
+        num_positions, difference = cross_check_etude(problem["input_filename"], options.walks, options.plies, rnd)
+        total_positions += num_positions
+        if difference is not None:
+            num_differences += 1
+            print "{}: {}".format(problem["input_filename"], difference)
+    print "{} positions checked, {} etudes with differences.".format(total_positions, num_differences)
+
+if __name__ == '__main__':
+    Main()
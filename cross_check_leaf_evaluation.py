@@ -0,0 +1,84 @@
+import random
+
+import LeafEvaluation
+from Batch import read_problems
+from Solver import *
+from optparse import OptionParser
+
+
+def get_two_move_lines(board):
+    """
+    Every (move, reply) line from board, the lines sharing their first move one after the other.
+    """
+    lines = []
+    for move in board.get_all_legal_moves():
+        board.push(move)
+        lines.extend((move, reply) for reply in board.get_all_legal_moves())
+        board.pop()
+    return lines
+
+def cross_check_position(board):
+    """
+    Returns the description of the first difference between the one at a time and the NumPy leaf
+    evaluators on board: the mate and stalemate flags of its legal moves, or the mates of its two-move
+    lines. Or None.
+    """
+    moves = board.get_all_legal_moves()
+    flags = get_mate_stalemate_flags(board, moves)
+    numpy_flags = LeafEvaluation.get_mate_stalemate_flags_numpy(board, moves)
+    if flags != numpy_flags:
+        return "mate and stalemate flags {} != {} of {}".format(flags, numpy_flags, moves)
+    lines = get_two_move_lines(board)
+    mates = get_mating_lines(board, lines)
+    numpy_mates = LeafEvaluation.get_mating_lines_numpy(board, lines)
+    if mates != numpy_mates:
+        return "mating lines {} != {}".format([line for line, mate in zip(lines, mates) if mate],
+                                              [line for line, mate in zip(lines, numpy_mates) if mate])
+    return None
+
+def cross_check_etude(input_filename, num_walks, max_plies, rnd):
+    """
+    Plays random games from the etude, with either side to move first, and cross-checks the leaf
+    evaluators on every position. Returns (number of positions checked, first difference or None).
+    """
+    num_positions = 0
+    for turn in PLAYERS:
+        board = read_board(input_filename, turn)
+        for _ in xrange(num_walks):
+            plies = 0
+            while True:
+                num_positions += 1
+                difference = cross_check_position(board)
+                if difference is not None:
+                    return num_positions, "{}\n{}".format(difference, board)
+                moves = board.get_all_legal_moves()
+                if not moves or plies == max_plies:
+                    break
+                board.push(rnd.choice(moves))
+                plies += 1
+            for _ in xrange(plies):
+                board.pop()
+    return num_positions, None
+
+def Main():
+    parser = OptionParser(usage="%prog [options] [<etudes directory or manifest file>]")
+    parser.add_option("--walks", default=5, type=int, help="Random games per etude and side to move.")
+    parser.add_option("--plies", default=12, type=int, help="Length of every random game.")
+    parser.add_option("--seed", default=0, type=int)
+
+    options, args = parser.parse_args()
+    if LeafEvaluation.numpy is None:
+        parser.error("Needs NumPy installed.")
+    rnd = random.Random(options.seed)
+    total_positions = 0
+    num_differences = 0
+    for problem in read_problems(args[0] if args else "etudes"):
+        num_positions, difference = cross_check_etude(problem["input_filename"], options.walks, options.plies, rnd)
+        total_positions += num_positions
+        if difference is not None:
+            num_differences += 1
+            print "{}: {}".format(problem["input_filename"], difference)
+    print "{} positions checked, {} etudes with differences.".format(total_positions, num_differences)
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,79 @@
+import os
+import sys
+
+from Batch import read_problems
+from Solver import *
+from benchmark import GOLDEN_ANSWERS_FILENAME, read_golden_answers
+from optparse import OptionParser
+
+DEFAULT_MIN_MATE_IN_N = 3
+# Extra nodes of the threat search, as a fraction of those of the plain search, above which it's reported.
+DEFAULT_THRESHOLD = 0.25
+
+
+def solve_quietly(input_filename, mate_in_n, threats, verbose):
+    """
+    Solves the etude with or without the threat-first defence search. Returns (key, nodes), the key in SAN.
+    The verbose output is thrown away.
+    """
+    board = read_board(input_filename, WHITE)
+    stdout = sys.stdout
+    if verbose:
+        sys.stdout = open(os.devnull, "w")
+    try:
+        solution = solve_mate_in_n(board, mate_in_n, verbose, threats=threats)
+    finally:
+        sys.stdout = stdout
+    return get_move_string(solution.move, board), board.num_nodes
+
+def cross_check_etude(input_filename, mate_in_n, expected_key, threshold):
+    """
+    Returns the lines describing every difference of the threat-first search: a key other than the golden
+    one or that of the plain search, verbose and quiet node counts that differ, or too many extra nodes.
+    Also returns the (plain, threat-first) node counts.
+    """
+    key, nodes = solve_quietly(input_filename, mate_in_n, False, False)
+    threat_key, threat_nodes = solve_quietly(input_filename, mate_in_n, True, False)
+    verbose_key, verbose_nodes = solve_quietly(input_filename, mate_in_n, True, True)
+    differences = []
+    if threat_key != key or (expected_key is not None and threat_key != expected_key):
+        differences.append("key {} != {} (golden {})".format(threat_key, key, expected_key))
+    if verbose_key != threat_key or verbose_nodes != threat_nodes:
+        differences.append("verbose {} {} nodes != quiet {} {} nodes".format(verbose_key, verbose_nodes,
+                                                                           threat_key, threat_nodes))
+    if threat_nodes > nodes * (1 + threshold):
+        differences.append("{} nodes, {} without the threats".format(threat_nodes, nodes))
+    return differences, nodes, threat_nodes
+
+def Main():
+    parser = OptionParser(usage="%prog [options] [<etudes directory or manifest file>]")
+    parser.add_option("--min_n", default=DEFAULT_MIN_MATE_IN_N, type=int,
+                      help="Smallest N of the mate_in_<N> etudes to check.")
+    parser.add_option("--threshold", default=DEFAULT_THRESHOLD, type=float,
+                      help="Relative increase in nodes of the threat-first search that is reported.")
+
+    options, args = parser.parse_args()
+    path = args[0] if args else "etudes"
+    golden_answers = read_golden_answers(os.path.join(path if os.path.isdir(path) else os.path.dirname(path),
+                                                      GOLDEN_ANSWERS_FILENAME))
+    total_nodes = 0
+    total_threat_nodes = 0
+    num_differences = 0
+    for problem in read_problems(path):
+        mate_in_n = get_mate_in_n(problem["type"])
+        if mate_in_n is None or mate_in_n < options.min_n:
+            continue
+        filename = os.path.basename(problem["input_filename"])
+        expected_key = golden_answers.get(filename, {}).get("key")
+        differences, nodes, threat_nodes = cross_check_etude(problem["input_filename"], mate_in_n, expected_key,
+                                                             options.threshold)
+        total_nodes += nodes
+        total_threat_nodes += threat_nodes
+        print "{:<40} {:>10} nodes {:>10} with threats".format(filename, nodes, threat_nodes)
+        for difference in differences:
+            num_differences += 1
+            print "{}: {}".format(filename, difference)
+    print "{} nodes, {} with threats, {} differences.".format(total_nodes, total_threat_nodes, num_differences)
+
+if __name__ == '__main__':
+    Main()
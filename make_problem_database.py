@@ -0,0 +1,67 @@
+import sys
+
+from Batch import read_problems
+from ProblemDatabase import *
+from optparse import OptionParser
+
+FEN_EXTENSION = ".fen"
+
+
+def is_etude_type(field):
+    try:
+        type_to_stipulation(field)
+        return True
+    except ValueError:
+        return False
+
+def read_fen_records(filename):
+    """
+    Records of every line of a FEN file: <FEN> <type> [<number of solutions>].
+    Blank lines and lines starting with # are ignored.
+    """
+    records = []
+    for line_number, line in enumerate(open(filename).readlines(), 1):
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        # The FEN takes two to six fields, and is followed by the type.
+        type_fields = [i for i, field in enumerate(fields) if i >= 2 and is_etude_type(field)]
+        if not type_fields:
+            raise ValueError("{}:{}: expected <FEN> <type> [<number of solutions>]".format(filename, line_number))
+        i = type_fields[0]
+        num_solutions = int(fields[i + 1]) if len(fields) > i + 1 else 1
+        records.append(encode_record(fen_to_board(' '.join(fields[:i])), fields[i], num_solutions))
+    return records
+
+def read_etude_records(path):
+    # Records of the etude files of a directory or manifest, as batch_solve.py finds them.
+    records = []
+    for problem in read_problems(path):
+        if problem["type"] is None:
+            print >> sys.stderr, "Skipping {}: unknown etude type.".format(problem["input_filename"])
+            continue
+        board = read_board(problem["input_filename"], problem_turn(problem["type"]))
+        records.append(encode_record(board, problem["type"], problem["num_solutions"]))
+    return records
+
+def Main():
+    parser = OptionParser(usage="%prog [options] <output{}> <etudes directory, manifest or {} file>...".format(
+        DATABASE_EXTENSION, FEN_EXTENSION))
+
+    options, args = parser.parse_args()
+    if len(args) < 2 or not is_problem_database(args[0]):
+        parser.error("Expected an output {} file and at least one input.".format(DATABASE_EXTENSION))
+
+    records = []
+    for path in args[1:]:
+        records += read_fen_records(path) if path.endswith(FEN_EXTENSION) else read_etude_records(path)
+    write_problem_database(args[0], records)
+
+    database = ProblemDatabase(args[0])
+    print "Wrote {} problems to {}:".format(len(database), args[0])
+    for etude_type, count in database.get_types():
+        print "  {:<15} {}".format(etude_type, count)
+    database.close()
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,31 @@
+import os
+
+from Tablebase import *
+from optparse import OptionParser
+
+
+def Main():
+    parser = OptionParser(usage="%prog [options] <material signature, e.g. KQvK or KRvKP>...")
+    parser.add_option("-d", "--directory", default=DEFAULT_TABLEBASE_DIR,
+                      help="Tablebases directory, written with the tables the signatures need too.")
+
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("Expected at least one material signature.")
+    try:
+        signatures = [get_signature(parse_signature(signature)) for signature in args]
+    except ValueError, e:
+        parser.error(str(e))
+
+    if not os.path.isdir(options.directory):
+        os.makedirs(options.directory)
+    tablebases = TablebaseSet(options.directory)
+    for signature in signatures:
+        if tablebases.is_covered(signature):
+            print "{}: already in {}.".format(signature, options.directory)
+        else:
+            generate_tablebase(signature, tablebases)
+    tablebases.close()
+
+if __name__ == '__main__':
+    Main()
@@ -1,30 +1,162 @@
 from Solver import *
+from TranspositionTable import DEFAULT_SIZE_MB
+from ProofNumberSearch import solve_mate_in_n_pns, DEFAULT_MAX_NODES
+from ParallelSolver import solve_mate_in_n_parallel
+from Stats import SearchStats
+from BitBoard import BOARD_CLASSES
+from SolutionCache import *
+from ProblemDatabase import ProblemDatabase, is_problem_database
+from SolverApi import solve, print_event, print_solve_result
+import LeafEvaluation
+from Verify import *
+from Tablebase import TablebaseSet, DEFAULT_TABLEBASE_DIR
 from optparse import OptionParser
 
 
 def Main():
     parser = OptionParser()
-    parser.add_option("-i", "--input_filename")
-    parser.add_option("-t", "--type", type="choice", choices=["mate_in_2", "mate_in_3", "mate_in_4", "selfmate", "helpmate"])
-    parser.add_option("-n", "--num_solutions", default=1, type=int)
+    parser.add_option("-i", "--input_filename", help="Etude file, or problem database with --record.")
+    parser.add_option("--record", default=0, type=int,
+                      help="Problem number in a problem database, whose type and number of solutions are the defaults.")
+    parser.add_option("-t", "--type", help="mate_in_<N> for any N, selfmate or helpmate.")
+    parser.add_option("-n", "--num_solutions", type=int, help="1 by default.")
+    parser.add_option("--tt_size_mb", default=DEFAULT_SIZE_MB, type=float,
+                      help="Memory cap of the mate-in-N transposition table, in MB.")
+    parser.add_option("--engine", type="choice", choices=["dfs", "pns"], default="dfs",
+                      help="Mate-in-N search: depth-first (dfs) or proof-number search (pns).")
+    parser.add_option("--pns_max_nodes", default=DEFAULT_MAX_NODES, type=int,
+                      help="Node store limit of the proof-number search.")
+    parser.add_option("-j", "--jobs", default=1, type=int,
+                      help="Worker processes for the depth-first mate-in-N search.")
+    parser.add_option("--no_move_ordering", action="store_true", default=False,
+                      help="Search the depth-first mate-in-N moves in generation order, to measure the node savings.")
+    parser.add_option("--board", type="choice", choices=sorted(BOARD_CLASSES), default="mailbox",
+                      help="Board implementation: mailbox or bitboard. The -j workers always use mailbox.")
+    parser.add_option("--stats", action="store_true", default=False,
+                      help="Count calls and time in move generation, make move, check and mate tests and SAN.")
+    parser.add_option("--trace_filename",
+                      help="Chrome trace-event JSON timeline of the key candidates and defences, implies --stats.")
+    parser.add_option("--cache_filename", default=DEFAULT_CACHE_FILENAME,
+                      help="SQLite file of the solutions kept across runs.")
+    parser.add_option("--cache_size_mb", default=DEFAULT_CACHE_SIZE_MB, type=float,
+                      help="Size of the solution cache above which the least recently used solutions are evicted.")
+    parser.add_option("--no_cache", "--no-cache", action="store_true", default=False,
+                      help="Neither read nor update the solution cache.")
+    parser.add_option("--max_nodes", "--max-nodes", type=int,
+                      help="Stop the search after this many nodes and print what it proved so far. "
+                           "Bypasses the solution cache.")
+    parser.add_option("--time_limit", "--time-limit", type=float,
+                      help="Stop the search after this many seconds and print what it proved so far. "
+                           "Bypasses the solution cache.")
+    parser.add_option("--leaf_eval", type="choice", choices=sorted(LeafEvaluation.LEAF_EVALUATORS), default="python",
+                      help="Mate test of the helpmate leaves and the selfmate defences: one at a time (python) or in "
+                           "NumPy batches (numpy).")
+    parser.add_option("--verify", action="store_true", default=False,
+                      help="Prove every key (cooks) and every continuation after each defence (duals), or find "
+                           "every helpmate solution. Bypasses the solution cache.")
+    parser.add_option("--tablebase_dir", default=DEFAULT_TABLEBASE_DIR,
+                      help="Endgame tablebases of make_tablebase.py, probed by the serial dfs mate search.")
 
     options, _ = parser.parse_args()
+    budgeted = options.max_nodes is not None or options.time_limit is not None
+    if budgeted and (options.engine != "dfs" or options.jobs > 1):
+    	parser.error("--max_nodes and --time_limit only apply to the serial dfs search.")
+    if options.leaf_eval == "numpy" and LeafEvaluation.numpy is None:
+    	parser.error("--leaf_eval numpy needs NumPy installed.")
+    leaf_evaluator = LeafEvaluation.LEAF_EVALUATORS[options.leaf_eval]
+    mate_flags_evaluator = LeafEvaluation.MATE_FLAGS_EVALUATORS[options.leaf_eval]
 
-    board = read_board(options.input_filename)
+    board_class = BOARD_CLASSES[options.board]
+    if is_problem_database(options.input_filename):
+    	database = ProblemDatabase(options.input_filename)
+    	_, _, record_type, record_num_solutions = database.get_record(options.record)
+    	options.type = options.type or record_type
+    	if options.num_solutions is None:
+    		options.num_solutions = record_num_solutions
+    	read_problem_board = lambda turn: database.get_board(options.record, board_class)
+    else:
+    	read_problem_board = lambda turn: read_board(options.input_filename, turn, board_class)
+    if options.num_solutions is None:
+    	options.num_solutions = 1
+    board = read_problem_board(WHITE)
+    transposition_table = TranspositionTable(options.tt_size_mb)
+
+    n = get_mate_in_n(options.type)
+
+    stats = None
+    if options.stats or options.trace_filename:
+    	stats = SearchStats()
+    	stats.install()
 
-    if options.type == "mate_in_2":
-    	solve_mate_in_two(board)
-    elif options.type == "mate_in_3":
-    	solve_mate_in_three(board)
-    elif options.type == "mate_in_4":
-    	solve_mate_in_four(board)
+    cache = None if options.no_cache or budgeted or options.verify else \
+    	SolutionCache(options.cache_filename, options.cache_size_mb)
+
+    if options.verify and (n is not None or options.type in ("selfmate", "helpmate")):
+    	if options.type == "helpmate":
+    		board = read_problem_board(BLACK)
+    	print board
+    	print
+    	if n is not None:
+    		result = verify_mate_in_n(board, n, transposition_table)
+    	elif options.type == "selfmate":
+    		result = verify_selfmate_in_two(board)
+    	else:
+    		result = verify_helpmate_in_two(board, options.num_solutions)
+    	print_verification(result, board)
+    elif budgeted and (n is not None or options.type in ("selfmate", "helpmate")):
+    	if options.type == "helpmate":
+    		board = read_problem_board(BLACK)
+    	print board
+    	print
+    	result = solve(board, options.type, options.num_solutions, print_event, None, transposition_table,
+    	               options.max_nodes, options.time_limit)
+    	print_solve_result(result)
+    elif n is not None:
+    	def search(transposition_table):
+    		if options.engine == "pns":
+    			return solve_mate_in_n_pns(board, n, max_nodes=options.pns_max_nodes)
+    		elif options.jobs > 1:
+    			return solve_mate_in_n_parallel(board, n, options.jobs, tt_size_mb=options.tt_size_mb)
+    		tablebases = TablebaseSet(options.tablebase_dir)
+    		solution = solve_mate_in_n(board, n, transposition_table=transposition_table, stats=stats,
+    		                           move_ordering=MoveOrdering(not options.no_move_ordering),
+    		                           tablebases=tablebases if tablebases.signatures else None)
+    		if tablebases.signatures:
+    			print tablebases
+    		tablebases.close()
+    		print "Nodes searched:", board.num_nodes
+    		return solution
+    	if cache is None:
+    		search(transposition_table)
+    	else:
+    		solve_mate_in_n_cached(cache, board, n, search, transposition_table=transposition_table)
     elif options.type == "selfmate":
-    	solve_selfmate_in_two(board)
+    	search = lambda: solve_selfmate_in_two(board, stats=stats, mate_flags_evaluator=mate_flags_evaluator)
+    	if cache is None:
+    		search()
+    	else:
+    		solve_selfmate_in_two_cached(cache, board, search)
     elif options.type == "helpmate":
-    	board.turn = BLACK
-    	solve_helpmate_in_two(board, options.num_solutions)
+    	board = read_problem_board(BLACK)
+    	search = lambda: solve_helpmate_in_two(board, options.num_solutions, stats=stats,
+    	                                       leaf_evaluator=leaf_evaluator)
+    	if cache is None:
+    		search()
+    	else:
+    		solve_helpmate_in_two_cached(cache, board, options.num_solutions, search)
     else:
     	print "Invalid etude type:", options.type
 
+    if cache is not None:
+    	print cache
+    	cache.close()
+
+    if stats is not None:
+    	# Only this process is counted, not the workers of -j.
+    	stats.uninstall()
+    	print stats
+    	if options.trace_filename:
+    		stats.write_trace(options.trace_filename)
+
 if __name__ == '__main__':
     Main()
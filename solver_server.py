@@ -0,0 +1,42 @@
+import multiprocessing
+
+from BitBoard import BOARD_CLASSES
+from SolutionCache import DEFAULT_CACHE_FILENAME
+from SolverService import *
+from optparse import OptionParser
+
+
+def Main():
+    parser = OptionParser(usage="%prog [options]\n\n"
+                                "POST /solve {\"fen\": ..., \"type\": ..., \"num_solutions\": ...} solves a position, "
+                                "GET /metrics returns the request counts, queue depth and latency percentiles.")
+    parser.add_option("--host", default="localhost", help="Address to listen on, local only by default.")
+    parser.add_option("-p", "--port", default=DEFAULT_PORT, type=int)
+    parser.add_option("-j", "--jobs", default=multiprocessing.cpu_count(), type=int,
+                      help="Worker processes, one problem each at a time.")
+    parser.add_option("--lru_size", default=DEFAULT_LRU_SIZE, type=int,
+                      help="Results kept in memory to answer repeated positions.")
+    parser.add_option("--board", type="choice", choices=sorted(BOARD_CLASSES), default="mailbox",
+                      help="Board implementation to solve with.")
+    parser.add_option("--cache_filename", default=DEFAULT_CACHE_FILENAME,
+                      help="SQLite file of the solutions kept across runs.")
+    parser.add_option("--no_cache", "--no-cache", action="store_true", default=False,
+                      help="Neither read nor update the solution cache.")
+    parser.add_option("-v", "--verbose", action="store_true", default=False, help="Log every request.")
+
+    options, _ = parser.parse_args()
+
+    service = SolverService(options.jobs, options.lru_size, None if options.no_cache else options.cache_filename,
+                            options.board)
+    server = SolverServer((options.host, options.port), service, options.verbose)
+    print "Serving on http://{}:{} with {} workers.".format(options.host, options.port, options.jobs)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    Main()